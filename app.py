@@ -1,24 +1,41 @@
 import streamlit as st
 from utils.logger_config import get_logger
-from knowledge_graph.neo4j_load import connect_to_neo4j
-from query.vector_based_query import find_similar_problem, get_llm_diagnosis
-from query.graph_cypher_qa_chain import graph_qa_chain
-from sentence_transformers import SentenceTransformer
+from knowledge_graph.neo4j_load import connect_to_neo4j, connect_to_neo4j_async, get_graph_state
+from query.async_query import find_similar_problem_async, run_sync
+from query.vector_based_query import stream_llm_diagnosis
+from query.template_router import answer_question
+from query.retrievers import get_retriever
+from query.response_cache import get_response_cache
+from utils.model_registry import get_model, get_resource, warmup
+from utils import metrics
 import os
 
 logger = get_logger(name=__name__, log_file="query.log")
-model = SentenceTransformer("all-MiniLM-L6-v2")
+warmup()   # load the embedding model in the background on first start
 LLM = "gemma2-9b-it"
 
 api_key = os.getenv("groq_api_key")
  # Step 4: Connect to Neo4j
 try:
     logger.info("Connecting to Neo4j...")
-    graph, driver = connect_to_neo4j()
+    # Streamlit reruns this script on every interaction; the connection is made once per process
+    graph, driver = get_resource("neo4j", connect_to_neo4j)
     logger.info("Neo4j connection successful.")
     #print(graph.schema)
 except Exception as e:
     logger.error(f"Neo4j connection failed: {e}")
+    graph = driver = None
+
+retriever = get_resource("retriever", lambda: get_retriever(driver=driver))
+# Async driver for the vector path; its pool is shared by all sessions of this process
+async_driver = get_resource("neo4j_async", connect_to_neo4j_async)
+
+# Drop cached answers once ingestion has produced a new graph version
+if driver is not None:
+    try:
+        get_response_cache().sync_graph_version(get_graph_state(driver).get("version"))
+    except Exception as e:
+        logger.warning(f"Could not check graph version: {e}")
 
 
 
@@ -42,7 +59,8 @@ if st.button("Get Solution"):
             # Option 1: CypherQAChain
             if method.startswith("GraphCypherQAChain"):
                 try:
-                    response = graph_qa_chain(graph=graph, query=query, llm=LLM)
+                    with metrics.span("app.request", method="graph_qa"):
+                        response = answer_question(graph=graph, query=query, llm=LLM)
                     st.subheader("📊 Knowledge Graph Response")
                     st.success(response)
                     logger.info(f"GraphCypherQAChain response: {response}")
@@ -53,14 +71,29 @@ if st.button("Get Solution"):
             # Option 2: Vector search + LLM
             else:
                 try:
-                    problem_context = find_similar_problem(user_input=query, driver=driver, model=model)
-                    st.subheader("🔁 Similar Historical Problem")
-                    st.info(problem_context)
-                    logger.info("Successfully retrieved problem context.")
+                    with metrics.span("app.request", method="vector"):
+                        # Retrieval runs on the shared event loop, so concurrent sessions
+                        # share pooled Neo4j connections instead of blocking
+                        problem_context = run_sync(find_similar_problem_async(
+                            user_input=query, driver=async_driver, model=get_model(), retriever=retriever
+                        ))
+                        st.subheader("🔁 Similar Historical Problem")
+                        st.info(problem_context)
+                        logger.info("Successfully retrieved problem context.")
 
-                    llm_response = get_llm_diagnosis(user_input=query, problem_context=problem_context, api_key=api_key)
-                    st.subheader("🧠 LLM Diagnosis and Recommendations")
-                    st.write(llm_response)
+                        # The diagnosis is rendered token by token as it streams in
+                        st.subheader("🧠 LLM Diagnosis and Recommendations")
+                        stats = {}
+                        st.write_stream(stream_llm_diagnosis(
+                            user_input=query, problem_context=problem_context, api_key=api_key, stats=stats
+                        ))
+                        if stats.get("ttft_seconds") is not None and not stats.get("cached"):
+                            st.caption(f"First token after {stats['ttft_seconds']:.2f}s, "
+                                       f"{stats['tokens_per_sec']:.0f} tokens/s")
                 except Exception as e:
                     logger.error(f"Vector search or LLM diagnosis failed: {e}")
                     st.error(f"Analysis error: {e}")
+
+        # The app runs until the server stops, so refresh the export after every request
+        if metrics.enabled():
+            metrics.export()
@@ -0,0 +1,107 @@
+# ann_recall.py
+#
+# Recall and latency of the IVF index against the exact cosine_similarity path.
+#
+#   python -m benchmarks.ann_recall --column "problem reported" --replicate 50000
+
+import argparse
+import json
+import time
+
+import numpy as np
+import pandas as pd
+from sentence_transformers import SentenceTransformer
+
+from embedding_relation.ann_index import IVFIndex
+from embedding_relation.embedding_cache import get_embedding_cache
+from embedding_relation.similarity_graph import top_k_similar, normalize_rows
+
+MODEL_NAME = "all-MiniLM-L6-v2"
+EXACT_MATRIX_LIMIT = 20000   # above this the N x N cosine_similarity matrix is skipped
+
+
+def exact_edges_cosine_similarity(embeddings, top_k, threshold):
+    """The original process_node_type path: full matrix plus argsort per row."""
+    from sklearn.metrics.pairwise import cosine_similarity
+
+    sim_matrix = cosine_similarity(embeddings)
+    edges = set()
+    for i in range(len(embeddings)):
+        for j in np.argsort(sim_matrix[i])[::-1][1:top_k + 1]:
+            if sim_matrix[i][j] >= threshold:
+                edges.add((i, int(j)))
+    return edges
+
+
+def load_embeddings(csv_path, column, replicate, noise, seed):
+    texts = pd.read_csv(csv_path)[column].dropna().unique().tolist()
+    model = SentenceTransformer(MODEL_NAME)
+    embeddings = get_embedding_cache(MODEL_NAME, model.get_sentence_embedding_dimension()).encode(model, texts)
+    if replicate and replicate > len(embeddings):
+        # Paraphrase-like copies: service texts perturbed around the real ones
+        rng = np.random.default_rng(seed)
+        base = embeddings[rng.integers(0, len(embeddings), replicate - len(embeddings))]
+        extra = base + noise * rng.normal(size=base.shape).astype(np.float32)
+        embeddings = np.vstack([embeddings, extra])
+    return normalize_rows(embeddings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="IVF recall vs exact cosine similarity")
+    parser.add_argument("--csv", default="data/manufacturing_service_data.csv")
+    parser.add_argument("--column", default="problem reported")
+    parser.add_argument("--replicate", type=int, default=0, help="grow the set to N vectors")
+    parser.add_argument("--noise", type=float, default=0.05)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--threshold", type=float, default=0.6)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write results as JSON")
+    args = parser.parse_args()
+
+    embeddings = load_embeddings(args.csv, args.column, args.replicate, args.noise, args.seed)
+    n = len(embeddings)
+    results = {"n": n, "top_k": args.top_k, "threshold": args.threshold, "runs": []}
+
+    if n <= EXACT_MATRIX_LIMIT:
+        start = time.perf_counter()
+        exact = exact_edges_cosine_similarity(embeddings, args.top_k, args.threshold)
+        results["cosine_similarity_seconds"] = time.perf_counter() - start
+    else:
+        exact = None
+
+    start = time.perf_counter()
+    src, dst, _ = top_k_similar(embeddings, top_k=args.top_k, threshold=args.threshold)
+    results["blocked_exact_seconds"] = time.perf_counter() - start
+    blocked = set(zip(src.tolist(), dst.tolist()))
+    if exact is None:
+        exact = blocked
+    else:
+        results["blocked_recall"] = len(blocked & exact) / len(exact) if exact else 1.0
+
+    start = time.perf_counter()
+    index = IVFIndex(seed=args.seed).build(embeddings)
+    results["ivf_build_seconds"] = time.perf_counter() - start
+    results["ivf_lists"] = index.n_lists
+
+    print(f"n={n} exact_edges={len(exact)} lists={index.n_lists}")
+    for key in ("cosine_similarity_seconds", "blocked_exact_seconds", "ivf_build_seconds"):
+        if key in results:
+            print(f"{key}: {results[key]:.3f}")
+    print(f"{'nprobe':>8} {'recall':>8} {'seconds':>9}")
+    for n_probe in args.nprobe:
+        start = time.perf_counter()
+        src, dst, _ = index.top_k_edges(top_k=args.top_k, threshold=args.threshold, n_probe=n_probe)
+        seconds = time.perf_counter() - start
+        found = set(zip(src.tolist(), dst.tolist()))
+        recall = len(found & exact) / len(exact) if exact else 1.0
+        results["runs"].append({"n_probe": n_probe, "recall": recall, "seconds": seconds})
+        print(f"{n_probe:>8} {recall:>8.4f} {seconds:>9.3f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
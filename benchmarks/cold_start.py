@@ -0,0 +1,88 @@
+# cold_start.py
+#
+# Cold-start profile of the entry points: import time, peak RSS and the slowest
+# imports, each measured in a fresh interpreter.
+#
+#   python -m benchmarks.cold_start --load-model --output cold_start.json
+
+import argparse
+import json
+import subprocess
+import sys
+
+TARGETS = [
+    "main",
+    "query.vector_based_query",
+    "query.graph_cypher_qa_chain",
+    "embedding_relation.graph_vector_similarity",
+    "knowledge_graph.create_nodes_from_csv",
+]
+
+CHILD = """
+import importlib, json, resource, sys, time
+start = time.perf_counter()
+importlib.import_module({module!r})
+imported = time.perf_counter()
+result = {{"module": {module!r}, "import_seconds": imported - start}}
+if {load_model}:
+    from utils.model_registry import get_model
+    get_model().encode(["warmup"])
+    result["model_seconds"] = time.perf_counter() - imported
+result["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+result["heavy_modules_loaded"] = sorted(
+    m for m in ("torch", "sentence_transformers", "langchain", "langchain_groq", "sklearn")
+    if m in sys.modules
+)
+print(json.dumps(result))
+"""
+
+
+def slowest_imports(stderr: str, top: int):
+    """Parses `-X importtime` output into the `top` largest cumulative import times."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = (part.strip() for part in line.split(":", 1)[1].split("|"))
+        rows.append((int(cumulative_us), name.strip()))
+    rows.sort(reverse=True)
+    return [{"module": name, "cumulative_ms": us / 1000} for us, name in rows[:top]]
+
+
+def profile(module: str, load_model: bool, top: int) -> dict:
+    code = CHILD.format(module=module, load_model=load_model)
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                          capture_output=True, text=True)
+    if proc.returncode != 0:
+        return {"module": module, "error": proc.stderr.strip().splitlines()[-1:]}
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result["slowest_imports"] = slowest_imports(proc.stderr, top)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start import and model load profile")
+    parser.add_argument("modules", nargs="*", default=TARGETS)
+    parser.add_argument("--load-model", action="store_true", help="also time get_model() after import")
+    parser.add_argument("--top", type=int, default=10, help="slowest imports to report")
+    parser.add_argument("--output", help="write the report as JSON")
+    args = parser.parse_args()
+
+    report = [profile(module, args.load_model, args.top) for module in args.modules]
+    for r in report:
+        if "error" in r:
+            print(f"{r['module']:<45} failed: {r['error']}")
+            continue
+        line = f"{r['module']:<45} import {r['import_seconds']:.2f}s  peak RSS {r['peak_rss_mb']:.0f} MB"
+        if "model_seconds" in r:
+            line += f"  model {r['model_seconds']:.2f}s"
+        print(line)
+        print(f"{'':<45} heavy modules: {', '.join(r['heavy_modules_loaded']) or 'none'}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# fake_groq_server.py
+#
+# Local stand-in for the Groq chat-completions endpoint, for offline tests and
+# benchmarks. Answers plain and streaming (SSE) requests with canned tokens after
+# a configurable first-token delay.
+#
+#   python -m benchmarks.fake_groq_server --port 8765 --ttft 0.4 --token-delay 0.02
+#   GROQ_API_URL=http://127.0.0.1:8765/openai/v1/chat/completions streamlit run app.py
+
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPLY = (
+    "The reported symptom matches earlier cases on this machine model. Check the listed causes "
+    "in order, starting with the most frequent one, and verify the corrective action resolved it "
+    "before closing the request. Keep the coolant below 40 °C; see the fabricant's réglage notes."
+)
+
+
+def make_handler(ttft: float, token_delay: float, tokens: int):
+    words = (REPLY.split() * (tokens // len(REPLY.split()) + 1))[:tokens]
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            model = body.get("model", "fake")
+            time.sleep(ttft)
+
+            if not body.get("stream"):
+                payload = json.dumps({
+                    "model": model,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": " ".join(words)}}],
+                    "usage": {"completion_tokens": len(words)},
+                }, ensure_ascii=False).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            for i, word in enumerate(words):
+                if i:
+                    time.sleep(token_delay)
+                self._event({"model": model, "choices": [{"index": 0, "delta": {"content": (" " if i else "") + word}}]})
+            self._event({
+                "model": model,
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                "x_groq": {"usage": {"completion_tokens": len(words)}},
+            })
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+            self.close_connection = True
+
+        def _event(self, data: dict):
+            # Raw UTF-8 rather than \u escapes, as real endpoints send it
+            self.wfile.write(f"data: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+    return Handler
+
+
+def start_fake_server(port: int = 0, ttft: float = 0.2, token_delay: float = 0.01, tokens: int = 60):
+    """
+    Starts the fake server in a daemon thread.
+
+    Returns:
+        tuple: (server, chat-completions URL). Call server.shutdown() to stop it.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(ttft, token_delay, tokens))
+    threading.Thread(target=server.serve_forever, name="fake-groq", daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/openai/v1/chat/completions"
+    return server, url
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake OpenAI-compatible chat-completions server")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--ttft", type=float, default=0.2, help="seconds before the first token")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="seconds between tokens")
+    parser.add_argument("--tokens", type=int, default=60, help="tokens per reply")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(args.ttft, args.token_delay, args.tokens))
+    print(f"Serving on http://127.0.0.1:{args.port}/openai/v1/chat/completions")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,346 @@
+# pipeline_benchmark.py
+#
+# End-to-end benchmark of every pipeline stage and the query path on synthetic
+# data. Each stage runs in a fresh process so its peak RSS is its own. Results
+# are appended to a JSONL file, one line per run, so runs can be compared.
+#
+#   python -m benchmarks.pipeline_benchmark --rows 100000
+#   python -m benchmarks.pipeline_benchmark --rows 1000000 --stages generate read embed similarity
+#   python -m benchmarks.pipeline_benchmark --rows 10000 --neo4j          # also load a local Neo4j
+#
+# Without --neo4j everything runs offline: the in-process vector index stands in
+# for Neo4j and benchmarks/fake_groq_server.py for Groq. Use --model to encode
+# with the real SentenceTransformer instead of the hashing stand-in.
+
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import platform
+import resource
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+import pandas as pd
+
+STAGES = ["generate", "read", "graph_load", "embed", "similarity", "ann", "index", "query"]
+RESULTS_PATH = "benchmarks/results.jsonl"
+WORK_DIR = "data/bench"
+QUERY_COUNT = 200
+VECTOR_DIM = 384
+
+
+class HashingEncoder:
+    """
+    Offline stand-in for the SentenceTransformer: signed feature hashing of word
+    unigrams and bigrams, L2-normalized. Paraphrases sharing words stay close.
+    """
+
+    def __init__(self, dim: int = VECTOR_DIM):
+        self.dim = dim
+
+    def _vector(self, text: str) -> np.ndarray:
+        words = str(text).casefold().split()
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature in words + [" ".join(pair) for pair in zip(words, words[1:])]:
+            digest = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+            vector[digest % self.dim] += 1.0 if digest >> 63 else -1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def encode(self, texts, batch_size: int = 256, convert_to_numpy: bool = True, **kwargs):
+        if isinstance(texts, str):
+            return self._vector(texts)
+        return np.vstack([self._vector(t) for t in texts]) if len(texts) else np.zeros((0, self.dim), np.float32)
+
+
+def percentiles(samples: list) -> dict:
+    samples = np.asarray(samples, dtype=float) * 1000
+    if not len(samples):
+        return {}
+    return {
+        "p50_ms": float(np.percentile(samples, 50)),
+        "p95_ms": float(np.percentile(samples, 95)),
+        "p99_ms": float(np.percentile(samples, 99)),
+        "max_ms": float(samples.max()),
+    }
+
+
+def _encoder(ctx: dict):
+    if ctx["model"]:
+        from utils.model_registry import get_model
+        return get_model()
+    return HashingEncoder()
+
+
+def _problem_texts(ctx: dict) -> list:
+    texts = pd.read_csv(ctx["csv"], usecols=["problem reported"], dtype=str)["problem reported"].dropna()
+    return sorted(set(texts))
+
+
+# --- stages: each takes the run context and returns its metrics ---
+
+def stage_generate(ctx):
+    from benchmarks.synthetic_data import SyntheticServiceData, default_config
+
+    config = default_config(ctx["rows"])
+    config.update(ctx["cardinalities"])
+    result = SyntheticServiceData(config).write_csv(ctx["csv"])
+    return {**result, "config": config, "bytes": os.path.getsize(ctx["csv"])}
+
+
+def stage_read(ctx):
+    from knowledge_graph.create_nodes_from_csv import iter_csv_chunks
+
+    start = time.perf_counter()
+    rows = sum(len(chunk) for chunk in iter_csv_chunks(ctx["csv"]))
+    seconds = time.perf_counter() - start
+    return {"rows": rows, "seconds": seconds, "rows_per_sec": rows / seconds}
+
+
+def stage_graph_load(ctx):
+    if not ctx["neo4j"]:
+        return {"skipped": "pass --neo4j to load a local Neo4j"}
+    from knowledge_graph.neo4j_load import connect_to_neo4j, delete_knowledge_graph
+    from knowledge_graph.schema import apply_schema
+    from knowledge_graph.create_nodes_from_csv import load_csv_and_create_nodes
+    from knowledge_graph.problem_context import materialize_problem_context
+    from main import CYPHER_QUERY
+
+    _, driver = connect_to_neo4j()
+    delete_knowledge_graph(driver)
+    apply_schema(driver)
+    result = load_csv_and_create_nodes(driver, ctx["csv"], CYPHER_QUERY)
+    start = time.perf_counter()
+    problems = materialize_problem_context(driver)
+    return {**result, "context_problems": problems, "context_seconds": time.perf_counter() - start}
+
+
+def stage_embed(ctx):
+    texts = _problem_texts(ctx)
+    encoder = _encoder(ctx)
+    start = time.perf_counter()
+    embeddings = np.asarray(encoder.encode(texts, batch_size=256, convert_to_numpy=True), dtype=np.float32)
+    seconds = time.perf_counter() - start
+    np.save(os.path.join(ctx["work_dir"], "embeddings.npy"), embeddings)
+    with open(os.path.join(ctx["work_dir"], "texts.json"), "w") as f:
+        json.dump(texts, f)
+
+    if ctx["neo4j"]:
+        from knowledge_graph.neo4j_load import connect_to_neo4j
+        from embedding_relation.graph_vector_similarity import write_embeddings, ensure_vector_index
+
+        _, driver = connect_to_neo4j()
+        write_start = time.perf_counter()
+        write_embeddings(driver, "Problem", texts, embeddings)
+        ensure_vector_index(driver, "Problem")
+        return {"texts": len(texts), "seconds": seconds, "texts_per_sec": len(texts) / seconds,
+                "write_seconds": time.perf_counter() - write_start}
+    return {"texts": len(texts), "seconds": seconds, "texts_per_sec": len(texts) / seconds}
+
+
+def _embeddings(ctx):
+    return np.load(os.path.join(ctx["work_dir"], "embeddings.npy"))
+
+
+def stage_similarity(ctx):
+    from embedding_relation.similarity_graph import top_k_similar
+
+    embeddings = _embeddings(ctx)
+    start = time.perf_counter()
+    src, _, _ = top_k_similar(embeddings, top_k=5, threshold=0.6, self_index=np.arange(len(embeddings)))
+    seconds = time.perf_counter() - start
+    return {"nodes": len(embeddings), "edges": len(src), "seconds": seconds,
+            "nodes_per_sec": len(embeddings) / seconds}
+
+
+def stage_ann(ctx):
+    from embedding_relation.ann_index import IVFIndex
+
+    embeddings = _embeddings(ctx)
+    start = time.perf_counter()
+    index = IVFIndex().build(embeddings)
+    built = time.perf_counter()
+    src, _, _ = index.top_k_edges(top_k=5, threshold=0.6)
+    done = time.perf_counter()
+    return {"nodes": len(embeddings), "edges": len(src), "build_seconds": built - start,
+            "search_seconds": done - built, "nodes_per_sec": len(embeddings) / (done - start)}
+
+
+def stage_index(ctx):
+    from embedding_relation.local_index import save_local_index, LocalVectorIndex
+
+    embeddings = _embeddings(ctx)
+    with open(os.path.join(ctx["work_dir"], "texts.json")) as f:
+        texts = json.load(f)
+    base_dir = os.path.join(ctx["work_dir"], "local_index")
+    start = time.perf_counter()
+    save_local_index("Problem", texts, embeddings, base_dir)
+    saved = time.perf_counter()
+    index = LocalVectorIndex.load("Problem", base_dir)
+
+    rng = np.random.default_rng(0)
+    queries = embeddings[rng.integers(0, len(embeddings), QUERY_COUNT)]
+    queries = queries + rng.normal(scale=0.05, size=queries.shape).astype(np.float32)
+    latencies = []
+    for q in queries:
+        t = time.perf_counter()
+        index.search(q, 3)
+        latencies.append(time.perf_counter() - t)
+    return {"vectors": len(index), "save_seconds": saved - start,
+            "qps": len(latencies) / sum(latencies), **percentiles(latencies)}
+
+
+def _context_records(ctx) -> dict:
+    """Stand-in for the materialized Problem context, built from the CSV itself."""
+    df = pd.read_csv(ctx["csv"], usecols=["problem reported", "cause", "corrective action", "machine model"],
+                     dtype=str).fillna("")
+    grouped = df.groupby("problem reported")
+    top = lambda s: s.value_counts().index[:5].tolist()
+    return {
+        text: {"causes": top(g["cause"]), "actions": top(g["corrective action"]), "machines": top(g["machine model"])}
+        for text, g in grouped
+    }
+
+
+def stage_query(ctx):
+    from query.context_assembler import assemble_context
+    from query.vector_based_query import stream_llm_diagnosis, find_similar_problem
+
+    texts = _problem_texts(ctx)
+    encoder = _encoder(ctx)
+    rng = np.random.default_rng(1)
+    questions = [texts[i] for i in rng.integers(0, len(texts), ctx["queries"])]
+
+    if ctx["neo4j"]:
+        from knowledge_graph.neo4j_load import connect_to_neo4j
+        _, driver = connect_to_neo4j()
+        retrieve = lambda q: find_similar_problem(q, driver, encoder)
+    else:
+        from embedding_relation.local_index import LocalVectorIndex
+        index = LocalVectorIndex.load("Problem", os.path.join(ctx["work_dir"], "local_index"))
+        context = _context_records(ctx)
+
+        def retrieve(q):
+            hits = index.search(encoder.encode(q), 3)
+            return assemble_context([{**hit, **context.get(hit["text"], {})} for hit in hits])[0]
+
+    retrieval, ttft, total = [], [], []
+    for q in questions:
+        start = time.perf_counter()
+        problem_context = retrieve(q)
+        retrieval.append(time.perf_counter() - start)
+        stats = {}
+        for _ in stream_llm_diagnosis(q, problem_context, api_key="benchmark", use_cache=False, stats=stats):
+            pass
+        if stats.get("ttft_seconds") is not None:
+            ttft.append(stats["ttft_seconds"])
+        total.append(time.perf_counter() - start)
+    return {
+        "queries": len(questions),
+        "retrieval": percentiles(retrieval),
+        "ttft": percentiles(ttft),
+        "end_to_end": percentiles(total),
+        "qps": len(total) / sum(total),
+    }
+
+
+def _run_stage(name: str, ctx: dict) -> dict:
+    start = time.perf_counter()
+    try:
+        metrics = globals()[f"stage_{name}"](ctx)
+    except Exception as e:
+        metrics = {"error": f"{type(e).__name__}: {e}"}
+    metrics["wall_seconds"] = time.perf_counter() - start
+    metrics["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return metrics
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end pipeline and query benchmark on synthetic data")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--stages", nargs="*", default=STAGES, choices=STAGES)
+    parser.add_argument("--neo4j", action="store_true", help="load and query the Neo4j from NEO4J_URI")
+    parser.add_argument("--model", action="store_true", help="encode with the SentenceTransformer")
+    parser.add_argument("--queries", type=int, default=QUERY_COUNT)
+    parser.add_argument("--llm-ttft", type=float, default=0.2, help="fake server delay before the first token")
+    parser.add_argument("--work-dir", default=WORK_DIR)
+    parser.add_argument("--results", default=RESULTS_PATH)
+    parser.add_argument("--no-isolate", action="store_true", help="run stages in this process")
+    for name in ("machines", "customers", "makes", "problems", "paraphrases"):
+        parser.add_argument(f"--{name}", type=int)
+    args = parser.parse_args()
+
+    work_dir = os.path.join(args.work_dir, str(args.rows))
+    os.makedirs(work_dir, exist_ok=True)
+    ctx = {
+        "rows": args.rows,
+        "csv": os.path.join(work_dir, "service_data.csv"),
+        "work_dir": work_dir,
+        "neo4j": args.neo4j,
+        "model": args.model,
+        "queries": args.queries,
+        "cardinalities": {k: v for k, v in vars(args).items()
+                          if k in ("machines", "customers", "makes", "problems", "paraphrases") and v is not None},
+    }
+
+    server = None
+    if "query" in args.stages:
+        from benchmarks.fake_groq_server import start_fake_server
+        server, url = start_fake_server(ttft=args.llm_ttft)
+        # Inherited by the stage processes
+        os.environ["GROQ_API_URL"] = url
+        os.environ.setdefault("LLM_REQUESTS_PER_MINUTE", "100000")
+        os.environ.setdefault("LLM_TOKENS_PER_MINUTE", "100000000")
+
+    results = {}
+    for name in [s for s in STAGES if s in args.stages]:
+        if args.no_isolate:
+            metrics = _run_stage(name, ctx)
+        else:
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+                metrics = pool.submit(_run_stage, name, ctx).result()
+        results[name] = metrics
+        summary = {}
+        for k, v in metrics.items():
+            if isinstance(v, dict):
+                summary.update({f"{k}.{m}": v[m] for m in ("p50_ms", "p95_ms") if m in v})
+            else:
+                summary[k] = v
+        print(f"{name:<12} " + "  ".join(
+            f"{k}={v:.3g}" if isinstance(v, float) else f"{k}={v}" for k, v in summary.items()
+        ))
+    if server is not None:
+        server.shutdown()
+
+    record = {
+        "run_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "rows": args.rows,
+        "encoder": "sentence_transformers" if args.model else "hashing",
+        "backend": "neo4j" if args.neo4j else "local",
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "stages": results,
+    }
+    if os.path.dirname(args.results):
+        os.makedirs(os.path.dirname(args.results), exist_ok=True)
+    with open(args.results, "a") as f:
+        f.write(json.dumps(record) + "\n")
+    print(f"Results appended to {args.results}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+# quantization_recall.py
+#
+# Recall, latency, on-disk size and in-memory scan size of the float16 / int8
+# local index against exact float32 search. Compact indexes are measured as
+# stored by default (codes and scales only, compact scores are final) and with
+# the float32 sidecar that enables exact rescoring of over-fetched candidates.
+#
+# Measured with --hashing --replicate 200000 (dim 384); ram is the resident
+# scan matrix, disk the stored vector files:
+#
+#   precision  sidecar  rescore  recall   ram_mb  disk_mb
+#   float32    -        -        1.0000   293.0   293.0
+#   float16    no       0        0.9980   146.5   146.5
+#   float16    yes      4        1.0000   146.5   439.5
+#   int8       no       0        0.9640    74.0    74.0
+#   int8       yes      4        1.0000    74.0   367.0
+#
+#   python -m benchmarks.quantization_recall --replicate 200000
+#   python -m benchmarks.quantization_recall --hashing --replicate 1000000 --rescore 2 4 8
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.pipeline_benchmark import HashingEncoder, percentiles
+from embedding_relation.local_index import save_local_index, LocalVectorIndex
+from embedding_relation.similarity_graph import normalize_rows
+
+MODEL_NAME = "all-MiniLM-L6-v2"
+NEO4J_LIST_BYTES = 8    # a LIST<FLOAT> property stores float64 values
+NEO4J_VECTOR_BYTES = 4  # db.create.setNodeVectorProperty stores float32
+
+
+def load_embeddings(csv_path, column, replicate, noise, seed, hashing):
+    texts = pd.read_csv(csv_path)[column].dropna().unique().tolist()
+    if hashing:
+        embeddings = HashingEncoder().encode(texts)
+    else:
+        from sentence_transformers import SentenceTransformer
+        from embedding_relation.embedding_cache import get_embedding_cache
+
+        model = SentenceTransformer(MODEL_NAME)
+        embeddings = get_embedding_cache(MODEL_NAME, model.get_sentence_embedding_dimension()).encode(model, texts)
+    if replicate and replicate > len(embeddings):
+        # Paraphrase-like copies: service texts perturbed around the real ones
+        rng = np.random.default_rng(seed)
+        base = embeddings[rng.integers(0, len(embeddings), replicate - len(embeddings))]
+        extra = base + noise * rng.normal(size=base.shape).astype(np.float32)
+        embeddings = np.vstack([embeddings, extra])
+    return normalize_rows(embeddings)
+
+
+def disk_bytes(base_dir, label="Bench"):
+    """Bytes of the vector files of a saved local index (ids excluded)."""
+    path = os.path.join(base_dir, label.lower())
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path) if name.endswith(".npy"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Quantized local index recall vs exact float32 search")
+    parser.add_argument("--csv", default="data/manufacturing_service_data.csv")
+    parser.add_argument("--column", default="problem reported")
+    parser.add_argument("--hashing", action="store_true", help="encode with the offline hashing stand-in")
+    parser.add_argument("--replicate", type=int, default=0, help="grow the set to N vectors")
+    parser.add_argument("--noise", type=float, default=0.05)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--precision", nargs="+", default=["float16", "int8"])
+    parser.add_argument("--rescore", type=int, nargs="+", default=[2, 4, 8],
+                        help="candidates per result rescored exactly against the float32 sidecar")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write results as JSON")
+    args = parser.parse_args()
+
+    embeddings = load_embeddings(args.csv, args.column, args.replicate, args.noise, args.seed, args.hashing)
+    n, dim = embeddings.shape
+    rng = np.random.default_rng(args.seed + 1)
+    queries = embeddings[rng.integers(0, n, args.queries)]
+    queries = queries + rng.normal(scale=args.noise, size=queries.shape).astype(np.float32)
+    ids = [str(i) for i in range(n)]
+
+    results = {"n": n, "dim": dim, "top_k": args.top_k, "runs": []}
+    with tempfile.TemporaryDirectory() as base_dir:
+        save_local_index("Bench", ids, embeddings, base_dir, precision="float32")
+        exact_index = LocalVectorIndex.load("Bench", base_dir)
+        truth, latencies = [], []
+        for q in queries:
+            start = time.perf_counter()
+            truth.append({hit["text"] for hit in exact_index.search(q, args.top_k)})
+            latencies.append(time.perf_counter() - start)
+        baseline, baseline_disk = exact_index.scan_bytes, disk_bytes(base_dir)
+        results["float32"] = {"ram_mb": baseline / 1024 ** 2, "disk_mb": baseline_disk / 1024 ** 2,
+                              **percentiles(latencies)}
+
+        print(f"n={n} dim={dim} top_k={args.top_k} queries={args.queries}")
+        print(f"{'precision':>10} {'sidecar':>8} {'rescore':>8} {'recall':>8} {'p50_ms':>8} {'p95_ms':>8} "
+              f"{'ram_mb':>8} {'disk_mb':>8} {'ram_x':>6} {'disk_x':>7}")
+        print(f"{'float32':>10} {'-':>8} {'-':>8} {1.0:>8.4f} {results['float32']['p50_ms']:>8.2f} "
+              f"{results['float32']['p95_ms']:>8.2f} {baseline / 1024 ** 2:>8.1f} {baseline_disk / 1024 ** 2:>8.1f} "
+              f"{1.0:>5.1f}x {1.0:>6.1f}x")
+
+        for precision in args.precision:
+            # As stored by default, then with the float32 rows kept for rescoring
+            for sidecar, factors in ((False, [0]), (True, [f for f in args.rescore if f > 0])):
+                if not factors:
+                    continue
+                save_local_index("Bench", ids, embeddings, base_dir, precision=precision, float32_sidecar=sidecar)
+                index = LocalVectorIndex.load("Bench", base_dir)
+                stored = disk_bytes(base_dir)
+                for factor in factors:
+                    index.rescore_factor = factor
+                    found, latencies = 0, []
+                    for q, expected in zip(queries, truth):
+                        start = time.perf_counter()
+                        hits = index.search(q, args.top_k)
+                        latencies.append(time.perf_counter() - start)
+                        found += len({hit["text"] for hit in hits} & expected)
+                    run = {
+                        "precision": precision,
+                        "float32_sidecar": sidecar,
+                        "rescore_factor": factor,
+                        "recall": found / sum(len(t) for t in truth),
+                        # Resident scan matrix; sidecar pages are mapped on demand and not counted
+                        "ram_mb": index.scan_bytes / 1024 ** 2,
+                        "disk_mb": stored / 1024 ** 2,
+                        "ram_reduction": baseline / index.scan_bytes,
+                        "disk_reduction": baseline_disk / stored,
+                        **percentiles(latencies),
+                    }
+                    results["runs"].append(run)
+                    print(f"{precision:>10} {'yes' if sidecar else 'no':>8} {factor:>8} {run['recall']:>8.4f} "
+                          f"{run['p50_ms']:>8.2f} {run['p95_ms']:>8.2f} {run['ram_mb']:>8.1f} {run['disk_mb']:>8.1f} "
+                          f"{run['ram_reduction']:>5.1f}x {run['disk_reduction']:>6.1f}x")
+
+    # Stored Neo4j property payload per node, before store/record overhead
+    results["neo4j_property_bytes"] = {"list": dim * NEO4J_LIST_BYTES, "float32": dim * NEO4J_VECTOR_BYTES}
+    print(f"neo4j embedding property: {dim * NEO4J_LIST_BYTES} bytes as list, "
+          f"{dim * NEO4J_VECTOR_BYTES} bytes as float32 vector")
+
+    if args.output:
+        if os.path.dirname(args.output):
+            os.makedirs(os.path.dirname(args.output), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+# stream_latency.py
+#
+# Time-to-first-token and tokens/sec of stream_llm_diagnosis against the fake
+# SSE server (default) or a real endpoint set through GROQ_API_URL.
+#
+#   python -m benchmarks.stream_latency --requests 20 --ttft 0.4
+#   python -m benchmarks.stream_latency --real --model llama3-70b-8192
+
+import argparse
+import json
+import os
+
+import numpy as np
+
+from benchmarks.fake_groq_server import start_fake_server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Streaming diagnosis TTFT and tokens/sec")
+    parser.add_argument("--requests", type=int, default=10)
+    parser.add_argument("--real", action="store_true", help="use GROQ_API_URL instead of the fake server")
+    parser.add_argument("--model", default="llama3-70b-8192")
+    parser.add_argument("--ttft", type=float, default=0.2)
+    parser.add_argument("--token-delay", type=float, default=0.01)
+    parser.add_argument("--tokens", type=int, default=60)
+    parser.add_argument("--output", help="write per-request stats as JSON")
+    args = parser.parse_args()
+
+    server = None
+    if not args.real:
+        server, url = start_fake_server(ttft=args.ttft, token_delay=args.token_delay, tokens=args.tokens)
+        os.environ["GROQ_API_URL"] = url
+        # The fake server has no quota; keep the client's rate limiter out of the measurement
+        os.environ.setdefault("LLM_REQUESTS_PER_MINUTE", "100000")
+        os.environ.setdefault("LLM_TOKENS_PER_MINUTE", "100000000")
+
+    # Imported after the environment is set
+    from query.vector_based_query import stream_llm_diagnosis
+
+    results = []
+    for i in range(args.requests):
+        stats = {}
+        for _ in stream_llm_diagnosis(f"spindle noise case {i}", "benchmark context",
+                                      api_key=os.getenv("groq_api_key", "fake"), model_name=args.model,
+                                      use_cache=False, stats=stats):
+            pass
+        results.append(stats)
+
+    ok = [r for r in results if r.get("ttft_seconds") is not None]
+    if ok:
+        ttft = np.array([r["ttft_seconds"] for r in ok])
+        rate = np.array([r["tokens_per_sec"] for r in ok])
+        print(f"requests {len(ok)}/{len(results)}")
+        print(f"TTFT    p50 {np.percentile(ttft, 50):.3f}s  p95 {np.percentile(ttft, 95):.3f}s")
+        print(f"tokens/s p50 {np.percentile(rate, 50):.1f}  min {rate.min():.1f}")
+    else:
+        print("no successful streams")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if server is not None:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
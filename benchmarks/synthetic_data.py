@@ -0,0 +1,191 @@
+# synthetic_data.py
+#
+# Synthetic service records in the 21-column schema of
+# data/manufacturing_service_data.csv, at any size, written in chunks.
+#
+#   python -m benchmarks.synthetic_data --rows 1000000 --output data/synthetic_1m.csv
+#   python -m benchmarks.synthetic_data --rows 100000 --machines 5000 --customers 800 --paraphrases 8
+
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+SEED_CSV = "data/manufacturing_service_data.csv"
+CHUNK_SIZE = 100000
+
+COLUMNS = [
+    "SR ref no", "SR date", "category hierarchy", "assigned account", "machine model", "serial number",
+    "component serial number", "commission date", "complaint category", "make", "Name", "type of activity",
+    "defect no", "problem reported", "problem summary", "sub assembly", "failure mode", "cause",
+    "corrective action", "problem", "product category",
+]
+
+# Columns that travel together: one seed row is one problem family
+FAMILY_COLUMNS = [
+    "category hierarchy", "complaint category", "type of activity", "problem reported", "problem summary",
+    "sub assembly", "failure mode", "cause", "corrective action", "problem", "product category",
+]
+
+SYNONYMS = {
+    "noisy": "making noise", "inconsistent": "irregular", "intermittent": "occasional", "errors": "faults",
+    "showing": "displaying", "hot": "overheating", "leaking": "dripping", "coolant": "coolent",
+    "failure": "breakdown", "stops": "halts", "vibration": "shaking", "slow": "sluggish",
+}
+PREFIXES = ["", "", "Operator reports ", "Customer says ", "Urgent: ", "Technician noted "]
+SUFFIXES = ["", "", " after long runs", " during startup", " under heavy load", " since last service"]
+
+
+def default_config(rows: int) -> dict:
+    """Cardinalities that grow sub-linearly with the number of rows."""
+    return {
+        "rows": rows,
+        "machines": max(50, rows // 50),
+        "models": max(7, int(rows ** 0.3)),
+        "customers": max(5, rows // 500),
+        "makes": max(5, int(rows ** 0.2)),
+        "accounts": max(5, rows // 2000),
+        "problems": max(100, int(rows ** 0.5)),
+        "paraphrases": 5,
+        "skew": 1.1,
+        "start_date": "2020-01-01",
+        "end_date": "2025-12-31",
+        "seed": 0,
+    }
+
+
+def _zipf_weights(n: int, skew: float) -> np.ndarray:
+    weights = 1.0 / np.arange(1, n + 1) ** skew
+    return weights / weights.sum()
+
+
+def _paraphrase(text: str, rng) -> str:
+    words = text.split()
+    words = [SYNONYMS.get(w.lower(), w) if rng.random() < 0.5 else w for w in words]
+    out = rng.choice(PREFIXES) + " ".join(words) + rng.choice(SUFFIXES)
+    return out.lower() if rng.random() < 0.2 else out
+
+
+def _names(seed_values, n: int, pattern: str) -> np.ndarray:
+    values = list(dict.fromkeys(seed_values))[:n]
+    values += [pattern.format(i) for i in range(len(values), n)]
+    return np.array(values, dtype=object)
+
+
+class SyntheticServiceData:
+    """
+    Generates realistic service records from the seed CSV.
+
+    Problem families (symptom, cause, corrective action, sub assembly, ...) come
+    from the seed rows and are multiplied into `problems` families; every family
+    has `paraphrases` wordings of the reported problem. Machines, customers,
+    makes and accounts are drawn with a Zipf-like skew, so a few are busy and
+    most are rare, as in real service history.
+    """
+
+    def __init__(self, config: dict, seed_csv: str = SEED_CSV):
+        self.config = config
+        rng = np.random.default_rng(config["seed"])
+        seed = pd.read_csv(seed_csv, dtype=str).fillna("")
+
+        families = seed[FAMILY_COLUMNS].sample(n=config["problems"], replace=True, random_state=config["seed"])
+        families = families.reset_index(drop=True)
+        # Beyond the seed rows, families differ by component position and symptom wording
+        extra = np.arange(len(families)) >= len(seed)
+        families.loc[extra, "problem reported"] = [
+            f"{text} ({rng.choice(['front', 'rear', 'left', 'right', 'upper', 'lower'])} {i})"
+            for i, text in zip(np.flatnonzero(extra), families.loc[extra, "problem reported"])
+        ]
+        families.loc[extra, "cause"] = [f"{c} - variant {i}" for i, c in zip(np.flatnonzero(extra), families.loc[extra, "cause"])]
+        self.families = families
+        self.sub_assembly_no = {name: i for i, name in enumerate(sorted(families["sub assembly"].unique()))}
+        self.paraphrases = np.array([
+            [text] + [_paraphrase(text, rng) for _ in range(config["paraphrases"] - 1)]
+            for text in families["problem reported"]
+        ], dtype=object)
+
+        self.models = _names(seed["machine model"], config["models"], "LT-{:04d}")
+        self.makes = _names(seed["make"], config["makes"], "Make {:03d} Corp")
+        self.customers = _names(seed["Name"], config["customers"], "Customer {:06d} Manufacturing")
+        self.accounts = _names(seed["assigned account"], config["accounts"], "ACC-SYN-{:05d}")
+
+        machines = config["machines"]
+        self.machine_model = rng.integers(0, len(self.models), machines)
+        self.machine_make = rng.integers(0, len(self.makes), machines)
+        self.machine_serial = np.array([f"SN-SYN-{i:08d}" for i in range(machines)], dtype=object)
+        start = np.datetime64(config["start_date"])
+        self.machine_commission = (start - rng.integers(30, 3650, machines).astype("timedelta64[D]")).astype(str)
+
+        self.start = start
+        self.days = int((np.datetime64(config["end_date"]) - start).astype(int))
+
+    def chunks(self, chunk_size: int = CHUNK_SIZE):
+        """Yields DataFrames with the 21 source columns, `chunk_size` rows at a time."""
+        config = self.config
+        rng = np.random.default_rng(config["seed"] + 1)
+        machine_p = _zipf_weights(config["machines"], config["skew"])
+        family_p = _zipf_weights(len(self.families), config["skew"])
+        customer_p = _zipf_weights(len(self.customers), config["skew"])
+
+        for offset in range(0, config["rows"], chunk_size):
+            n = min(chunk_size, config["rows"] - offset)
+            ids = np.arange(offset, offset + n)
+            machine = rng.choice(config["machines"], n, p=machine_p)
+            family = rng.choice(len(self.families), n, p=family_p)
+            wording = rng.integers(0, self.paraphrases.shape[1], n)
+            fam = self.families.iloc[family].reset_index(drop=True)
+            dates = (self.start + rng.integers(0, self.days + 1, n).astype("timedelta64[D]")).astype(str)
+
+            df = pd.DataFrame({
+                "SR ref no": [f"SRV-SYN-{i:09d}" for i in ids],
+                "SR date": dates,
+                "assigned account": self.accounts[rng.integers(0, len(self.accounts), n)],
+                "machine model": self.models[self.machine_model[machine]],
+                "serial number": self.machine_serial[machine],
+                "commission date": self.machine_commission[machine],
+                "make": self.makes[self.machine_make[machine]],
+                "Name": self.customers[rng.choice(len(self.customers), n, p=customer_p)],
+                "defect no": [f"DEF-{d:04d}" for d in rng.integers(0, 10000, n)],
+            })
+            for column in FAMILY_COLUMNS:
+                df[column] = fam[column].to_numpy()
+            df["problem reported"] = self.paraphrases[family, wording]
+            df["component serial number"] = [
+                f"CSN-{m:08d}-{self.sub_assembly_no[s]:03d}" for m, s in zip(machine, df["sub assembly"])
+            ]
+            yield df[COLUMNS]
+
+    def write_csv(self, path: str, chunk_size: int = CHUNK_SIZE) -> dict:
+        """Writes the dataset to `path`; returns rows, seconds and rows/sec."""
+        start = time.perf_counter()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        rows = 0
+        for i, chunk in enumerate(self.chunks(chunk_size)):
+            chunk.to_csv(path, mode="w" if i == 0 else "a", header=i == 0, index=False)
+            rows += len(chunk)
+        seconds = time.perf_counter() - start
+        return {"rows": rows, "seconds": seconds, "rows_per_sec": rows / seconds if seconds else 0.0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic service records")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--output", help="CSV path (default data/synthetic_<rows>.csv)")
+    for name in ("machines", "models", "customers", "makes", "accounts", "problems", "paraphrases", "seed"):
+        parser.add_argument(f"--{name}", type=int)
+    parser.add_argument("--skew", type=float, help="Zipf exponent of entity popularity")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+
+    config = default_config(args.rows)
+    config.update({k: v for k, v in vars(args).items() if k in config and v is not None})
+    output = args.output or f"data/synthetic_{args.rows}.csv"
+    result = SyntheticServiceData(config).write_csv(output, args.chunk_size)
+    print(f"{result['rows']} rows -> {output} in {result['seconds']:.1f}s ({result['rows_per_sec']:.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    main()
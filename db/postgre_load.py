@@ -1,9 +1,14 @@
 import os
+import csv
+import threading
+from contextlib import contextmanager
 import pandas as pd
 import psycopg2
+from psycopg2 import sql
 from sqlalchemy import create_engine
 from dotenv import load_dotenv
 from utils.logger_config import get_logger
+from utils import metrics
 
 # Load environment variables
 load_dotenv()
@@ -17,6 +22,15 @@ DB_NAME = os.getenv("DB_NAME")
 DB_USER = os.getenv("DB_USER")
 DB_PASSWORD = os.getenv("DB_PASSWORD")
 
+STREAM_CHUNK_SIZE = 50000  # rows fetched per round trip by the server-side cursor
+KEY_COLUMN = "SR ref no"   # unique key for upsert loads
+FILE_ROW_COLUMN = "_file_row"  # staging-table line number, so the last row of a repeated key wins
+POOL_SIZE = 5
+POOL_MAX_OVERFLOW = 10
+
+_ENGINE = None
+_ENGINE_LOCK = threading.Lock()
+
 # Validate
 if not all([DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASSWORD]):
     logger.error("Missing database environment variables. Please check .env file.")
@@ -47,51 +61,180 @@ def connect_to_postgre():
 
 def get_engine():
     """
-    Creates a SQLAlchemy engine using environment variables.
+    Returns the process-wide pooled SQLAlchemy engine, creating it on first use.
 
     Returns:
         sqlalchemy.engine.Engine or None
     """
+    global _ENGINE
+    if _ENGINE is not None:
+        return _ENGINE
+    with _ENGINE_LOCK:
+        if _ENGINE is None:
+            try:
+                _ENGINE = create_engine(
+                    f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}",
+                    pool_size=POOL_SIZE,
+                    max_overflow=POOL_MAX_OVERFLOW,
+                    pool_pre_ping=True
+                )
+                logger.info("SQLAlchemy engine created successfully.")
+            except Exception as e:
+                logger.error(f"Failed to create SQLAlchemy engine: {e}")
+    return _ENGINE
+
+
+@contextmanager
+def get_connection():
+    """
+    Checks a raw psycopg2 connection out of the shared engine pool.
+
+    The transaction is committed on success and rolled back on error; the
+    connection is returned to the pool either way.
+
+    Yields:
+        psycopg2.extensions.connection
+    """
+    engine = get_engine()
+    if engine is None:
+        raise ConnectionError("Engine creation failed.")
+    conn = engine.raw_connection()
     try:
-        engine = create_engine(
-            f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def _read_header(csv_path: str) -> list:
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        return next(csv.reader(f))
+
+
+def _create_table(cursor, table_name: str, columns: list):
+    cursor.execute(
+        sql.SQL("CREATE TABLE IF NOT EXISTS {} ({})").format(
+            sql.Identifier(table_name),
+            sql.SQL(", ").join(sql.SQL("{} TEXT").format(sql.Identifier(c)) for c in columns)
         )
-        logger.info("SQLAlchemy engine created successfully.")
-        return engine
-    except Exception as e:
-        logger.error(f"Failed to create SQLAlchemy engine: {e}")
-        return None
+    )
+
 
+def _copy_from_file(cursor, table_name: str, columns: list, csv_path: str):
+    copy = sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv, HEADER true)").format(
+        sql.Identifier(table_name),
+        sql.SQL(", ").join(map(sql.Identifier, columns))
+    )
+    with open(csv_path, encoding="utf-8") as f:
+        cursor.copy_expert(copy.as_string(cursor), f)
 
-def upload_csv_to_postgre(csv_path: str, table_name: str):
+
+@metrics.timed("postgres.upload")
+def upload_csv_to_postgre(csv_path: str, table_name: str, mode: str = "upsert",
+                          key_column: str = KEY_COLUMN, delete_missing: bool = True):
     """
-    Uploads a CSV file to a PostgreSQL table using SQLAlchemy.
+    Bulk loads a CSV file into a PostgreSQL table with COPY FROM STDIN.
+
+    The file is streamed to the server as-is, so it is never loaded into a
+    DataFrame. Columns are created as TEXT, matching the raw CSV values.
 
     Args:
         csv_path (str): Path to the CSV file.
         table_name (str): Target PostgreSQL table name.
+        mode (str): "replace" drops and recreates the table, "append" adds rows,
+            "upsert" loads into a staging table and merges it with
+            INSERT ... ON CONFLICT on `key_column`. If the file repeats a key,
+            its last row wins.
+        key_column (str): Unique key used by upsert mode.
+        delete_missing (bool): In upsert mode, also delete rows whose key is no
+            longer in the file, so the table mirrors the CSV and removed tickets
+            are retired downstream. Pass False for files that only carry new and
+            changed rows.
 
     Returns:
-        None
+        int or None: Number of rows written, updated or deleted, None on failure.
     """
+    if mode not in ("replace", "append", "upsert"):
+        raise ValueError(f"Unknown upload mode: {mode}")
     try:
-        engine = get_engine()
-        if engine is None:
-            raise ConnectionError("Engine creation failed.")
+        columns = _read_header(csv_path)
+        table = sql.Identifier(table_name)
+
+        with get_connection() as conn, conn.cursor() as cursor:
+            if mode == "replace":
+                cursor.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(table))
+            _create_table(cursor, table_name, columns)
+
+            if mode in ("replace", "append"):
+                _copy_from_file(cursor, table_name, columns, csv_path)
+                rows = cursor.rowcount
+            else:
+                key = sql.Identifier(key_column)
+                cursor.execute(
+                    sql.SQL("CREATE UNIQUE INDEX IF NOT EXISTS {} ON {} ({})").format(
+                        sql.Identifier(f"{table_name}_key_uidx"), table, key
+                    )
+                )
+                stage_name = f"{table_name}_stage"
+                cursor.execute(
+                    sql.SQL("CREATE TEMP TABLE {} (LIKE {} INCLUDING DEFAULTS) ON COMMIT DROP").format(
+                        sql.Identifier(stage_name), table
+                    )
+                )
+                cursor.execute(
+                    sql.SQL("ALTER TABLE {} ADD COLUMN {} BIGSERIAL").format(
+                        sql.Identifier(stage_name), sql.Identifier(FILE_ROW_COLUMN)
+                    )
+                )
+                # COPY assigns the serial in file order
+                _copy_from_file(cursor, stage_name, columns, csv_path)
 
-        df = pd.read_csv(csv_path)
-        logger.info(f"Read CSV '{csv_path}' with {len(df)} rows.")
+                column_list = sql.SQL(", ").join(map(sql.Identifier, columns))
+                updates = sql.SQL(", ").join(
+                    sql.SQL("{0} = EXCLUDED.{0}").format(sql.Identifier(c))
+                    for c in columns if c != key_column
+                )
+                # DISTINCT ON keeps the last row per key if the file repeats a request
+                cursor.execute(
+                    sql.SQL(
+                        "INSERT INTO {table} ({cols}) "
+                        "SELECT DISTINCT ON ({key}) {cols} FROM {stage} "
+                        "ORDER BY {key}, {file_row} DESC "
+                        "ON CONFLICT ({key}) DO UPDATE SET {updates} "
+                        "WHERE ({target}.*) IS DISTINCT FROM (EXCLUDED.*)"
+                    ).format(
+                        table=table, cols=column_list, key=key, file_row=sql.Identifier(FILE_ROW_COLUMN),
+                        stage=sql.Identifier(stage_name), updates=updates, target=table
+                    )
+                )
+                rows = cursor.rowcount
+                if delete_missing:
+                    cursor.execute(
+                        sql.SQL(
+                            "DELETE FROM {table} t WHERE NOT EXISTS "
+                            "(SELECT 1 FROM {stage} s WHERE s.{key} = t.{key})"
+                        ).format(table=table, stage=sql.Identifier(stage_name), key=key)
+                    )
+                    logger.info(f"Deleted {cursor.rowcount} rows no longer in '{csv_path}'.")
+                    rows += cursor.rowcount
 
-        df.to_sql(name=table_name, con=engine, if_exists='replace', index=False)
-        logger.info(f"Uploaded data to table '{table_name}' successfully.")
+        metrics.inc("rows_total", max(rows, 0), stage="postgres.upload")
+        logger.info(f"Uploaded '{csv_path}' to table '{table_name}' ({mode}, {rows} rows).")
+        return rows
 
     except Exception as e:
         logger.error(f"CSV upload failed: {e}")
 
 
+@metrics.timed("postgres.export")
 def export_table_to_csv(table_name: str, output_path: str):
     """
-    Exports a PostgreSQL table to a CSV file.
+    Exports a PostgreSQL table to a CSV file with COPY TO STDOUT.
+
+    Rows are streamed from the server straight into the file.
 
     Args:
         table_name (str): Name of the table to export.
@@ -101,13 +244,81 @@ def export_table_to_csv(table_name: str, output_path: str):
         None
     """
     try:
-        engine = get_engine()
-        if engine is None:
-            raise ConnectionError("Engine creation failed.")
-
-        df = pd.read_sql(f"SELECT * FROM {table_name}", con=engine)
-        df.to_csv(output_path, index=False)
+        copy = sql.SQL("COPY (SELECT * FROM {}) TO STDOUT WITH (FORMAT csv, HEADER true)").format(
+            sql.Identifier(table_name)
+        )
+        with get_connection() as conn, conn.cursor() as cursor:
+            with open(output_path, "w", encoding="utf-8", newline="") as f:
+                cursor.copy_expert(copy.as_string(cursor), f)
+            metrics.inc("rows_total", max(cursor.rowcount, 0), stage="postgres.export")
         logger.info(f"Exported table '{table_name}' to '{output_path}'.")
 
     except Exception as e:
         logger.error(f"Export failed: {e}")
+
+
+def distinct_values(table_name: str, columns: list) -> dict:
+    """
+    Distinct non-empty values of each column, computed by the server.
+
+    Args:
+        table_name (str): Name of the table to read.
+        columns (list[str]): Column names.
+
+    Returns:
+        dict: Column name -> sorted list of distinct values.
+    """
+    values = {}
+    with get_connection() as conn, conn.cursor() as cursor:
+        for column in columns:
+            cursor.execute(
+                sql.SQL("SELECT DISTINCT {col} FROM {table} WHERE {col} IS NOT NULL AND {col} <> ''").format(
+                    col=sql.Identifier(column), table=sql.Identifier(table_name)
+                )
+            )
+            values[column] = sorted(row[0] for row in cursor.fetchall())
+    logger.info(f"Read distinct values of {len(columns)} columns from table '{table_name}'.")
+    return values
+
+
+def stream_table(table_name: str, chunk_size: int = STREAM_CHUNK_SIZE, rename: dict = None,
+                 since_column: str = None, since=None):
+    """
+    Streams a PostgreSQL table in bounded chunks through a server-side cursor.
+
+    Only `chunk_size` rows are held in memory at a time, so the table never has to
+    be materialized in full or written to an intermediate CSV.
+
+    Args:
+        table_name (str): Name of the table to read.
+        chunk_size (int): Number of rows per chunk.
+        rename (dict): Optional column renames applied to every chunk.
+        since_column (str): Optional column used to skip rows older than `since`.
+        since: Lower bound (inclusive) for `since_column`.
+
+    Yields:
+        pd.DataFrame: Chunk of rows with NaN filled as empty strings.
+    """
+    query = sql.SQL("SELECT * FROM {}").format(sql.Identifier(table_name))
+    params = None
+    if since_column and since is not None:
+        query = query + sql.SQL(" WHERE {} >= %s").format(sql.Identifier(since_column))
+        params = (since,)
+
+    total = 0
+    with get_connection() as conn:
+        with conn.cursor(name=f"stream_{table_name}") as cursor:
+            cursor.itersize = chunk_size
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                columns = [col[0] for col in cursor.description]
+                df = pd.DataFrame.from_records(rows, columns=columns)
+                if rename:
+                    df = df.rename(columns=rename)
+                total += len(df)
+                metrics.inc("rows_total", len(df), stage="postgres.stream")
+                yield df.fillna("")
+    logger.info(f"Streamed {total} rows from table '{table_name}'.")
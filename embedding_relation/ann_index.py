@@ -0,0 +1,191 @@
+# ann_index.py
+
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from embedding_relation.similarity_graph import normalize_rows, SIMILARITY_WORKERS
+from utils.logger_config import get_logger
+from utils import metrics
+
+logger = get_logger(name=__name__, log_file="embedding_relation.log")
+
+# === CONFIG ===
+DEFAULT_NPROBE = 8           # lists scanned per query: higher = better recall, slower
+KMEANS_ITERATIONS = 20
+KMEANS_SAMPLE_PER_LIST = 256  # training points per centroid
+ASSIGN_BLOCK = 65536          # rows assigned to centroids at once
+QUERY_CHUNK = 1024            # queries handled per worker task
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Returns the index of the most similar centroid for each (normalized) row."""
+    out = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), ASSIGN_BLOCK):
+        block = vectors[start:start + ASSIGN_BLOCK]
+        out[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return out
+
+
+def _kmeans(vectors: np.ndarray, n_lists: int, iterations: int, rng) -> np.ndarray:
+    """Spherical k-means (cosine) with Lloyd iterations; empty lists are re-seeded."""
+    centroids = vectors[rng.choice(len(vectors), n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assign = _assign(vectors, centroids)
+        counts = np.bincount(assign, minlength=n_lists)
+        order = np.argsort(assign, kind="stable")
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        filled = counts > 0
+        sums = np.zeros_like(centroids)
+        sums[filled] = np.add.reduceat(vectors[order], starts[filled], axis=0)
+        empty = np.flatnonzero(~filled)
+        if len(empty):
+            sums[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+class IVFIndex:
+    """
+    Inverted-file index for approximate cosine nearest-neighbour search.
+
+    Vectors are partitioned into `n_lists` clusters by spherical k-means. A query
+    only scans the `n_probe` lists whose centroids are closest to it, so search
+    cost is roughly n_probe / n_lists of an exact scan. `n_probe` is the
+    recall/latency knob: n_probe == n_lists is exact search.
+    """
+
+    def __init__(self, n_lists: int = None, n_probe: int = DEFAULT_NPROBE, seed: int = 0):
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.seed = seed
+        self.centroids = None
+        self.vectors = None
+        self.list_offsets = None
+        self.list_ids = None
+
+    def __len__(self):
+        return 0 if self.vectors is None else len(self.vectors)
+
+    @metrics.timed("ann.build")
+    def build(self, vectors):
+        """
+        Trains the centroids and assigns every vector to its list.
+
+        Args:
+            vectors: (n, d) array of embeddings.
+
+        Returns:
+            IVFIndex: self
+        """
+        vectors = normalize_rows(vectors)
+        n = len(vectors)
+        if not self.n_lists:
+            self.n_lists = max(1, int(4 * np.sqrt(n)))
+        self.n_lists = min(self.n_lists, n)
+
+        rng = np.random.default_rng(self.seed)
+        sample_size = min(n, self.n_lists * KMEANS_SAMPLE_PER_LIST)
+        sample = vectors[rng.choice(n, sample_size, replace=False)] if sample_size < n else vectors
+        self.centroids = _kmeans(sample, self.n_lists, KMEANS_ITERATIONS, rng)
+
+        assign = _assign(vectors, self.centroids)
+        self.list_ids = np.argsort(assign, kind="stable")
+        self.list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=self.n_lists))])
+        self.vectors = vectors
+        logger.info(f"Built IVF index over {n} vectors with {self.n_lists} lists")
+        return self
+
+    def _search_chunk(self, queries, top_k, n_probe, exclude):
+        ids = np.full((len(queries), top_k), -1, dtype=np.int64)
+        scores = np.full((len(queries), top_k), -np.inf, dtype=np.float32)
+        probe = min(n_probe, self.n_lists)
+        centroid_scores = queries @ self.centroids.T
+        if probe < self.n_lists:
+            lists = np.argpartition(-centroid_scores, probe - 1, axis=1)[:, :probe]
+        else:
+            lists = np.broadcast_to(np.arange(self.n_lists), (len(queries), self.n_lists))
+
+        for row, query in enumerate(queries):
+            candidates = np.concatenate([
+                self.list_ids[self.list_offsets[l]:self.list_offsets[l + 1]] for l in lists[row]
+            ])
+            if exclude is not None and exclude[row] >= 0:
+                candidates = candidates[candidates != exclude[row]]
+            if len(candidates) == 0:
+                continue
+            sims = self.vectors[candidates] @ query
+            k = min(top_k, len(candidates))
+            best = np.argpartition(-sims, k - 1)[:k] if k < len(candidates) else np.arange(len(candidates))
+            best = best[np.argsort(-sims[best], kind="stable")]
+            ids[row, :k] = candidates[best]
+            scores[row, :k] = sims[best]
+        return ids, scores
+
+    def search(self, queries, top_k: int = 5, n_probe: int = None, exclude=None,
+               workers: int = SIMILARITY_WORKERS):
+        """
+        Approximate top-k cosine search.
+
+        Args:
+            queries: (n, d) array of query embeddings.
+            top_k (int): Neighbours returned per query.
+            n_probe (int): Lists scanned per query (defaults to self.n_probe).
+            exclude: Optional (n,) array of an index id to skip per query (-1 for none).
+            workers (int): Threads scanning query chunks.
+
+        Returns:
+            tuple: (ids, scores) arrays of shape (n, top_k); missing entries are -1 / -inf.
+        """
+        queries = normalize_rows(np.atleast_2d(queries))
+        n_probe = n_probe or self.n_probe
+        exclude = None if exclude is None else np.asarray(exclude)
+        starts = range(0, len(queries), QUERY_CHUNK)
+
+        def run(start):
+            part = None if exclude is None else exclude[start:start + QUERY_CHUNK]
+            return self._search_chunk(queries[start:start + QUERY_CHUNK], top_k, n_probe, part)
+
+        if workers > 1 and len(starts) > 1:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                parts = list(pool.map(run, starts))
+        else:
+            parts = [run(start) for start in starts]
+        if not parts:
+            return np.empty((0, top_k), dtype=np.int64), np.empty((0, top_k), dtype=np.float32)
+        return np.vstack([p[0] for p in parts]), np.vstack([p[1] for p in parts])
+
+    def top_k_edges(self, top_k: int = 5, threshold: float = 0.6, n_probe: int = None):
+        """
+        Approximate counterpart of similarity_graph.top_k_similar over the indexed
+        vectors themselves (self-matches excluded).
+
+        Returns:
+            tuple: (src, dst, score) arrays, one entry per edge.
+        """
+        ids, scores = self.search(self.vectors, top_k=top_k, n_probe=n_probe,
+                                  exclude=np.arange(len(self.vectors)))
+        keep = (ids >= 0) & (scores >= threshold)
+        src = np.repeat(np.arange(len(ids)), ids.shape[1]).reshape(ids.shape)
+        return src[keep], ids[keep], scores[keep]
+
+    def save(self, path: str):
+        """Persists the index as .npy files in directory `path`."""
+        os.makedirs(path, exist_ok=True)
+        for name in ("centroids", "vectors", "list_offsets", "list_ids"):
+            np.save(os.path.join(path, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(path, "ivf.json"), "w") as f:
+            json.dump({"n_lists": self.n_lists, "n_probe": self.n_probe, "seed": self.seed}, f)
+        logger.info(f"Saved IVF index to {path}")
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True):
+        """Loads an index saved with save(); vectors are memory-mapped by default."""
+        with open(os.path.join(path, "ivf.json")) as f:
+            params = json.load(f)
+        index = cls(**params)
+        for name in ("centroids", "vectors", "list_offsets", "list_ids"):
+            mode = "r" if mmap and name == "vectors" else None
+            setattr(index, name, np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mode))
+        return index
@@ -0,0 +1,284 @@
+# embedding_cache.py
+
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+from utils.logger_config import get_logger
+from utils import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to in-process locking only
+    fcntl = None
+
+logger = get_logger(name=__name__, log_file="embedding_relation.log")
+
+# === CONFIG ===
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "data/embedding_cache")
+MAX_ENTRIES = 1_000_000    # ~1.5 GB of float32 vectors at 384 dimensions
+EVICT_TO = 0.9             # fraction of MAX_ENTRIES kept after an eviction
+ENCODE_BATCH_SIZE = 256
+
+META_FILE = "meta.json"
+KEYS_FILE = "keys.npy"
+ATIME_FILE = "atime.npy"
+VECTORS_FILE = "vectors.f32"
+LOCK_FILE = ".lock"
+KEY_BYTES = 32             # hex digest length; hex avoids NumPy stripping trailing NUL bytes
+
+
+def normalize_for_key(text: str) -> str:
+    """Collapses whitespace and case so trivially different strings share an entry."""
+    return " ".join(str(text).split()).casefold()
+
+
+def cache_key(model_name: str, text: str) -> bytes:
+    payload = f"{model_name}\0{normalize_for_key(text)}".encode("utf-8")
+    return hashlib.blake2b(payload, digest_size=KEY_BYTES // 2).hexdigest().encode("ascii")
+
+
+class EmbeddingCache:
+    """
+    On-disk, content-addressed store of text embeddings.
+
+    Vectors live in a flat float32 file that is memory-mapped for reads, with a
+    parallel array of keys (hash of model name + normalized text) and last-access
+    times. Writers append under an exclusive file lock and publish by atomically
+    replacing the key index, so readers holding a shared lock always see a
+    consistent snapshot. Changing the model name or dimension invalidates the store.
+    """
+
+    def __init__(self, cache_dir: str = EMBEDDING_CACHE_DIR, model_name: str = "all-MiniLM-L6-v2",
+                 dim: int = 384, max_entries: int = MAX_ENTRIES):
+        self.cache_dir = cache_dir
+        self.model_name = model_name
+        self.dim = dim
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._touched = {}
+        self.hits = 0
+        self.misses = 0
+        self._state = (None, {})   # (vector map, key -> row), always replaced together
+        os.makedirs(cache_dir, exist_ok=True)
+        with self._lock:
+            self._load()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.cache_dir, name)
+
+    @contextmanager
+    def _file_lock(self, exclusive: bool):
+        with open(self._path(LOCK_FILE), "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_meta(self) -> dict:
+        try:
+            with open(self._path(META_FILE)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _snapshot(self):
+        """Reads keys, access times and a read-only vector map for the published count."""
+        meta = self._read_meta()
+        count = meta.get("count", 0)
+        if meta.get("model_name") != self.model_name or meta.get("dim") != self.dim or count == 0:
+            return meta, np.empty(0, dtype=f"S{KEY_BYTES}"), np.empty(0), None
+        keys = np.load(self._path(KEYS_FILE))[:count]
+        atime = np.load(self._path(ATIME_FILE))[:count]
+        vectors = np.memmap(self._path(VECTORS_FILE), dtype=np.float32, mode="r", shape=(count, self.dim))
+        return meta, keys, atime, vectors
+
+    def _load(self):
+        """Publishes the current on-disk snapshot to readers. Caller holds self._lock."""
+        with self._file_lock(exclusive=False):
+            meta, keys, atime, vectors = self._snapshot()
+        if meta and (meta.get("model_name") != self.model_name or meta.get("dim") != self.dim):
+            logger.info(
+                f"Embedding cache built for {meta.get('model_name')}/{meta.get('dim')}, "
+                f"invalidating for {self.model_name}/{self.dim}"
+            )
+            self._clear()
+            return
+        # One assignment, so a reader never pairs a new vector map with an old key index
+        self._state = (vectors, {k: i for i, k in enumerate(keys.tolist())})
+
+    def _publish(self, keys: np.ndarray, atime: np.ndarray):
+        """Atomically replaces the index files; meta.json goes last as the commit point."""
+        for name, array in ((KEYS_FILE, keys), (ATIME_FILE, atime)):
+            tmp = self._path(name + ".tmp.npy")
+            np.save(tmp, array)
+            os.replace(tmp, self._path(name))
+        tmp = self._path(META_FILE + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump({"model_name": self.model_name, "dim": self.dim, "count": int(len(keys))}, f)
+        os.replace(tmp, self._path(META_FILE))
+
+    def get_many(self, texts: list):
+        """
+        Looks up cached embeddings.
+
+        Returns:
+            tuple: (float32 array of shape (len(texts), dim), boolean mask of hits)
+        """
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        found = np.zeros(len(texts), dtype=bool)
+        now = time.time()
+        with self._lock:
+            vectors, index = self._state
+            for i, text in enumerate(texts):
+                key = cache_key(self.model_name, text)
+                row = index.get(key)
+                if row is not None:
+                    out[i] = vectors[row]
+                    found[i] = True
+                    self._touched[key] = now
+        self.hits += int(found.sum())
+        self.misses += int(len(texts) - found.sum())
+        metrics.inc("cache_requests_total", int(found.sum()), cache="embedding", result="hit")
+        metrics.inc("cache_requests_total", int(len(texts) - found.sum()), cache="embedding", result="miss")
+        return out, found
+
+    def put_many(self, texts: list, vectors: np.ndarray):
+        """
+        Appends embeddings for texts not yet stored and evicts if over capacity.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        now = time.time()
+        with self._lock:
+            with self._file_lock(exclusive=True):
+                self._append(texts, vectors, now)
+            # Reloaded before other threads can read, so they never see a stale index
+            self._load()
+
+    def _append(self, texts: list, vectors: np.ndarray, now: float):
+        """Writes new rows and republishes the index. Caller holds both locks."""
+        # Another process may have written since our snapshot
+        meta, keys, atime, _ = self._snapshot()
+        known = {k: i for i, k in enumerate(keys.tolist())}
+        atime = np.array(atime, dtype=np.float64)
+
+        new_keys, new_rows, pending = [], [], set()
+        for i, text in enumerate(texts):
+            key = cache_key(self.model_name, text)
+            if key in known or key in pending:
+                continue
+            pending.add(key)
+            new_keys.append(key)
+            new_rows.append(i)
+
+        for key, t in self._touched.items():
+            if key in known:
+                atime[known[key]] = max(atime[known[key]], t)
+        self._touched.clear()
+
+        if new_rows:
+            with open(self._path(VECTORS_FILE), "r+b" if keys.size else "wb") as f:
+                f.seek(len(keys) * self.dim * 4)
+                f.write(np.ascontiguousarray(vectors[new_rows]).tobytes())
+                f.truncate()
+            keys = np.concatenate([keys, np.array(new_keys, dtype=f"S{KEY_BYTES}")])
+            atime = np.concatenate([atime, np.full(len(new_keys), now)])
+
+        self._publish(keys, atime)
+        if len(keys) > self.max_entries:
+            self._evict(keys, atime)
+
+    def _evict(self, keys: np.ndarray, atime: np.ndarray):
+        """Rewrites the store keeping the most recently used entries. Caller holds the locks."""
+        keep = int(self.max_entries * EVICT_TO)
+        order = np.sort(np.argsort(atime)[::-1][:keep])
+        vectors = np.memmap(self._path(VECTORS_FILE), dtype=np.float32, mode="r",
+                            shape=(len(keys), self.dim))
+        tmp = self._path(VECTORS_FILE + ".tmp")
+        with open(tmp, "wb") as f:
+            for start in range(0, len(order), 65536):
+                f.write(np.asarray(vectors[order[start:start + 65536]]).tobytes())
+        del vectors
+        # Readers keep their mapping of the old file until they reload
+        os.replace(tmp, self._path(VECTORS_FILE))
+        self._publish(keys[order], atime[order])
+        logger.info(f"Evicted {len(keys) - len(order)} embeddings from cache")
+
+    def invalidate(self):
+        """Removes every stored embedding, e.g. after MODEL_NAME changes."""
+        with self._lock:
+            self._clear()
+
+    def _clear(self):
+        """Removes the store files and empties the published state. Caller holds self._lock."""
+        with self._file_lock(exclusive=True):
+            for name in (META_FILE, KEYS_FILE, ATIME_FILE, VECTORS_FILE):
+                try:
+                    os.remove(self._path(name))
+                except FileNotFoundError:
+                    pass
+        self._state = (None, {})
+        self._touched.clear()
+        logger.info(f"Embedding cache at {self.cache_dir} invalidated")
+
+    def encode(self, model, texts: list, batch_size: int = ENCODE_BATCH_SIZE) -> np.ndarray:
+        """
+        Returns embeddings for texts, encoding only the ones not cached yet.
+
+        Args:
+            model: SentenceTransformer used for cache misses.
+            texts (list[str]): Texts to embed.
+            batch_size (int): Encoding batch size for misses.
+
+        Returns:
+            np.ndarray: float32 array of shape (len(texts), dim).
+        """
+        texts = list(texts)
+        out, found = self.get_many(texts)
+        missing = [i for i in range(len(texts)) if not found[i]]
+        if missing:
+            # Encode each distinct normalized text once
+            first = {}
+            for i in missing:
+                first.setdefault(normalize_for_key(texts[i]), i)
+            unique_idx = list(first.values())
+            with metrics.span("embedding.model_encode"):
+                encoded = model.encode([texts[i] for i in unique_idx], batch_size=batch_size,
+                                       convert_to_numpy=True)
+            metrics.inc("texts_encoded_total", len(unique_idx))
+            by_key = dict(zip(first.keys(), encoded))
+            for i in missing:
+                out[i] = by_key[normalize_for_key(texts[i])]
+            self.put_many([texts[i] for i in unique_idx], encoded)
+        logger.info(f"Embedding cache: {len(texts) - len(missing)} hits, {len(missing)} encoded")
+        return out
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._state[1]),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+_CACHES = {}
+_CACHES_LOCK = threading.Lock()
+
+
+def get_embedding_cache(model_name: str = "all-MiniLM-L6-v2", dim: int = 384,
+                        cache_dir: str = EMBEDDING_CACHE_DIR) -> EmbeddingCache:
+    """Returns the process-wide cache for a model, opening it on first use."""
+    with _CACHES_LOCK:
+        key = (cache_dir, model_name, dim)
+        if key not in _CACHES:
+            _CACHES[key] = EmbeddingCache(cache_dir=cache_dir, model_name=model_name, dim=dim)
+        return _CACHES[key]
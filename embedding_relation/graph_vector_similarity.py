@@ -1,24 +1,34 @@
 # embed_and_link.py
 
+import time
 import pandas as pd
 import numpy as np
 from neo4j import GraphDatabase
-from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
 from utils.logger_config import get_logger
+from utils import metrics
+from utils.model_registry import MODEL_NAME
+from embedding_relation.embedding_cache import get_embedding_cache
+from embedding_relation.similarity_graph import top_k_similar
+from embedding_relation.ann_index import IVFIndex
+from embedding_relation.local_index import save_local_index
+from embedding_relation.text_encoding import encode_node_texts
 import os
 
 logger = get_logger(name=__name__, log_file="embedding_relation.log")
 
 # === CONFIG ===
-MODEL_NAME = "all-MiniLM-L6-v2"
 VECTOR_DIM = 384
 SIMILARITY_THRESHOLD = 0.6
 TOP_K = 5
-
-# === LOAD EMBEDDING MODEL ===
-
-model = SentenceTransformer(MODEL_NAME)
+WRITE_BATCH_SIZE = 1000      # rows per UNWIND transaction for embeddings and SIMILAR_TO edges
+USE_EMBEDDING_CACHE = True   # reuse embeddings stored on disk by earlier runs
+SIMILARITY_BACKEND = "auto"  # "exact" (blocked), "ivf" (approximate) or "auto"
+ANN_MIN_NODES = 50000        # "auto" switches to the IVF index above this many nodes
+ANN_NPROBE = 8               # IVF lists scanned per node; raise for recall, lower for speed
+ANN_INDEX_DIR = os.getenv("ANN_INDEX_DIR", "data/ann_index")
+SAVE_LOCAL_INDEX = True      # also write embeddings for the in-process retriever
+EMBEDDING_PROPERTY_TYPE = os.getenv("EMBEDDING_PROPERTY_TYPE", "list")  # "list" (float64) or "float32" (Neo4j 5.13+, half the size)
+EMBEDDING_SPOOL_DIR = os.getenv("EMBEDDING_SPOOL_DIR", "data/embeddings")  # .npy files filled chunk by chunk while encoding
 
 # === LOAD CSV DATA ===
 #csv_path = "data/manufacturing_service_data.csv"
@@ -37,6 +47,45 @@ except Exception as e:
 
 
 
+@metrics.timed("embedding.encode")
+def encode_texts(model, texts):
+    """
+    Encodes texts, going through the persistent embedding cache when enabled so
+    only texts never seen with MODEL_NAME reach the model.
+    """
+    if USE_EMBEDDING_CACHE:
+        return get_embedding_cache(MODEL_NAME, VECTOR_DIM).encode(model, texts)
+    metrics.inc("texts_encoded_total", len(texts))
+    return model.encode(texts, convert_to_numpy=True)
+
+@metrics.timed("embedding.similarity")
+def similar_edges(label, embeddings):
+    """
+    Returns (src, dst, score) arrays of SIMILAR_TO candidates among embeddings,
+    using exact blocked search or the IVF index depending on SIMILARITY_BACKEND.
+    The IVF index is saved under ANN_INDEX_DIR/<label> for reuse.
+    """
+    backend = SIMILARITY_BACKEND
+    if backend == "auto":
+        backend = "ivf" if len(embeddings) >= ANN_MIN_NODES else "exact"
+
+    if backend == "ivf":
+        index = IVFIndex(n_probe=ANN_NPROBE).build(embeddings)
+        try:
+            index.save(os.path.join(ANN_INDEX_DIR, label.lower()))
+        except OSError as e:
+            logger.warning(f"Could not persist IVF index for {label}: {e}")
+        return index.top_k_edges(top_k=TOP_K, threshold=SIMILARITY_THRESHOLD)
+    return top_k_similar(embeddings, top_k=TOP_K, threshold=SIMILARITY_THRESHOLD)
+
+def _save_local_index(label, texts, embeddings, index=None):
+    if not SAVE_LOCAL_INDEX:
+        return
+    try:
+        save_local_index(label, texts, embeddings, index=index)
+    except OSError as e:
+        logger.warning(f"Could not save local {label} index: {e}")
+
 # === LOAD CSV DATA ===
 def load_csv_for_embedding(csv_path: str):
     try:
@@ -100,6 +149,115 @@ def create_similar_relationship(tx, label, text_a, text_b, score):
     """
     tx.run(query, text_a=text_a, text_b=text_b, score=round(score, 3))
 
+def _chunks(rows, size):
+    for i in range(0, len(rows), size):
+        yield rows[i:i + size]
+
+def _write_unwind_batches(driver, query, batches, what, stage="neo4j.write"):
+    """
+    Runs an UNWIND query over each batch of rows, one managed transaction per
+    batch, and logs the achieved throughput. Batches may be produced lazily.
+    """
+    start = time.perf_counter()
+    total = 0
+    with driver.session() as session:
+        for batch in batches:
+            session.execute_write(lambda tx: tx.run(query, rows=batch).consume())
+            metrics.inc("batches_total", stage=stage)
+            total += len(batch)
+    metrics.inc("rows_total", total, stage=stage)
+    elapsed = time.perf_counter() - start
+    rate = total / elapsed if elapsed > 0 else 0.0
+    logger.info(f"Wrote {total} {what} in {elapsed:.2f}s - {rate:.0f}/sec")
+    return total
+
+@metrics.timed("neo4j.write_embeddings")
+def write_embeddings(driver, label, texts, embeddings, batch_size=WRITE_BATCH_SIZE, index=None):
+    """
+    Bulk version of update_node_embedding. Nodes are matched by their text key,
+    which is backed by the uniqueness constraint from knowledge_graph.schema.
+
+    With EMBEDDING_PROPERTY_TYPE "float32" the embedding is stored through
+    db.create.setNodeVectorProperty as a float32 array instead of a list of
+    float64 values, halving its size in the store and page cache.
+
+    Parameters
+    ----------
+    driver : neo4j.Driver
+        The Neo4j driver to use for the update
+    label : str
+        The label of the nodes to update or create
+    texts : list of str
+        The text property of each node
+    embeddings : numpy array
+        One embedding row per text, or per distinct text when `index` is given
+    batch_size : int
+        Number of nodes written per transaction
+    index : numpy array, optional
+        Row of `embeddings` for each text, so texts sharing a normalized form
+        share one embedding
+
+    Returns
+    -------
+    int
+        Number of embeddings written
+    """
+    if EMBEDDING_PROPERTY_TYPE == "float32":
+        query = f"""
+        UNWIND $rows AS row
+        MERGE (n:{label} {{text: row.text}})
+        WITH n, row
+        CALL db.create.setNodeVectorProperty(n, 'embedding', row.embedding)
+        """
+    else:
+        query = f"""
+        UNWIND $rows AS row
+        MERGE (n:{label} {{text: row.text}})
+        SET n.embedding = row.embedding
+        """
+    def batches():
+        # Rows are built per batch, so a memory-mapped matrix is read a slice at a time
+        for i in range(0, len(texts), batch_size):
+            rows = range(i, min(i + batch_size, len(texts)))
+            yield [
+                {"text": texts[k], "embedding": embeddings[k if index is None else index[k]].tolist()}
+                for k in rows
+            ]
+    return _write_unwind_batches(driver, query, batches(), f"{label} embeddings",
+                                 stage="neo4j.write_embeddings")
+
+@metrics.timed("neo4j.write_similar")
+def write_similar_relationships(driver, label, edges, batch_size=WRITE_BATCH_SIZE):
+    """
+    Bulk version of create_similar_relationship.
+
+    Parameters
+    ----------
+    driver : neo4j.Driver
+        The Neo4j driver to use for the update
+    label : str
+        The label of the nodes to link
+    edges : iterable of (str, str, float)
+        (text_a, text_b, score) triples, one per SIMILAR_TO relationship
+    batch_size : int
+        Number of relationships written per transaction
+
+    Returns
+    -------
+    int
+        Number of relationships written
+    """
+    query = f"""
+    UNWIND $rows AS row
+    MATCH (a:{label} {{text: row.a}})
+    MATCH (b:{label} {{text: row.b}})
+    MERGE (a)-[r:SIMILAR_TO]->(b)
+    SET r.score = row.score
+    """
+    rows = [{"a": a, "b": b, "score": round(float(score), 3)} for a, b, score in edges]
+    return _write_unwind_batches(driver, query, _chunks(rows, batch_size), f"{label} SIMILAR_TO edges",
+                                 stage="neo4j.write_similar")
+
 def process_node_type(driver, label, column_name, csv_path, model):
     """
     Process a column of the CSV data as a particular type of node, computing their
@@ -124,17 +282,48 @@ def process_node_type(driver, label, column_name, csv_path, model):
     logger.info(f"Processing {label} nodes from column: {column_name}")
     df = load_csv_for_embedding(csv_path)
     texts = df[column_name].dropna().unique().tolist()
+    process_node_texts(driver, label, texts, model)
 
+@metrics.timed("embedding.process_node_texts")
+def process_node_texts(driver, label, texts, model):
+    """
+    Embeds the given texts of a node type, stores the embeddings, rebuilds the
+    vector index and creates SIMILAR_TO relationships. Used directly by the
+    streaming pipeline, which collects the texts while loading the graph.
+
+    Texts are normalized (case, punctuation, whitespace, common misspellings)
+    and each distinct form is encoded once, in chunks spooled to
+    EMBEDDING_SPOOL_DIR (see embedding_relation.text_encoding). Nodes whose
+    texts share a form get the same embedding and a SIMILAR_TO edge with score
+    1.0 to the first of them.
+
+    Parameters
+    ----------
+    driver : neo4j.Driver
+        The Neo4j driver to use for the update
+    label : str
+        The label of the nodes to process
+    texts : list of str
+        Unique texts of the node type
+    model : SentenceTransformer
+        The embedding model
+
+    Returns
+    -------
+    None
+    """
+    texts = [t for t in texts if t]
     if not texts:
         logger.warning(f"No data found for {label}")
         return
 
-    embeddings = model.encode(texts, convert_to_numpy=True)
+    spool = os.path.join(EMBEDDING_SPOOL_DIR, f"{label.lower()}.npy")
+    _, embeddings, index = encode_node_texts(texts, model=model, out_path=spool,
+                                            use_cache=USE_EMBEDDING_CACHE)
 
     # Store embeddings in Neo4j
-    with driver.session() as session:
-        for text, vec in zip(texts, embeddings):
-            session.write_transaction(update_node_embedding, label, text, vec)
+    write_embeddings(driver, label, texts, embeddings, index=index)
+    _save_local_index(label, texts, embeddings, index=index)
 
     # Create vector index
     index_name = f"{label.lower()}_index"
@@ -152,17 +341,108 @@ def process_node_type(driver, label, column_name, csv_path, model):
             """
         )
 
-    # Create SIMILAR_TO edges
-    sim_matrix = cosine_similarity(embeddings)
-    with driver.session() as session:
-        for i, text_i in enumerate(texts):
-            top_idx = np.argsort(sim_matrix[i])[::-1][1:TOP_K+1]
-            for j in top_idx:
-                if sim_matrix[i][j] >= SIMILARITY_THRESHOLD:
-                    session.write_transaction(
-                        create_similar_relationship, label, text_i, texts[j], sim_matrix[i][j]
-                    )
+    # Create SIMILAR_TO edges between distinct forms, each represented by its first text
+    _, first = np.unique(index, return_index=True)
+    src, dst, scores = similar_edges(label, embeddings)
+    edges = [(texts[first[i]], texts[first[j]], score) for i, j, score in zip(src, dst, scores)]
+    edges += [(text, texts[first[index[k]]], 1.0) for k, text in enumerate(texts) if first[index[k]] != k]
+    write_similar_relationships(driver, label, edges)
 
     logger.info(f"{label} nodes processed with embeddings and SIMILAR_TO links")
 
 
+def ensure_vector_index(driver, label):
+    """
+    Creates the vector index for label if it does not exist yet. Unlike
+    process_node_type, the existing index is kept so it stays queryable while
+    new embeddings are added.
+    """
+    index_name = f"{label.lower()}_index"
+    with driver.session() as session:
+        exists = session.run(
+            "SHOW INDEXES YIELD name WHERE name = $name RETURN name", name=index_name
+        ).single()
+        if exists is None:
+            session.run(
+                f"""
+                CALL db.index.vector.createNodeIndex(
+                    '{index_name}', '{label}', 'embedding', {VECTOR_DIM}, 'cosine'
+                )
+                """
+            )
+            logger.info(f"Created vector index {index_name}")
+
+@metrics.timed("embedding.refresh_node_embeddings")
+def refresh_node_embeddings(driver, label, texts, model):
+    """
+    Incrementally embeds the given texts of a node type and links them to their
+    most similar nodes, leaving the rest of the label untouched.
+
+    Only texts whose node has no embedding yet are encoded. Their outgoing
+    SIMILAR_TO edges are recomputed against every embedded node of the label.
+
+    Parameters
+    ----------
+    driver : neo4j.Driver
+        The Neo4j driver to use for the update
+    label : str
+        The label of the nodes to refresh
+    texts : iterable of str
+        Texts touched by new or changed service requests
+    model : SentenceTransformer
+        The embedding model
+
+    Returns
+    -------
+    int
+        Number of texts that were embedded
+    """
+    texts = sorted({t for t in texts if t})
+    if not texts:
+        return 0
+
+    with driver.session() as session:
+        pending = [
+            r["text"] for r in session.run(
+                f"""
+                UNWIND $texts AS text
+                MATCH (n:{label} {{text: text}})
+                WHERE n.embedding IS NULL
+                RETURN n.text AS text
+                """,
+                texts=texts
+            )
+        ]
+    if not pending:
+        logger.info(f"No new {label} texts to embed")
+        return 0
+
+    _, embeddings, index = encode_node_texts(pending, model=model, use_cache=USE_EMBEDDING_CACHE)
+    embeddings = embeddings[index]
+    write_embeddings(driver, label, pending, embeddings)
+
+    ensure_vector_index(driver, label)
+
+    with driver.session() as session:
+        records = session.run(
+            f"MATCH (n:{label}) WHERE n.embedding IS NOT NULL RETURN n.text AS text, n.embedding AS embedding"
+        ).data()
+    all_texts = [r["text"] for r in records]
+    all_embeddings = np.array([r["embedding"] for r in records], dtype=np.float32)
+    _save_local_index(label, all_texts, all_embeddings)
+
+    position = {text: i for i, text in enumerate(all_texts)}
+    src, dst, scores = top_k_similar(
+        embeddings, all_embeddings, top_k=TOP_K, threshold=SIMILARITY_THRESHOLD,
+        self_index=[position.get(text, -1) for text in pending]
+    )
+    with driver.session() as session:
+        session.run(
+            f"UNWIND $texts AS text MATCH (:{label} {{text: text}})-[r:SIMILAR_TO]->() DELETE r",
+            texts=pending
+        )
+    edges = [(pending[i], all_texts[j], score) for i, j, score in zip(src, dst, scores)]
+    write_similar_relationships(driver, label, edges)
+
+    logger.info(f"Refreshed {len(pending)} {label} embeddings and their SIMILAR_TO links")
+    return len(pending)
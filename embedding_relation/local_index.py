@@ -0,0 +1,171 @@
+# local_index.py
+
+import json
+import os
+
+import numpy as np
+from embedding_relation.similarity_graph import normalize_rows
+from embedding_relation.quantization import quantize, approximate_scores, PRECISIONS
+from utils.logger_config import get_logger
+
+logger = get_logger(name=__name__, log_file="embedding_relation.log")
+
+# === CONFIG ===
+LOCAL_INDEX_DIR = os.getenv("LOCAL_INDEX_DIR", "data/local_index")
+LOCAL_INDEX_PRECISION = os.getenv("LOCAL_INDEX_PRECISION", "float32")  # "float32", "float16" or "int8"
+RESCORE_FACTOR = 4   # compact-vector candidates per result, rescored exactly; 0 returns compact scores
+# Keep the float32 rows next to the compact codes for exact rescoring; costs the full float32 size on disk
+LOCAL_INDEX_FLOAT32_SIDECAR = os.getenv("LOCAL_INDEX_FLOAT32_SIDECAR", "0").lower() in ("1", "true", "yes")
+
+VECTORS_FILE = "vectors.npy"
+CODES_FILE = "codes.npy"
+SCALES_FILE = "scales.npy"
+IDS_FILE = "ids.json"
+SAVE_CHUNK_ROWS = 65536   # rows normalized and written at a time
+
+
+def save_local_index(label: str, texts: list, embeddings, base_dir: str = LOCAL_INDEX_DIR,
+                     precision: str = LOCAL_INDEX_PRECISION, index=None,
+                     float32_sidecar: bool = LOCAL_INDEX_FLOAT32_SIDECAR):
+    """
+    Persists the embeddings of a node type as a normalized matrix plus the node
+    keys (texts) in row order, for in-process retrieval without Neo4j.
+
+    With precision "float16" or "int8" only the compact codes (plus per-vector
+    scales for int8) are stored, so the index is 2x or 4x smaller on disk as
+    well as in memory. `float32_sidecar` also keeps the float32 rows, which
+    searches memory-map to rescore their candidates exactly.
+
+    Rows are normalized and written SAVE_CHUNK_ROWS at a time, so a memory-mapped
+    `embeddings` is never loaded whole. `index` optionally gives the row of
+    `embeddings` for each text. Files are written to temporaries and renamed, so
+    open readers are not disturbed.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision: {precision}")
+    path = os.path.join(base_dir, label.lower())
+    os.makedirs(path, exist_ok=True)
+    n, dim = len(texts), embeddings.shape[1]
+
+    outputs = {}
+    if precision == "float32" or float32_sidecar:
+        outputs[VECTORS_FILE] = np.float32
+    if precision != "float32":
+        outputs[CODES_FILE] = np.dtype(precision)
+    if precision == "int8":
+        outputs[SCALES_FILE] = np.float32
+    arrays = {
+        name: np.lib.format.open_memmap(os.path.join(path, name + ".tmp.npy"), mode="w+", dtype=dtype,
+                                        shape=(n, dim) if name != SCALES_FILE else (n,))
+        for name, dtype in outputs.items()
+    }
+    for start in range(0, n, SAVE_CHUNK_ROWS):
+        rows = slice(start, min(start + SAVE_CHUNK_ROWS, n))
+        block = normalize_rows(embeddings[rows] if index is None else embeddings[index[rows]])
+        if VECTORS_FILE in arrays:
+            arrays[VECTORS_FILE][rows] = block
+        if precision != "float32":
+            codes, scales = quantize(block, precision)
+            arrays[CODES_FILE][rows] = codes
+            if scales is not None:
+                arrays[SCALES_FILE][rows] = scales
+
+    for name in (CODES_FILE, SCALES_FILE, VECTORS_FILE):
+        if name in arrays:
+            arrays[name].flush()
+            os.replace(os.path.join(path, name + ".tmp.npy"), os.path.join(path, name))
+        elif os.path.exists(os.path.join(path, name)):
+            os.remove(os.path.join(path, name))
+    del arrays
+    tmp = os.path.join(path, IDS_FILE + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(list(texts), f)
+    os.replace(tmp, os.path.join(path, IDS_FILE))
+    sidecar = " with float32 sidecar" if precision != "float32" and VECTORS_FILE in outputs else ""
+    logger.info(f"Saved local {label} index with {n} {precision} vectors{sidecar} to {path}")
+
+
+class LocalVectorIndex:
+    """
+    Memory-mapped embedding matrix with node ids, searched by exact cosine similarity.
+
+    When the index was saved with a compact precision, the float16/int8 codes
+    are held in memory and scanned instead. If a float32 sidecar was saved, the
+    best top_k * RESCORE_FACTOR candidates are rescored against their float32
+    rows; otherwise the compact scores, which equal dot products with the
+    dequantized codes, are final.
+    """
+
+    def __init__(self, ids: list, vectors: np.ndarray = None, codes: np.ndarray = None, scales: np.ndarray = None,
+                 rescore_factor: int = RESCORE_FACTOR):
+        self.ids = ids
+        self.vectors = vectors
+        self.codes = codes
+        self.scales = scales
+        self.rescore_factor = rescore_factor
+
+    @property
+    def precision(self) -> str:
+        return "float32" if self.codes is None else str(self.codes.dtype)
+
+    @property
+    def scan_bytes(self) -> int:
+        """Size of the matrix every search scans."""
+        if self.codes is None:
+            return self.vectors.nbytes
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    @classmethod
+    def load(cls, label: str, base_dir: str = LOCAL_INDEX_DIR):
+        path = os.path.join(base_dir, label.lower())
+        with open(os.path.join(path, IDS_FILE), encoding="utf-8") as f:
+            ids = json.load(f)
+        vectors = codes = scales = None
+        if os.path.exists(os.path.join(path, VECTORS_FILE)):
+            vectors = np.load(os.path.join(path, VECTORS_FILE), mmap_mode="r")
+        if os.path.exists(os.path.join(path, CODES_FILE)):
+            # Loaded into memory: the compact copy is what every search scans
+            codes = np.load(os.path.join(path, CODES_FILE))
+            if os.path.exists(os.path.join(path, SCALES_FILE)):
+                scales = np.load(os.path.join(path, SCALES_FILE))
+        rows = {len(a) for a in (vectors, codes, scales) if a is not None}
+        if not rows or rows != {len(ids)}:
+            raise ValueError(f"Local index at {path} is inconsistent: {len(ids)} ids, {sorted(rows)} vector rows")
+        index = cls(ids, vectors, codes, scales)
+        logger.info(f"Loaded local {label} index with {len(ids)} {index.precision} vectors from {path}")
+        return index
+
+    def __len__(self):
+        return len(self.ids)
+
+    def search(self, vector, top_k: int = 3) -> list:
+        """
+        Returns the top_k most similar node ids for one query vector.
+
+        Returns:
+            list[dict]: {"text": node id, "score": cosine similarity}, best first.
+        """
+        if not self.ids:
+            return []
+        query = normalize_rows(np.atleast_2d(vector))[0]
+        if self.codes is None:
+            scores = self.vectors @ query
+            best = _top(scores, top_k)
+            return [{"text": self.ids[i], "score": float(scores[i])} for i in best]
+
+        scores = approximate_scores(self.codes, self.scales, query)
+        if self.rescore_factor <= 0 or self.vectors is None:
+            best = _top(scores, top_k)
+            return [{"text": self.ids[i], "score": float(scores[i])} for i in best]
+
+        candidates = np.sort(_top(scores, top_k * self.rescore_factor))
+        exact = np.asarray(self.vectors[candidates], dtype=np.float32) @ query
+        best = _top(exact, top_k)
+        return [{"text": self.ids[candidates[i]], "score": float(exact[i])} for i in best]
+
+
+def _top(scores: np.ndarray, k: int) -> np.ndarray:
+    """Positions of the k highest scores, best first."""
+    k = min(k, len(scores))
+    best = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+    return best[np.argsort(-scores[best], kind="stable")]
@@ -0,0 +1,60 @@
+# quantization.py
+
+import numpy as np
+
+# === CONFIG ===
+PRECISIONS = ("float32", "float16", "int8")
+SCORE_BLOCK_ROWS = 4096    # compact rows widened to float32 at a time; small blocks stay in cache
+
+
+def quantize(vectors, precision: str):
+    """
+    Compacts unit-length float32 vectors for storage and scanning.
+
+    float16 halves the size. int8 quarters it with symmetric per-vector scales:
+    row i is stored as round(v / s_i) with s_i = max|v| / 127, so every row uses
+    the full int8 range.
+
+    Args:
+        vectors (np.ndarray): float32 matrix, one vector per row.
+        precision (str): "float32", "float16" or "int8".
+
+    Returns:
+        tuple: (codes, scales); scales is None unless precision is "int8".
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision: {precision}")
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if precision == "float32":
+        return vectors, None
+    if precision == "float16":
+        return vectors.astype(np.float16), None
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def dequantize(codes, scales=None) -> np.ndarray:
+    """Inverse of quantize, back to float32."""
+    vectors = np.asarray(codes, dtype=np.float32)
+    if scales is not None:
+        vectors = vectors * np.asarray(scales, dtype=np.float32)[:, None]
+    return vectors
+
+
+def approximate_scores(codes, scales, query, block_rows: int = SCORE_BLOCK_ROWS) -> np.ndarray:
+    """
+    Dot products of one float32 query with every compact row.
+
+    Rows are widened to float32 one block at a time, so the scan never holds a
+    full-precision copy of the matrix.
+    """
+    query = np.asarray(query, dtype=np.float32)
+    scores = np.empty(len(codes), dtype=np.float32)
+    for start in range(0, len(codes), block_rows):
+        block = np.asarray(codes[start:start + block_rows], dtype=np.float32)
+        scores[start:start + len(block)] = block @ query
+    if scales is not None:
+        scores *= scales
+    return scores
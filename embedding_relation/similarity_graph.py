@@ -0,0 +1,114 @@
+# similarity_graph.py
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from utils.logger_config import get_logger
+
+logger = get_logger(name=__name__, log_file="embedding_relation.log")
+
+# === CONFIG ===
+BLOCK_SIZE = 2048                    # upper bound on query rows per block
+MAX_BLOCK_BYTES = 256 * 1024 ** 2    # cap on one block's similarity matrix
+SIMILARITY_WORKERS = os.cpu_count() or 1
+
+
+def normalize_rows(vectors) -> np.ndarray:
+    """
+    Returns float32 unit-length copies of the rows so a dot product is the cosine similarity.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def _block_top_k(queries, corpus, start, top_k, threshold, self_index):
+    """
+    Scores one block of queries against the whole corpus and keeps the best top_k
+    per row above threshold, sorted by descending score.
+    """
+    sims = queries @ corpus.T
+    rows = np.arange(len(queries))
+    if self_index is not None:
+        own = self_index[start:start + len(queries)]
+        valid = own >= 0
+        sims[rows[valid], own[valid]] = -np.inf
+
+    k = min(top_k, corpus.shape[0])
+    if k < corpus.shape[0]:
+        idx = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+    else:
+        idx = np.broadcast_to(np.arange(corpus.shape[0]), (len(queries), corpus.shape[0]))
+    scores = np.take_along_axis(sims, idx, axis=1)
+    order = np.argsort(-scores, axis=1, kind="stable")
+    idx = np.take_along_axis(idx, order, axis=1)
+    scores = np.take_along_axis(scores, order, axis=1)
+
+    keep = scores >= threshold
+    src = np.repeat(rows + start, k).reshape(len(queries), k)
+    return src[keep], idx[keep], scores[keep]
+
+
+def top_k_similar(queries, corpus=None, top_k: int = 5, threshold: float = 0.6,
+                  self_index=None, block_size: int = BLOCK_SIZE,
+                  workers: int = SIMILARITY_WORKERS):
+    """
+    Finds the top_k most cosine-similar corpus rows for every query row.
+
+    Vectors are normalized once and multiplied in row blocks, so memory stays
+    bounded by the block size instead of growing with N x N. Each block picks its
+    neighbours with argpartition and applies the threshold before anything is
+    kept. Blocks are scored in parallel threads (NumPy releases the GIL in matmul).
+
+    Args:
+        queries: (n, d) array of query embeddings.
+        corpus: (m, d) array to search; defaults to the queries themselves.
+        top_k (int): Neighbours kept per query.
+        threshold (float): Minimum cosine similarity for a neighbour.
+        self_index: Optional (n,) array giving each query's own row in the corpus
+            (-1 if absent), which is excluded. Defaults to the identity when
+            corpus is None.
+        block_size (int): Upper bound on query rows scored at once.
+        workers (int): Number of threads scoring blocks.
+
+    Returns:
+        tuple: (src, dst, score) arrays, one entry per edge, grouped by src with
+            scores in descending order.
+    """
+    queries = normalize_rows(queries)
+    if corpus is None:
+        corpus = queries
+        if self_index is None:
+            self_index = np.arange(len(queries))
+    else:
+        corpus = normalize_rows(corpus)
+    if self_index is not None:
+        self_index = np.asarray(self_index)
+
+    empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))
+    if len(queries) == 0 or len(corpus) == 0 or top_k <= 0:
+        return empty
+
+    rows_per_block = max(1, min(block_size, MAX_BLOCK_BYTES // (4 * corpus.shape[0])))
+    starts = range(0, len(queries), rows_per_block)
+
+    def run(start):
+        return _block_top_k(queries[start:start + rows_per_block], corpus, start,
+                            top_k, threshold, self_index)
+
+    if workers > 1 and len(starts) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            parts = list(pool.map(run, starts))
+    else:
+        parts = [run(start) for start in starts]
+
+    src = np.concatenate([p[0] for p in parts])
+    dst = np.concatenate([p[1] for p in parts])
+    score = np.concatenate([p[2] for p in parts])
+    logger.info(
+        f"Scored {len(queries)}x{len(corpus)} similarities in {len(parts)} blocks "
+        f"of {rows_per_block} rows: {len(src)} edges"
+    )
+    return src, dst, score
@@ -0,0 +1,214 @@
+# text_encoding.py
+
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from multiprocessing import get_context
+
+import numpy as np
+from utils.logger_config import get_logger
+from utils import metrics
+from utils.model_registry import MODEL_NAME
+from embedding_relation.embedding_cache import get_embedding_cache
+
+logger = get_logger(name=__name__, log_file="embedding_relation.log")
+
+# === CONFIG ===
+VECTOR_DIM = 384
+ENCODE_CHUNK_SIZE = 2048       # texts per chunk handed to a worker
+ENCODE_BATCH_SIZE = 64         # model batch size inside a chunk
+ENCODE_PROCESSES = int(os.getenv("ENCODE_PROCESSES", "0"))  # 0 = auto, 1 = in-process
+MIN_TEXTS_PER_PROCESS = 5000   # below this many texts per worker, spawning costs more than it saves
+MAX_AUTO_PROCESSES = 4
+CACHE_FLUSH_ROWS = 32768       # encoded rows added to the embedding cache per index rewrite
+
+# Misspellings seen in service tickets and user questions
+MISSPELLINGS = {
+    "coolent": "coolant",
+    "colant": "coolant",
+    "coolnt": "coolant",
+    "hydrolic": "hydraulic",
+    "hydralic": "hydraulic",
+    "presure": "pressure",
+    "pressur": "pressure",
+    "temprature": "temperature",
+    "tempreture": "temperature",
+    "vibraton": "vibration",
+    "vibation": "vibration",
+    "spindel": "spindle",
+    "bearring": "bearing",
+    "lubricaton": "lubrication",
+    "overheting": "overheating",
+    "alighnment": "alignment",
+}
+
+_PUNCTUATION = re.compile(r"[^\w\s]+")
+_WORD = re.compile(r"\w+")
+
+
+def normalize_text(text: str) -> str:
+    """
+    Canonical form used for deduplication and encoding: case-folded, punctuation
+    replaced by spaces, whitespace collapsed and known misspellings corrected.
+    """
+    text = _PUNCTUATION.sub(" ", str(text).casefold())
+    return " ".join(MISSPELLINGS.get(word, word) for word in _WORD.findall(text))
+
+
+def dedupe_texts(texts: list):
+    """
+    Groups texts by their normalized form.
+
+    Returns:
+        tuple: (unique normalized texts in first-seen order, np.ndarray giving
+            the position in that list for every input text).
+    """
+    position, unique = {}, []
+    index = np.empty(len(texts), dtype=np.int64)
+    for i, text in enumerate(texts):
+        key = normalize_text(text)
+        pos = position.get(key)
+        if pos is None:
+            pos = position[key] = len(unique)
+            unique.append(key)
+        index[i] = pos
+    return unique, index
+
+
+def _auto_processes(n_texts: int) -> int:
+    if ENCODE_PROCESSES > 0:
+        return ENCODE_PROCESSES
+    cpus = os.cpu_count() or 1
+    return max(1, min(MAX_AUTO_PROCESSES, cpus, n_texts // MIN_TEXTS_PER_PROCESS))
+
+
+# --- worker processes ---
+
+_worker_model = None
+
+
+def _init_worker(model_name: str, threads: int):
+    global _worker_model
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    # Split the cores between workers instead of every worker using all of them
+    torch.set_num_threads(threads)
+    _worker_model = SentenceTransformer(model_name, device="cpu")
+
+
+def _encode_chunk(texts: list) -> np.ndarray:
+    vectors = _worker_model.encode(texts, batch_size=ENCODE_BATCH_SIZE, convert_to_numpy=True)
+    return np.asarray(vectors, dtype=np.float32)
+
+
+def encode_chunked(texts: list, model=None, model_name: str = MODEL_NAME, out_path: str = None,
+                   chunk_size: int = ENCODE_CHUNK_SIZE, processes: int = None, use_cache: bool = True,
+                   dim: int = VECTOR_DIM) -> np.ndarray:
+    """
+    Encodes texts in bounded chunks, optionally across a pool of CPU processes,
+    writing each chunk out as soon as it is done.
+
+    Texts found in the embedding cache are not encoded again, and new vectors
+    are added to it every CACHE_FLUSH_ROWS rows, so the cache index is not
+    rewritten per chunk. With `out_path` the result is a float32 .npy memmap on
+    disk, so only the chunks in flight are held in memory.
+
+    Args:
+        texts (list[str]): Texts to encode, typically already deduplicated.
+        model: Loaded SentenceTransformer for in-process encoding; loaded via
+            the model registry when needed and not given.
+        model_name (str): Model loaded by each worker process.
+        out_path (str): Optional .npy file receiving the embeddings.
+        chunk_size (int): Texts per chunk.
+        processes (int): Worker processes; None picks from ENCODE_PROCESSES and
+            the number of texts, 1 encodes in this process.
+        use_cache (bool): Read and fill the persistent embedding cache.
+
+    Returns:
+        np.ndarray: float32 embeddings of shape (len(texts), dim), a memmap when
+            `out_path` is given.
+    """
+    texts = list(texts)
+    if out_path:
+        os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+        out = np.lib.format.open_memmap(out_path, mode="w+", dtype=np.float32, shape=(len(texts), dim))
+    else:
+        out = np.zeros((len(texts), dim), dtype=np.float32)
+
+    cache = get_embedding_cache(model_name, dim) if use_cache else None
+    pending = []
+    for start in range(0, len(texts), chunk_size):
+        rows = np.arange(start, min(start + chunk_size, len(texts)))
+        if cache is not None:
+            cached, found = cache.get_many([texts[i] for i in rows])
+            out[rows[found]] = cached[found]
+            rows = rows[~found]
+        if len(rows):
+            pending.append(rows)
+
+    n_pending = sum(len(rows) for rows in pending)
+    processes = processes or _auto_processes(n_pending)
+
+    unflushed = []
+
+    def flush():
+        # Read back from the output, so only row numbers are held between flushes
+        if cache is not None and unflushed:
+            rows = np.concatenate(unflushed)
+            cache.put_many([texts[i] for i in rows], out[rows])
+        unflushed.clear()
+
+    def write(rows, vectors):
+        out[rows] = vectors
+        unflushed.append(rows)
+        if sum(len(r) for r in unflushed) >= CACHE_FLUSH_ROWS:
+            flush()
+        metrics.inc("texts_encoded_total", len(rows))
+
+    logger.info(f"Encoding {n_pending} of {len(texts)} texts in {len(pending)} chunks "
+                f"with {processes} process{'es' if processes > 1 else ''}")
+
+    with metrics.span("embedding.encode_chunked", processes=processes):
+        if processes <= 1:
+            if pending and model is None:
+                from utils.model_registry import get_model
+                model = get_model(model_name)
+            for rows in pending:
+                vectors = model.encode([texts[i] for i in rows], batch_size=ENCODE_BATCH_SIZE,
+                                       convert_to_numpy=True)
+                write(rows, np.asarray(vectors, dtype=np.float32))
+        else:
+            threads = max(1, (os.cpu_count() or 1) // processes)
+            with ProcessPoolExecutor(max_workers=processes, mp_context=get_context("spawn"),
+                                     initializer=_init_worker, initargs=(model_name, threads)) as pool:
+                # At most two chunks per worker in flight keeps memory bounded
+                queue = list(reversed(pending))
+                in_flight = {}
+                while queue or in_flight:
+                    while queue and len(in_flight) < 2 * processes:
+                        rows = queue.pop()
+                        in_flight[pool.submit(_encode_chunk, [texts[i] for i in rows])] = rows
+                    done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+                    for future in done:
+                        write(in_flight.pop(future), future.result())
+        flush()
+
+    if out_path:
+        out.flush()
+    return out
+
+
+def encode_node_texts(texts: list, model=None, out_path: str = None, **kwargs):
+    """
+    Normalizes and deduplicates node texts, then encodes each distinct form once.
+
+    Returns:
+        tuple: (unique normalized texts, their embeddings, index mapping every
+            input text to its row in the embeddings).
+    """
+    unique, index = dedupe_texts(texts)
+    if len(unique) < len(texts):
+        logger.info(f"{len(texts)} texts normalize to {len(unique)} distinct forms")
+    embeddings = encode_chunked(unique, model=model, out_path=out_path, **kwargs)
+    return unique, embeddings, index
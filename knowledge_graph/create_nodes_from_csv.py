@@ -1,44 +1,242 @@
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import pandas as pd
 from utils.logger_config import get_logger
+from utils import metrics
 
 logger = get_logger(name=__name__, log_file="knowledge_graph.log")
-def load_csv_and_create_nodes(driver, csv_path: str, cypher_query: str):
+
+# === CONFIG ===
+BATCH_SIZE = 1000          # rows sent per UNWIND transaction
+WRITER_SESSIONS = 1        # default writer sessions; concurrent MERGEs duplicate nodes without uniqueness constraints
+PARALLEL_WRITER_SESSIONS = 4  # writer sessions once apply_schema reports the constraints online
+MAX_BATCH_RETRIES = 3      # attempts per batch before it is reported as failed
+RETRY_BACKOFF_SECONDS = 1.0
+CSV_CHUNK_SIZE = 50000     # rows read from the CSV at a time
+
+# Rename columns to match expected Cypher query parameter names
+COLUMN_RENAMES = {
+    "SR ref no": "SR_ref_no",
+    "SR date": "SR_date",
+    "commission date": "commission_date",
+    "machine model": "machine_model",
+    "serial number": "serial_number",
+    "component serial number": "component_serial_number",
+    "sub assembly": "sub_assembly",
+    "problem summary": "problem_summary",
+    "problem reported": "problem_reported",
+    "failure mode": "failure_mode",
+    "corrective action": "corrective_action",
+    "product category": "product_category",
+    "assigned account": "assigned_account",
+    "type of activity": "type_of_activity",
+    "defect no": "defect_no",
+    "complaint category": "complaint_category"
+}
+
+
+def prepare_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Renames source columns to Cypher parameter names and fills NaN with empty strings.
+    """
+    return df.rename(columns=COLUMN_RENAMES).fillna("")
+
+
+def iter_csv_chunks(csv_path: str, chunksize: int = CSV_CHUNK_SIZE):
+    """
+    Reads the service CSV in bounded chunks.
+
+    Args:
+        csv_path (str): Path to the CSV file.
+        chunksize (int): Number of rows per chunk.
+
+    Yields:
+        pd.DataFrame: Renamed and NaN-filled chunk.
+    """
+    for chunk in pd.read_csv(csv_path, chunksize=chunksize):
+        metrics.inc("rows_total", len(chunk), stage="csv.read")
+        yield prepare_frame(chunk)
+
+
+def build_unwind_query(cypher_query: str) -> str:
+    """
+    Converts a per-row Cypher query into its batched form.
+
+    Every `$param` reference becomes `row.param` and the query is prefixed with
+    `UNWIND $rows AS row`, so one transaction can process a whole list of rows.
+
+    Args:
+        cypher_query (str): Per-row Cypher query using `$param` placeholders.
+
+    Returns:
+        str: Batched Cypher query expecting a `$rows` list parameter.
+    """
+    body = re.sub(r"\$(\w+)", r"row.\1", cypher_query)
+    return f"UNWIND $rows AS row\n{body}"
+
+
+def _write_batch(tx, query: str, rows: list):
+    tx.run(query, rows=rows).consume()
+
+
+def _run_batch(driver, query: str, rows: list, batch_no: int) -> bool:
+    """
+    Writes one batch in its own session, retrying with linear backoff.
+
+    Returns:
+        bool: True if the batch was committed, False once retries are exhausted.
+    """
+    for attempt in range(1, MAX_BATCH_RETRIES + 1):
+        try:
+            with metrics.span("neo4j.load.batch"):
+                with driver.session() as session:
+                    session.execute_write(_write_batch, query, rows)
+            metrics.inc("batches_total", stage="neo4j.load")
+            return True
+        except Exception as e:
+            metrics.inc("retries_total", component="neo4j.load")
+            logger.warning(
+                f"Batch {batch_no} failed (attempt {attempt}/{MAX_BATCH_RETRIES}): {e}"
+            )
+            if attempt < MAX_BATCH_RETRIES:
+                time.sleep(RETRY_BACKOFF_SECONDS * attempt)
+    metrics.inc("batches_failed_total", stage="neo4j.load")
+    logger.error(f"Batch {batch_no} with {len(rows)} rows failed permanently.")
+    return False
+
+
+def load_rows_batched(driver, df: pd.DataFrame, cypher_query: str,
+                      batch_size: int = BATCH_SIZE, workers: int = WRITER_SESSIONS) -> dict:
+    """
+    Loads a renamed DataFrame into Neo4j using UNWIND batches.
+
+    Batches are written by up to `workers` parallel sessions. Only use more than
+    one once the uniqueness constraints exist (see schema.constraints_online):
+    without them concurrent MERGEs of the same key create duplicate nodes.
+    Concurrent MERGEs on shared nodes can deadlock; those batches are retried
+    like any other failure.
+
+    Args:
+        driver: Neo4j driver instance.
+        df (pd.DataFrame): Rows with columns already renamed to query parameters.
+        cypher_query (str): Per-row Cypher query (converted with build_unwind_query).
+        batch_size (int): Number of rows per transaction.
+        workers (int): Number of parallel writer sessions.
+
+    Returns:
+        dict: Counts of loaded and failed rows plus the achieved rows/sec.
+    """
+    query = build_unwind_query(cypher_query)
+    records = df.fillna("").to_dict("records")
+    batches = [records[i:i + batch_size] for i in range(0, len(records), batch_size)]
+
+    start = time.perf_counter()
+    loaded = failed = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {
+            pool.submit(_run_batch, driver, query, batch, n): batch
+            for n, batch in enumerate(batches, start=1)
+        }
+        for future in as_completed(futures):
+            if future.result():
+                loaded += len(futures[future])
+            else:
+                failed += len(futures[future])
+
+    elapsed = time.perf_counter() - start
+    rate = loaded / elapsed if elapsed > 0 else 0.0
+    metrics.inc("rows_total", loaded, stage="neo4j.load")
+    metrics.inc("rows_failed_total", failed, stage="neo4j.load")
+    logger.info(
+        f"Loaded {loaded} rows in {len(batches)} batches ({failed} failed) "
+        f"in {elapsed:.2f}s - {rate:.0f} rows/sec"
+    )
+    return {"rows": loaded, "failed": failed, "seconds": elapsed, "rows_per_sec": rate}
+
+
+def load_rows_per_row(driver, df: pd.DataFrame, cypher_query: str) -> dict:
+    """
+    Loads a renamed DataFrame into Neo4j one auto-commit query per row.
+
+    Kept as a fallback for servers or queries where batching is not possible.
+    """
+    start = time.perf_counter()
+    loaded = failed = 0
+    with driver.session() as session:
+        for index, row in df.fillna("").iterrows():
+            params = row.to_dict()
+            try:
+                session.run(cypher_query, **params)
+                loaded += 1
+            except Exception as e:
+                failed += 1
+                logger.error(f"Failed to run Cypher query for row {index + 1}: {e}")
+
+    elapsed = time.perf_counter() - start
+    rate = loaded / elapsed if elapsed > 0 else 0.0
+    metrics.inc("rows_total", loaded, stage="neo4j.load")
+    metrics.inc("rows_failed_total", failed, stage="neo4j.load")
+    logger.info(f"Loaded {loaded} rows per-row ({failed} failed) - {rate:.0f} rows/sec")
+    return {"rows": loaded, "failed": failed, "seconds": elapsed, "rows_per_sec": rate}
+
+
+@metrics.timed("neo4j.load")
+def load_chunks_and_create_nodes(driver, chunks, cypher_query: str, batched: bool = True,
+                                 batch_size: int = BATCH_SIZE, workers: int = WRITER_SESSIONS) -> dict:
+    """
+    Loads an iterable of renamed DataFrame chunks into Neo4j.
+
+    Chunks can come from iter_csv_chunks or db.postgre_load.stream_table, so only
+    one chunk is held in memory at a time.
+
+    Args:
+        driver: Neo4j driver instance.
+        chunks: Iterable of renamed, NaN-filled DataFrames.
+        cypher_query (str): Per-row Cypher query using `$param` placeholders.
+        batched (bool): Use UNWIND batches; False falls back to one query per row.
+        batch_size (int): Rows per batch in batched mode.
+        workers (int): Parallel writer sessions in batched mode.
+
+    Returns:
+        dict: Load statistics summed over all chunks.
+    """
+    totals = {"rows": 0, "failed": 0, "seconds": 0.0}
+    for chunk in chunks:
+        if batched:
+            stats = load_rows_batched(driver, chunk, cypher_query, batch_size=batch_size, workers=workers)
+        else:
+            stats = load_rows_per_row(driver, chunk, cypher_query)
+        for key in totals:
+            totals[key] += stats[key]
+    totals["rows_per_sec"] = totals["rows"] / totals["seconds"] if totals["seconds"] > 0 else 0.0
+    return totals
+
+
+def load_csv_and_create_nodes(driver, csv_path: str, cypher_query: str, batched: bool = True,
+                              batch_size: int = BATCH_SIZE, workers: int = WRITER_SESSIONS):
+    """
+    Loads the service CSV into Neo4j, reading it in chunks.
+
+    Args:
+        driver: Neo4j driver instance.
+        csv_path (str): Path to the CSV file.
+        cypher_query (str): Per-row Cypher query using `$param` placeholders.
+        batched (bool): Use UNWIND batches; False falls back to one query per row.
+        batch_size (int): Rows per batch in batched mode.
+        workers (int): Parallel writer sessions in batched mode.
+
+    Returns:
+        dict or None: Load statistics, or None if the load failed.
+    """
     try:
-        df = pd.read_csv(csv_path)
-        logger.info(f"Loaded CSV with {len(df)} rows from '{csv_path}'")
-
-        # Rename columns to match expected Cypher query parameter names
-        df.rename(columns={
-            "SR ref no": "SR_ref_no",
-            "SR date": "SR_date",
-            "commission date": "commission_date",
-            "machine model": "machine_model",
-            "serial number": "serial_number",
-            "component serial number": "component_serial_number",
-            "sub assembly": "sub_assembly",
-            "problem summary": "problem_summary",
-            "problem reported": "problem_reported",
-            "failure mode": "failure_mode",
-            "corrective action": "corrective_action",
-            "product category": "product_category",
-            "assigned account": "assigned_account",
-            "type of activity": "type_of_activity",
-            "defect no": "defect_no",
-            "complaint category": "complaint_category"
-        }, inplace=True)
-
-        # Fill NaN with empty string to avoid parameter issues
-        df.fillna("", inplace=True)
-        
-        df.to_csv("data/service_records_after_renaming.csv", index=False)
-
-        with driver.session() as session:
-            for index, row in df.iterrows():
-                params = row.to_dict()
-                try:
-                    session.run(cypher_query, **params)
-                except Exception as e:
-                    logger.error(f"Failed to run Cypher query for row {index + 1}: {e}")
+        stats = load_chunks_and_create_nodes(
+            driver, iter_csv_chunks(csv_path), cypher_query,
+            batched=batched, batch_size=batch_size, workers=workers
+        )
+        logger.info(f"Loaded CSV with {stats['rows']} rows from '{csv_path}'")
+        return stats
 
     except Exception as e:
         logger.error(f"Error loading CSV or creating nodes: {e}")
@@ -0,0 +1,265 @@
+# incremental_refresh.py
+
+import hashlib
+import json
+import time
+
+import pandas as pd
+from knowledge_graph.create_nodes_from_csv import load_rows_batched, BATCH_SIZE, WRITER_SESSIONS
+from knowledge_graph.neo4j_load import get_graph_state, set_graph_state, bump_graph_version, GRAPH_STATE_LABEL
+from knowledge_graph.problem_context import problems_for_requests
+from utils.logger_config import get_logger
+from utils import metrics
+
+logger = get_logger(name=__name__, log_file="knowledge_graph.log")
+
+# === CONFIG ===
+ID_COLUMN = "SR_ref_no"
+WATERMARK_COLUMN = "SR_date"
+RETIRE_BATCH_SIZE = 5000
+
+
+def row_fingerprint(row: dict) -> str:
+    """
+    Returns a content hash of a renamed service request row.
+
+    Values are serialized with sorted keys, so column order does not matter.
+    """
+    payload = json.dumps(row, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def fetch_fingerprints(driver) -> dict:
+    """
+    Reads the stored content hash of every ServiceRequest in the graph.
+
+    Returns:
+        dict: Mapping of service request id to content hash (None if never hashed).
+    """
+    with driver.session() as session:
+        result = session.run("MATCH (sr:ServiceRequest) RETURN sr.id AS id, sr.content_hash AS hash")
+        return {r["id"]: r["hash"] for r in result}
+
+
+# Takes each request off the shared edges it was loaded onto (keys stored on the
+# request by the load query), deletes the edges no other request still counts
+# and returns the entities the request pointed at, the only nodes it can orphan
+RELEASE_SHARED_EDGES_QUERY = """
+UNWIND $ids AS id
+MATCH (sr:ServiceRequest {id: id})
+OPTIONAL MATCH (sr)-[:ON_MACHINE]->(machine:Machine)
+OPTIONAL MATCH (machine)-[made_by:MADE_BY]->(make:Make {name: sr.make})
+OPTIONAL MATCH (machine)-[belongs_to:BELONGS_TO]->(category:ProductCategory {name: sr.product_category})
+OPTIONAL MATCH (machine)-[has_component:HAS_COMPONENT]->(component:Component {serial: sr.component_serial, name: sr.component_name})
+OPTIONAL MATCH (component)-[has_problem:HAS_PROBLEM]->(problem:Problem {text: sr.problem_text})
+OPTIONAL MATCH (problem)-[defined_by:DEFINED_BY]->(defect:Defect {code: sr.defect_code})
+OPTIONAL MATCH (problem)-[has_failure_mode:HAS_FAILURE_MODE]->(failure:FailureMode {type: sr.failure_mode})
+OPTIONAL MATCH (problem)-[caused_by:CAUSED_BY]->(cause:Cause {text: sr.cause_text})
+OPTIONAL MATCH (cause)-[resolved_by:RESOLVED_BY]->(action:CorrectiveAction {text: sr.action_text})
+WITH [made_by, belongs_to, has_component, has_problem, defined_by, has_failure_mode, caused_by, resolved_by] AS rels,
+     [(sr)-->(n) | n] + [make, category, component, problem, defect, failure, cause, action] AS nodes
+CALL {
+    WITH rels
+    UNWIND [r IN rels WHERE r IS NOT NULL] AS r
+    SET r.requests = r.requests - 1
+    WITH r WHERE r.requests <= 0
+    DELETE r
+}
+UNWIND [n IN nodes WHERE n IS NOT NULL] AS n
+RETURN DISTINCT elementId(n) AS node
+"""
+
+
+def _release_shared_edges(session, ids: list) -> set:
+    """Releases the shared edges of `ids`; returns the element ids of the entities they pointed at."""
+    return {record["node"] for record in session.run(RELEASE_SHARED_EDGES_QUERY, ids=ids)}
+
+
+def _detach_service_requests(driver, ids: list) -> set:
+    """
+    Removes the outgoing relationships of changed requests before they are reloaded,
+    so stale links (e.g. a corrected customer) do not survive the update. The
+    requests are also taken off the shared edges between their machine, make,
+    category, component, problem, defect, failure mode, cause and action, so a
+    corrected value is unlinked once no other request reports it.
+
+    Returns:
+        set: Element ids of the entities the old rows pointed at, to be pruned
+            once the new rows are loaded (see _prune_orphans).
+    """
+    with driver.session() as session:
+        released = _release_shared_edges(session, ids)
+        session.run(
+            """
+            UNWIND $ids AS id
+            MATCH (sr:ServiceRequest {id: id})-[r]->()
+            DELETE r
+            """,
+            ids=ids
+        ).consume()
+    return released
+
+
+def _prune_orphans(session, nodes, batch_size: int) -> int:
+    """
+    Removes the given entity nodes (element ids) that are left without any
+    relationship other than SIMILAR_TO. Only the entities of released requests
+    are checked, so the cost follows the size of the delta, not of the graph.
+    """
+    nodes = list(nodes)
+    total = 0
+    for i in range(0, len(nodes), batch_size):
+        total += session.run(
+            """
+            UNWIND $nodes AS node
+            MATCH (n) WHERE elementId(n) = node
+              AND NOT EXISTS { MATCH (n)-[r]-() WHERE type(r) <> 'SIMILAR_TO' }
+            DETACH DELETE n
+            RETURN count(*) AS pruned
+            """,
+            nodes=nodes[i:i + batch_size]
+        ).single()["pruned"]
+    return total
+
+
+def retire_service_requests(driver, ids: list, batch_size: int = RETIRE_BATCH_SIZE) -> int:
+    """
+    Deletes service requests that disappeared from the source along with the
+    shared edges only they supported, then removes the entities they pointed at
+    that are left without any relationship other than SIMILAR_TO.
+
+    Returns:
+        int: Number of service requests deleted.
+    """
+    retired = 0
+    released = set()
+    with driver.session() as session:
+        for i in range(0, len(ids), batch_size):
+            batch = ids[i:i + batch_size]
+            released |= _release_shared_edges(session, batch)
+            session.run(
+                "UNWIND $ids AS id MATCH (sr:ServiceRequest {id: id}) DETACH DELETE sr",
+                ids=batch
+            ).consume()
+            retired += len(batch)
+        _prune_orphans(session, released, batch_size)
+
+    logger.info(f"Retired {retired} service requests.")
+    return retired
+
+
+@metrics.timed("neo4j.incremental_refresh")
+def incremental_refresh(driver, chunks, cypher_query: str, text_columns: dict,
+                        append_only: bool = False, batch_size: int = BATCH_SIZE,
+                        workers: int = WRITER_SESSIONS) -> dict:
+    """
+    Applies only the differences between the source rows and the graph.
+
+    Each row is fingerprinted by its service request id plus a content hash.
+    New and changed requests are upserted, requests missing from the source are
+    retired, and the texts touched by the changes are collected so only those
+    need to be re-embedded. Problems on the machines of changed requests (before
+    and after the change) are collected so their materialized context can be
+    refreshed.
+
+    Args:
+        driver: Neo4j driver instance.
+        chunks: Iterable of renamed, NaN-filled DataFrames (see iter_csv_chunks).
+        cypher_query (str): Per-row Cypher query using `$param` placeholders. It
+            receives each row's hash as `$content_hash` and must store it on the
+            ServiceRequest (see main.CYPHER_QUERY).
+        text_columns (dict): Node label -> renamed column holding its text.
+        append_only (bool): Skip rows dated before the stored watermark and never
+            retire requests. Faster for sources that only ever grow.
+        batch_size (int): Rows per UNWIND batch.
+        workers (int): Parallel writer sessions.
+
+    Returns:
+        dict: Counts of new, changed, unchanged and retired requests, the new
+            watermark, the affected texts per label and the touched problems.
+    """
+    start = time.perf_counter()
+    existing = fetch_fingerprints(driver)
+    state = get_graph_state(driver)
+    watermark = state.get("watermark") if append_only else None
+    logger.info(f"Graph holds {len(existing)} service requests (watermark: {state.get('watermark')}).")
+
+    seen = set()
+    new_max = state.get("watermark")
+    affected = {label: set() for label in text_columns}
+    touched_problems = set()
+    released = set()
+    stats = {"new": 0, "changed": 0, "unchanged": 0, "skipped": 0, "retired": 0, "failed": 0}
+
+    for chunk in chunks:
+        if append_only and watermark and WATERMARK_COLUMN in chunk:
+            older = chunk[WATERMARK_COLUMN].astype(str) < str(watermark)
+            stats["skipped"] += int(older.sum())
+            chunk = chunk[~older]
+        if chunk.empty:
+            continue
+
+        records = chunk.to_dict("records")
+        hashes = [row_fingerprint(row) for row in records]
+        ids = [row[ID_COLUMN] for row in records]
+        seen.update(ids)
+
+        upserts, changed_ids = [], []
+        for row, sr_id, digest in zip(records, ids, hashes):
+            if sr_id not in existing:
+                stats["new"] += 1
+            elif existing[sr_id] != digest:
+                stats["changed"] += 1
+                changed_ids.append(sr_id)
+            else:
+                stats["unchanged"] += 1
+                continue
+            upserts.append((row, digest))
+
+        if WATERMARK_COLUMN in chunk and len(chunk):
+            chunk_max = str(chunk[WATERMARK_COLUMN].astype(str).max())
+            new_max = max(new_max, chunk_max) if new_max else chunk_max
+
+        if not upserts:
+            continue
+
+        if changed_ids:
+            touched_problems |= problems_for_requests(driver, changed_ids)
+            released |= _detach_service_requests(driver, changed_ids)
+
+        # The load query stores the hash in the same transaction as the row, so a
+        # committed batch is never counted twice and a failed one is retried next time
+        rows = [{**row, "content_hash": digest} for row, digest in upserts]
+        result = load_rows_batched(
+            driver, pd.DataFrame.from_records(rows), cypher_query,
+            batch_size=batch_size, workers=workers
+        )
+        stats["failed"] += result["failed"]
+        if result["failed"]:
+            logger.warning(f"{result['failed']} rows failed to load; they keep their old fingerprints and are retried.")
+
+        for label, column in text_columns.items():
+            affected[label].update(row[column] for row in rows if row.get(column))
+        touched_problems |= problems_for_requests(driver, [row[ID_COLUMN] for row in rows])
+
+    if not append_only:
+        retired = [sr_id for sr_id in existing if sr_id not in seen]
+        if retired:
+            touched_problems |= problems_for_requests(driver, retired)
+            stats["retired"] = retire_service_requests(driver, retired)
+    if released:
+        # Entities only the old versions of changed requests pointed at
+        with driver.session() as session:
+            _prune_orphans(session, released, RETIRE_BATCH_SIZE)
+
+    if new_max:
+        set_graph_state(driver, watermark=new_max)
+    if stats["new"] or stats["changed"] or stats["retired"]:
+        bump_graph_version(driver)
+
+    for kind in ("new", "changed", "unchanged", "retired"):
+        metrics.inc("service_requests_total", stats[kind], kind=kind)
+    elapsed = time.perf_counter() - start
+    logger.info(f"Incremental refresh finished in {elapsed:.2f}s: {stats}")
+    return {**stats, "watermark": new_max, "affected_texts": affected,
+            "touched_problems": touched_problems, "seconds": elapsed}
@@ -1,8 +1,8 @@
 import os
-from neo4j import GraphDatabase
+from neo4j import GraphDatabase, AsyncGraphDatabase
 from utils.logger_config import get_logger
+from utils import metrics
 from dotenv import load_dotenv
-from langchain_community.graphs import Neo4jGraph
 
 load_dotenv()  # Make sure environment variables are loaded
 
@@ -21,6 +21,11 @@ except Exception as e:
     logger.error(f"Failed to load Neo4j environment variables: {e}")
     NEO4J_URI = NEO4J_USER = NEO4J_PASSWORD = None
 
+DELETE_BATCH_SIZE = 10000
+
+# Bookkeeping node holding the graph version and ingestion watermark
+GRAPH_STATE_LABEL = "GraphState"
+GRAPH_STATE_NAME = "service_requests"
 
 # def connect_to_neo4j():
 #     """
@@ -50,10 +55,15 @@ def connect_to_neo4j():
         Tuple[langchain_neo4j.Neo4jGraph, neo4j.GraphDatabase.driver] or None
     """
     try:
+        # Imported lazily to keep langchain off the import path of ingestion-only code
+        from langchain_community.graphs import Neo4jGraph
+
         graph = Neo4jGraph(
             url=NEO4J_URI,
             username=NEO4J_USER,
-            password=NEO4J_PASSWORD
+            password=NEO4J_PASSWORD,
+            # The QA engine pulls the schema when it first needs it
+            refresh_schema=False
         )
         
         logger.info("Connected to Neo4j successfully using Neo4jGraph.")
@@ -64,6 +74,28 @@ def connect_to_neo4j():
         logger.error(f"Failed to connect to Neo4j: {e}")
         return None
 
+def connect_to_neo4j_async():
+    """
+    Creates an async Neo4j driver for the concurrent query path (query.async_query).
+
+    The driver keeps its own connection pool and must be used from a single
+    event loop.
+
+    Returns:
+        neo4j.AsyncDriver or None
+    """
+    try:
+        if not all([NEO4J_URI, NEO4J_USER, NEO4J_PASSWORD]):
+            raise EnvironmentError("Neo4j credentials are not properly set.")
+
+        driver = AsyncGraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
+        logger.info("Created async Neo4j driver.")
+        return driver
+
+    except Exception as e:
+        logger.error(f"Failed to create async Neo4j driver: {e}")
+        return None
+
 def create_node(driver,knowledge_graph_code):
     with driver.session() as session:
         result = session.run(f"{knowledge_graph_code}")
@@ -78,17 +110,92 @@ def read_nodes(driver):
             logger.info(f"Read node: {record['n']}")
             print(record['n'])
             
-def delete_knowledge_graph(driver):
+@metrics.timed("neo4j.delete")
+def delete_knowledge_graph(driver, batch_size: int = DELETE_BATCH_SIZE):
     """
     Deletes all nodes and relationships in the Neo4j knowledge graph.
 
+    Nodes are detached and deleted in batches of `batch_size`, each in its own
+    transaction, so large graphs do not have to fit in a single transaction.
+    The graph state node is kept so the graph version keeps increasing; its
+    other properties (e.g. the watermark) are cleared, so the reload starts
+    from the first row.
+
     Args:
         driver: Neo4j driver instance used to connect to the database.
+        batch_size (int): Number of nodes deleted per transaction.
+
+    Returns:
+        int: Number of nodes deleted.
+    """
+
+    deleted = 0
+    with driver.session() as session:
+        while True:
+            count = session.run(
+                f"""
+                MATCH (n)
+                WHERE NOT n:{GRAPH_STATE_LABEL}
+                WITH n LIMIT $batch_size
+                DETACH DELETE n
+                RETURN count(*) AS deleted
+                """,
+                batch_size=batch_size
+            ).single()["deleted"]
+            deleted += count
+            if count < batch_size:
+                break
+        session.run(
+            f"MATCH (s:{GRAPH_STATE_LABEL} {{name: $name}}) SET s = {{name: s.name, version: s.version}}",
+            name=GRAPH_STATE_NAME
+        ).consume()
+    logger.info(f"Knowledge graph deleted successfully ({deleted} nodes).")
+    return deleted
+
+
+def get_graph_state(driver) -> dict:
+    """
+    Reads the ingestion bookkeeping node (graph version and watermark).
 
     Returns:
-        None
+        dict: Properties of the state node, empty if the graph was never loaded.
+    """
+    with driver.session() as session:
+        record = session.run(
+            f"MATCH (s:{GRAPH_STATE_LABEL} {{name: $name}}) RETURN properties(s) AS state",
+            name=GRAPH_STATE_NAME
+        ).single()
+    return dict(record["state"]) if record else {}
+
+
+def set_graph_state(driver, **properties):
     """
+    Stores properties (e.g. watermark) on the ingestion bookkeeping node.
+    """
+    with driver.session() as session:
+        session.run(
+            f"MERGE (s:{GRAPH_STATE_LABEL} {{name: $name}}) SET s += $props",
+            name=GRAPH_STATE_NAME, props=properties
+        ).consume()
+
+
+def bump_graph_version(driver) -> int:
+    """
+    Increments the graph version after ingestion changed the graph.
+
+    Query-side caches compare this version to decide when to refresh.
 
+    Returns:
+        int: The new graph version.
+    """
     with driver.session() as session:
-        session.run("MATCH (n) DETACH DELETE n")
-        logger.info("Knowledge graph deleted successfully.")
+        version = session.run(
+            f"""
+            MERGE (s:{GRAPH_STATE_LABEL} {{name: $name}})
+            SET s.version = coalesce(s.version, 0) + 1, s.updated_at = datetime()
+            RETURN s.version AS version
+            """,
+            name=GRAPH_STATE_NAME
+        ).single()["version"]
+    logger.info(f"Graph version bumped to {version}.")
+    return version
@@ -0,0 +1,146 @@
+# problem_context.py
+
+import time
+from utils.logger_config import get_logger
+from utils import metrics
+
+logger = get_logger(name=__name__, log_file="knowledge_graph.log")
+
+# === CONFIG ===
+TOP_N = 5                    # causes, actions and machine models kept per problem
+CONTEXT_BATCH_SIZE = 1000    # problems materialized per transaction
+
+# Columns read by retrieval; replaces the per-hit traversal with property reads
+CONTEXT_PROJECTION = """
+    coalesce(problem.context_causes, []) AS causes,
+    coalesce(problem.context_actions, []) AS actions,
+    coalesce(problem.context_machines, []) AS machines,
+    problem.context_text AS context
+"""
+
+AGGREGATE_QUERY = """
+UNWIND $texts AS text
+MATCH (problem:Problem {text: text})
+CALL {
+    WITH problem
+    // Requests reporting this cause for this problem; only the problem's own edges are read
+    MATCH (problem)-[caused_by:CAUSED_BY]->(cause:Cause)
+    WITH cause, coalesce(caused_by.requests, 1) AS n
+    ORDER BY n DESC LIMIT $top_n
+    RETURN collect(cause.text) AS causes, collect(n) AS cause_counts
+}
+CALL {
+    WITH problem
+    MATCH (problem)-[:CAUSED_BY]->(:Cause)-[:RESOLVED_BY]->(action:CorrectiveAction)
+    WITH action, count(*) AS n
+    ORDER BY n DESC LIMIT $top_n
+    RETURN collect(action.text) AS actions, collect(n) AS action_counts
+}
+CALL {
+    WITH problem
+    MATCH (machine:Machine)-[:HAS_COMPONENT]->(:Component)-[:HAS_PROBLEM]->(problem)
+    OPTIONAL MATCH (sr:ServiceRequest)-[:ON_MACHINE]->(machine)
+    WITH machine.model AS model, count(DISTINCT sr) AS n
+    ORDER BY n DESC LIMIT $top_n
+    RETURN collect(model) AS machines, collect(n) AS machine_counts
+}
+CALL {
+    WITH problem
+    MATCH (sr:ServiceRequest)-[:ON_MACHINE]->(:Machine)-[:HAS_COMPONENT]->(:Component)-[:HAS_PROBLEM]->(problem)
+    RETURN count(DISTINCT sr) AS request_count
+}
+RETURN problem.text AS text, causes, cause_counts, actions, action_counts,
+       machines, machine_counts, request_count
+"""
+
+WRITE_QUERY = """
+UNWIND $rows AS row
+MATCH (problem:Problem {text: row.text})
+SET problem.context_causes = row.causes,
+    problem.context_cause_counts = row.cause_counts,
+    problem.context_actions = row.actions,
+    problem.context_action_counts = row.action_counts,
+    problem.context_machines = row.machines,
+    problem.context_machine_counts = row.machine_counts,
+    problem.context_request_count = row.request_count,
+    problem.context_text = row.context,
+    problem.context_updated_at = datetime()
+"""
+
+
+def _with_counts(values: list, counts: list, unit: str = "") -> str:
+    if not values:
+        return "Not available"
+    return ", ".join(f"{v} ({n}{unit})" for v, n in zip(values, counts))
+
+
+def render_problem_context(record: dict) -> str:
+    """Pre-renders the LLM context of one problem from its aggregated record."""
+    return "\n".join([
+        f"Problem: {record['text']}",
+        f"Causes: {_with_counts(record['causes'], record['cause_counts'], ' requests')}",
+        f"Corrective Actions: {_with_counts(record['actions'], record['action_counts'], ' causes')}",
+        f"Machines: {_with_counts(record['machines'], record['machine_counts'], ' requests')}",
+        f"Service Requests: {record['request_count']}",
+    ])
+
+
+def problems_for_requests(driver, ids: list) -> set:
+    """
+    Problem texts whose context depends on the given service requests, i.e. the
+    problems on the machines the requests point at.
+    """
+    if not ids:
+        return set()
+    with driver.session() as session:
+        result = session.run(
+            """
+            UNWIND $ids AS id
+            MATCH (:ServiceRequest {id: id})-[:ON_MACHINE]->(:Machine)-[:HAS_COMPONENT]->(:Component)-[:HAS_PROBLEM]->(problem:Problem)
+            RETURN DISTINCT problem.text AS text
+            """,
+            ids=ids
+        )
+        return {record["text"] for record in result}
+
+
+@metrics.timed("neo4j.problem_context")
+def materialize_problem_context(driver, texts=None, include_missing: bool = True, top_n: int = TOP_N,
+                                batch_size: int = CONTEXT_BATCH_SIZE) -> int:
+    """
+    Stores a compact, precomputed context on Problem nodes: top causes, actions
+    and machine models with counts, the number of service requests, and a
+    pre-rendered context string. Retrieval then reads these properties instead
+    of traversing the graph for every hit.
+
+    Args:
+        driver: Neo4j driver instance.
+        texts (iterable): Problem texts to refresh; None refreshes every problem.
+        include_missing (bool): Also materialize problems that have no context
+            yet, e.g. on a graph loaded before this stage existed.
+        top_n (int): Entries kept per list.
+        batch_size (int): Problems per transaction.
+
+    Returns:
+        int: Number of problems materialized.
+    """
+    start = time.perf_counter()
+    with driver.session() as session:
+        if texts is None:
+            texts = [r["text"] for r in session.run("MATCH (p:Problem) RETURN p.text AS text")]
+        elif include_missing:
+            texts = set(texts) | {r["text"] for r in session.run(
+                "MATCH (p:Problem) WHERE p.context_updated_at IS NULL RETURN p.text AS text"
+            )}
+        texts = [t for t in texts if t]
+
+        done = 0
+        for i in range(0, len(texts), batch_size):
+            records = [r.data() for r in session.run(AGGREGATE_QUERY, texts=texts[i:i + batch_size], top_n=top_n)]
+            rows = [{**r, "context": render_problem_context(r)} for r in records]
+            session.run(WRITE_QUERY, rows=rows).consume()
+            done += len(rows)
+            metrics.inc("rows_total", len(rows), stage="neo4j.problem_context")
+
+    logger.info(f"Materialized context for {done} problems in {time.perf_counter() - start:.2f}s.")
+    return done
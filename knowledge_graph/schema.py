@@ -0,0 +1,212 @@
+# schema.py
+
+import time
+from utils.logger_config import get_logger
+from utils import metrics
+
+logger = get_logger(name=__name__, log_file="knowledge_graph.log")
+
+# === CONFIG ===
+INDEX_WAIT_TIMEOUT = 300   # seconds to wait for indexes to come online
+USE_NODE_KEYS = False      # NODE KEY constraints need Neo4j Enterprise; UNIQUE works everywhere
+
+# Identity of every node label MERGEd by CYPHER_QUERY in main.py.
+# The MERGE pattern for each label must use exactly these properties.
+NODE_KEYS = {
+    "ServiceRequest": ("id",),
+    "Machine": ("model", "serial_number"),
+    "Component": ("serial", "name"),
+    "Problem": ("text",),
+    "FailureMode": ("type",),
+    "Cause": ("text",),
+    "CorrectiveAction": ("text",),
+    "ProductCategory": ("name",),
+    "AssignedAccount": ("name",),
+    "Customer": ("name",),
+    "ActivityType": ("type",),
+    "Defect": ("code",),
+    "Make": ("name",),
+    "ComplaintCategory": ("category",),
+}
+
+# Additional lookup indexes: (index type, label, property)
+LOOKUP_INDEXES = [
+    ("RANGE", "ServiceRequest", "date"),
+    ("RANGE", "Machine", "model"),
+    ("TEXT", "Problem", "text"),
+    ("TEXT", "Cause", "text"),
+    ("TEXT", "CorrectiveAction", "text"),
+    ("TEXT", "Customer", "name"),
+]
+
+# Relationships attached to Problem nodes by CYPHER_QUERY, used to merge duplicates
+PROBLEM_INCOMING = ["HAS_PROBLEM"]
+PROBLEM_OUTGOING = ["DEFINED_BY", "HAS_FAILURE_MODE", "CAUSED_BY"]
+# Carries the request counts of a duplicate's edge over to the kept node's edge
+ADD_REQUESTS = ("SET k.requests = CASE WHEN r.requests IS NULL THEN k.requests "
+                "ELSE coalesce(k.requests, 0) + r.requests END")
+
+
+def constraint_name(label: str) -> str:
+    return f"{label.lower()}_key"
+
+
+def index_name(kind: str, label: str, prop: str) -> str:
+    return f"{label.lower()}_{prop.lower()}_{kind.lower()}"
+
+
+def schema_statements(use_node_keys: bool = USE_NODE_KEYS) -> list:
+    """
+    Builds the idempotent DDL statements for all constraints and lookup indexes.
+
+    Args:
+        use_node_keys (bool): Declare NODE KEY instead of UNIQUE constraints.
+
+    Returns:
+        list[str]: Cypher statements using IF NOT EXISTS.
+    """
+    requirement = "IS NODE KEY" if use_node_keys else "IS UNIQUE"
+    statements = []
+    for label, props in NODE_KEYS.items():
+        if len(props) == 1:
+            target = f"n.{props[0]}"
+        else:
+            target = "(" + ", ".join(f"n.{p}" for p in props) + ")"
+        statements.append(
+            f"CREATE CONSTRAINT {constraint_name(label)} IF NOT EXISTS "
+            f"FOR (n:{label}) REQUIRE {target} {requirement}"
+        )
+    for kind, label, prop in LOOKUP_INDEXES:
+        statements.append(
+            f"CREATE {kind} INDEX {index_name(kind, label, prop)} IF NOT EXISTS "
+            f"FOR (n:{label}) ON (n.{prop})"
+        )
+    return statements
+
+
+def merge_duplicate_problems(driver) -> int:
+    """
+    Collapses Problem nodes that share the same text into a single node.
+
+    Older graphs MERGEd Problem on (text, description, summary), which produced one
+    node per description while embeddings were written by text. Relationships of
+    the duplicates are moved onto the kept node; SIMILAR_TO edges are dropped and
+    rebuilt by the embedding stage.
+
+    Returns:
+        int: Number of duplicate nodes removed.
+    """
+    # elementId order makes the kept node deterministic, and relinking and
+    # deleting in one statement per text means they always agree on it
+    relink = "\n    ".join([
+        f"CALL {{ WITH keep, dupe MATCH (x)-[r:{rel}]->(dupe) MERGE (x)-[k:{rel}]->(keep) {ADD_REQUESTS} }}"
+        for rel in PROBLEM_INCOMING
+    ] + [
+        f"CALL {{ WITH keep, dupe MATCH (dupe)-[r:{rel}]->(x) MERGE (keep)-[k:{rel}]->(x) {ADD_REQUESTS} }}"
+        for rel in PROBLEM_OUTGOING
+    ])
+    merge = f"""
+    MATCH (p:Problem {{text: $text}})
+    WITH p ORDER BY elementId(p)
+    WITH collect(p) AS nodes
+    WITH head(nodes) AS keep, tail(nodes) AS dupes
+    UNWIND dupes AS dupe
+    {relink}
+    DETACH DELETE dupe
+    RETURN count(*) AS removed
+    """
+    removed = 0
+    with driver.session() as session:
+        texts = [
+            r["text"] for r in session.run(
+                "MATCH (p:Problem) WITH p.text AS text, count(*) AS n WHERE n > 1 RETURN text"
+            )
+        ]
+        for text in texts:
+            removed += session.execute_write(lambda tx: tx.run(merge, text=text).single()["removed"])
+
+    if removed:
+        logger.info(f"Merged {removed} duplicate Problem nodes.")
+    return removed
+
+
+def constraints_online(missing: list) -> bool:
+    """True if none of the node uniqueness constraints is among the `missing` names from apply_schema."""
+    return not {constraint_name(label) for label in NODE_KEYS} & set(missing)
+
+
+def wait_for_indexes(driver, timeout: int = INDEX_WAIT_TIMEOUT) -> list:
+    """
+    Waits for all indexes to come online and reports expected ones that are missing.
+
+    Args:
+        driver: Neo4j driver instance.
+        timeout (int): Seconds to wait before giving up.
+
+    Returns:
+        list[str]: Names of expected constraints/indexes that are missing or not ONLINE.
+    """
+    expected = {constraint_name(label) for label in NODE_KEYS}
+    expected |= {index_name(kind, label, prop) for kind, label, prop in LOOKUP_INDEXES}
+
+    deadline = time.monotonic() + timeout
+    with driver.session() as session:
+        try:
+            session.run("CALL db.awaitIndexes($timeout)", timeout=timeout).consume()
+        except Exception as e:
+            logger.warning(f"db.awaitIndexes failed, polling index state instead: {e}")
+
+        while True:
+            constraints = {r["name"] for r in session.run("SHOW CONSTRAINTS YIELD name")}
+            states = {r["name"]: r["state"] for r in session.run("SHOW INDEXES YIELD name, state")}
+            missing = sorted(
+                name for name in expected
+                if name not in constraints and states.get(name) != "ONLINE"
+            )
+            # Constraints are backed by an index of the same name; check it is online too
+            missing += sorted(
+                name for name in expected & constraints
+                if name in states and states[name] != "ONLINE"
+            )
+            if not missing or time.monotonic() >= deadline:
+                break
+            time.sleep(1)
+
+    if missing:
+        logger.warning(f"Schema objects missing or not online: {missing}")
+    else:
+        logger.info("All constraints and indexes are online.")
+    return missing
+
+
+@metrics.timed("neo4j.schema")
+def apply_schema(driver, use_node_keys: bool = USE_NODE_KEYS, timeout: int = INDEX_WAIT_TIMEOUT) -> list:
+    """
+    Creates all constraints and lookup indexes and waits for them to come online.
+
+    Safe to run before every load: every statement uses IF NOT EXISTS. Duplicate
+    Problem nodes left by older loads are merged first so the uniqueness constraint
+    can be created.
+
+    Args:
+        driver: Neo4j driver instance.
+        use_node_keys (bool): Declare NODE KEY instead of UNIQUE constraints.
+        timeout (int): Seconds to wait for indexes to come online.
+
+    Returns:
+        list[str]: Names of expected constraints/indexes that are missing or not ONLINE.
+    """
+    try:
+        merge_duplicate_problems(driver)
+    except Exception as e:
+        logger.warning(f"Could not merge duplicate Problem nodes: {e}")
+
+    with driver.session() as session:
+        for statement in schema_statements(use_node_keys):
+            try:
+                session.run(statement).consume()
+            except Exception as e:
+                logger.error(f"Failed to apply schema statement '{statement}': {e}")
+
+    logger.info("Schema statements applied.")
+    return wait_for_indexes(driver, timeout=timeout)
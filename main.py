@@ -1,13 +1,21 @@
+from functools import partial
 import pandas as pd
-from db.postgre_load import connect_to_postgre, upload_csv_to_postgre, export_table_to_csv
-from knowledge_graph.neo4j_load import connect_to_neo4j, read_nodes, create_node, delete_knowledge_graph
-from knowledge_graph.create_nodes_from_csv import load_csv_and_create_nodes
-from embedding_relation.graph_vector_similarity import process_node_type
+from db.postgre_load import connect_to_postgre, upload_csv_to_postgre, export_table_to_csv, stream_table, distinct_values
+from knowledge_graph.neo4j_load import connect_to_neo4j, read_nodes, delete_knowledge_graph, get_graph_state
+from knowledge_graph.create_nodes_from_csv import iter_csv_chunks, COLUMN_RENAMES, WRITER_SESSIONS, PARALLEL_WRITER_SESSIONS
+from knowledge_graph.incremental_refresh import incremental_refresh
+from knowledge_graph.schema import apply_schema, constraints_online
+from knowledge_graph.problem_context import materialize_problem_context
+from embedding_relation.graph_vector_similarity import process_node_texts, refresh_node_embeddings, EMBEDDING_SPOOL_DIR
+from embedding_relation.text_encoding import encode_node_texts
 from utils.logger_config import get_logger
+from utils import metrics
+from utils.pipeline import Pipeline, Stage, PipelineError, file_signature
 from query.graph_cypher_qa_chain import graph_qa_chain
 import os
-from sentence_transformers import SentenceTransformer
+from utils.model_registry import get_model, warmup, MODEL_NAME
 from query.vector_based_query import find_similar_problem, get_llm_diagnosis
+from query.response_cache import get_response_cache
 
 
 logger = get_logger(name=__name__, log_file="main.log")
@@ -15,24 +23,35 @@ logger = get_logger(name=__name__, log_file="main.log")
 # === CONFIGURATION ===
 CSV_PATH_1 = "data/manufacturing_service_data.csv"
 CSV_PATH_2 = "data/exported_data.csv"
+TABLE_NAME = "manufacturing_service_data"
+UPLOAD_MODE = "upsert"        # "replace", "append" or "upsert" on SR ref no
+STREAM_FROM_POSTGRES = True   # feed Postgres chunks straight into the graph instead of exporting CSV_PATH_2
 LLM = "gemma2-9b-it"
 query = "Coolent is extremely hot"
+FULL_REBUILD = False   # wipe the graph and re-embed everything instead of applying only changes
+APPEND_ONLY = False    # incremental mode: skip rows older than the stored SR date watermark
+PIPELINE_RESUME = True # skip stages whose checkpoint is still valid (utils/pipeline.py)
 api_key = os.getenv("groq_api_key")
-model = SentenceTransformer("all-MiniLM-L6-v2")
 
 NODE_TYPES = {
     "Problem": "problem reported",
     "Cause": "cause",
     "CorrectiveAction": "corrective action"
 }
+TEXT_COLUMNS = {label: COLUMN_RENAMES.get(column, column) for label, column in NODE_TYPES.items()}
 
 CYPHER_QUERY = """
 MERGE (sr:ServiceRequest {id: $SR_ref_no})
-SET sr.date = $SR_date, sr.commission_date = $commission_date
+SET sr.date = $SR_date, sr.commission_date = $commission_date,
+    sr.component_serial = $component_serial_number, sr.component_name = $sub_assembly,
+    sr.problem_text = $problem_reported, sr.cause_text = $cause, sr.action_text = $corrective_action,
+    sr.defect_code = $defect_no, sr.failure_mode = $failure_mode,
+    sr.make = $make, sr.product_category = $product_category
 
 MERGE (machine:Machine {model: $machine_model, serial_number: $serial_number})
 MERGE (component:Component {serial: $component_serial_number, name: $sub_assembly})
-MERGE (problem:Problem {text: $problem_reported, description: $problem, summary: $problem_summary})
+MERGE (problem:Problem {text: $problem_reported})
+SET problem.description = $problem, problem.summary = $problem_summary
 MERGE (failure:FailureMode {type: $failure_mode})
 MERGE (cause:Cause {text: $cause})
 MERGE (action:CorrectiveAction {text: $corrective_action})
@@ -50,18 +69,146 @@ MERGE (sr)-[:HAS_CUSTOMER]->(customer)
 MERGE (sr)-[:HAS_ACTIVITY]->(activity)
 MERGE (sr)-[:HAS_COMPLAINT_CATEGORY]->(complaint)
 
-MERGE (machine)-[:MADE_BY]->(make)
-MERGE (machine)-[:BELONGS_TO]->(category)
-MERGE (machine)-[:HAS_COMPONENT]->(component)
-MERGE (component)-[:HAS_PROBLEM]->(problem)
-MERGE (problem)-[:DEFINED_BY]->(defect)
-MERGE (problem)-[:HAS_FAILURE_MODE]->(failure)
-MERGE (problem)-[:CAUSED_BY]->(cause)
-MERGE (cause)-[:RESOLVED_BY]->(action)
+MERGE (machine)-[made_by:MADE_BY]->(make)
+MERGE (machine)-[belongs_to:BELONGS_TO]->(category)
+MERGE (machine)-[has_component:HAS_COMPONENT]->(component)
+MERGE (component)-[has_problem:HAS_PROBLEM]->(problem)
+MERGE (problem)-[defined_by:DEFINED_BY]->(defect)
+MERGE (problem)-[has_failure_mode:HAS_FAILURE_MODE]->(failure)
+MERGE (problem)-[caused_by:CAUSED_BY]->(cause)
+MERGE (cause)-[resolved_by:RESOLVED_BY]->(action)
+
+// Requests behind each shared edge, so a changed or retired request can drop its own.
+// Counted once per content hash, so retrying a batch that did commit does not count twice.
+FOREACH (_ IN CASE WHEN coalesce(sr.content_hash <> $content_hash, true) THEN [1] ELSE [] END |
+    SET made_by.requests = coalesce(made_by.requests, 0) + 1,
+        belongs_to.requests = coalesce(belongs_to.requests, 0) + 1,
+        has_component.requests = coalesce(has_component.requests, 0) + 1,
+        has_problem.requests = coalesce(has_problem.requests, 0) + 1,
+        defined_by.requests = coalesce(defined_by.requests, 0) + 1,
+        has_failure_mode.requests = coalesce(has_failure_mode.requests, 0) + 1,
+        caused_by.requests = coalesce(caused_by.requests, 0) + 1,
+        resolved_by.requests = coalesce(resolved_by.requests, 0) + 1
+)
+SET sr.content_hash = coalesce($content_hash, sr.content_hash)
 """
 
+def collect_source_texts(source: dict) -> dict:
+    """
+    Distinct texts of every embedded node type in the source table or CSV.
+    Top-level so the pipeline can run it in a separate process.
+    """
+    columns = list(NODE_TYPES.values())
+    if source["kind"] == "table":
+        values = distinct_values(source["name"], columns)
+    else:
+        df = pd.read_csv(source["path"], usecols=columns, dtype=str)
+        values = {c: sorted(v for v in df[c].dropna().unique() if v) for c in columns}
+    return {label: values[column] for label, column in NODE_TYPES.items()}
+
+
+def _encode_label(label: str, source_texts: dict) -> int:
+    # Fills the embedding cache while the graph loads; the link stage then only reads it.
+    # Spooled to disk so the vectors are not held in memory.
+    texts = source_texts[label]
+    encode_node_texts(texts, out_path=os.path.join(EMBEDDING_SPOOL_DIR, f"{label.lower()}.npy"))
+    return len(texts)
+
+
+def _link_label(label: str, refresh: dict, source_texts: dict, driver, **upstream):
+    if FULL_REBUILD:
+        # Rebuilds the vector and local indexes, so every text of the label is needed, not the delta
+        texts = source_texts[label]
+        process_node_texts(driver, label, texts, get_model())
+        return len(texts)
+    return refresh_node_embeddings(driver, label, refresh["affected_texts"][label], get_model())
+
+
+def build_pipeline() -> Pipeline:
+    """
+    The ingestion steps as a DAG (see utils/pipeline.py). Upload and graph
+    preparation run side by side; encoding needs only the distinct source texts,
+    so it overlaps the graph load, and the three node types are encoded and
+    linked concurrently:
+
+        upload -> source -> graph_load -> problem_context, link_<label>
+        prepare_graph ----> graph_load
+        source -> source_texts -> encode_<label> -> link_<label>
+    """
+    pipeline = Pipeline("ingest")
+    rebuild = {"full_rebuild": FULL_REBUILD}
+
+    @pipeline.stage(outputs=["uploaded_rows"],
+                    params={"csv": file_signature(CSV_PATH_1), "table": TABLE_NAME, "mode": UPLOAD_MODE,
+                            "append_only": APPEND_ONLY})
+    def upload():
+        # Unless append-only, upsert drops rows that left the CSV so graph_load retires them
+        rows = upload_csv_to_postgre(CSV_PATH_1, TABLE_NAME, mode=UPLOAD_MODE, delete_missing=not APPEND_ONLY)
+        if rows is None:
+            raise RuntimeError(f"Upload of {CSV_PATH_1} to PostgreSQL failed")
+        return rows
+
+    @pipeline.stage(inputs=["uploaded_rows"], outputs=["source"], params={"stream": STREAM_FROM_POSTGRES})
+    def source(uploaded_rows):
+        if STREAM_FROM_POSTGRES:
+            return {"kind": "table", "name": TABLE_NAME}
+        export_table_to_csv(TABLE_NAME, CSV_PATH_2)
+        return {"kind": "csv", "path": CSV_PATH_2}
+
+    # A rebuild must wipe the graph on every run, so its checkpoint is never reused
+    @pipeline.stage(inputs=["driver"], outputs=["writer_sessions"], params=rebuild, checkpoint=not FULL_REBUILD)
+    def prepare_graph(driver):
+        if FULL_REBUILD:
+            delete_knowledge_graph(driver)
+        read_nodes(driver)
+        missing = apply_schema(driver)
+        if missing:
+            logger.warning(f"Schema incomplete, load may be slow: {missing}")
+        # Parallel writers only once concurrent MERGEs cannot duplicate nodes
+        return PARALLEL_WRITER_SESSIONS if constraints_online(missing) else WRITER_SESSIONS
+
+    @pipeline.stage(inputs=["source", "writer_sessions", "driver"], outputs=["refresh"],
+                    params={"append_only": APPEND_ONLY})
+    def graph_load(source, writer_sessions, driver):
+        if source["kind"] == "table":
+            watermark = get_graph_state(driver).get("watermark") if APPEND_ONLY else None
+            chunks = stream_table(TABLE_NAME, rename=COLUMN_RENAMES, since_column="SR date", since=watermark)
+        else:
+            chunks = iter_csv_chunks(source["path"])
+        refresh = incremental_refresh(
+            driver=driver,
+            chunks=chunks,
+            cypher_query=CYPHER_QUERY,
+            text_columns=TEXT_COLUMNS,
+            append_only=APPEND_ONLY,
+            workers=writer_sessions
+        )
+        # Cached LLM answers were produced against the previous graph
+        if get_response_cache().sync_graph_version(get_graph_state(driver).get("version")):
+            logger.info("Response cache invalidated for the new graph version.")
+        return refresh
+
+    @pipeline.stage(inputs=["refresh", "driver"], outputs=["context_problems"], params=rebuild)
+    def problem_context(refresh, driver):
+        return materialize_problem_context(driver, None if FULL_REBUILD else refresh["touched_problems"])
+
+    pipeline.add(Stage("source_texts", collect_source_texts, inputs=["source"], outputs=["source_texts"],
+                       executor="process"))
+    for label in NODE_TYPES:
+        pipeline.add(Stage(f"encode_{label}", partial(_encode_label, label), inputs=["source_texts"],
+                           outputs=[f"encoded_{label}"], params={"label": label, "model": MODEL_NAME}))
+        pipeline.add(Stage(f"link_{label}", partial(_link_label, label),
+                           inputs=["refresh", "source_texts", f"encoded_{label}", "driver"],
+                           outputs=[f"linked_{label}"],
+                           params={"label": label, "model": MODEL_NAME, **rebuild}))
+    return pipeline
+
+
+@metrics.timed("pipeline.total")
 def main():
     logger.info("Starting pipeline...")
+    # Load the embedding model in the background while the databases are prepared
+    warmup()
 
     # Step 1: Connect to PostgreSQL
     try:
@@ -72,25 +219,7 @@ def main():
         logger.error(f"PostgreSQL connection failed: {e}")
         return
 
-    # Step 2: Upload CSV
-    try:
-        logger.info(f"Uploading CSV to PostgreSQL: {CSV_PATH_1}")
-        upload_csv_to_postgre(CSV_PATH_1, "manufacturing_service_data")
-        logger.info("CSV uploaded to PostgreSQL.")
-    except Exception as e:
-        logger.error(f"Failed to upload CSV: {e}")
-        return
-
-    # Step 3: Export table to new CSV
-    try:
-        logger.info("Exporting table to CSV...")
-        export_table_to_csv("manufacturing_service_data", CSV_PATH_2)
-        logger.info(f"Exported table to: {CSV_PATH_2}")
-    except Exception as e:
-        logger.error(f"Failed to export table: {e}")
-        return
-
-    # Step 4: Connect to Neo4j
+    # Step 2: Connect to Neo4j
     try:
         logger.info("Connecting to Neo4j...")
         graph, driver = connect_to_neo4j()
@@ -100,50 +229,17 @@ def main():
         logger.error(f"Neo4j connection failed: {e}")
         return
 
+    # Step 3: Upload, load, materialize and embed; a rerun resumes at the first failed or changed stage
     try:
-        # Step 5: Delete previous graph
-        try:
-            logger.info("Deleting existing knowledge graph...")
-            delete_knowledge_graph(driver)
-            logger.info("Knowledge graph cleared.")
-        except Exception as e:
-            logger.warning(f"Failed to delete knowledge graph: {e}")
-
-        # Step 6: Read existing nodes (optional debug step)
-        try:
-            logger.info("Reading existing nodes...")
-            read_nodes(driver)
-        except Exception as e:
-            logger.warning(f"Failed to read existing nodes: {e}")
-
-        # Step 7: Load CSV and create nodes
-        try:
-            logger.info("Creating knowledge graph from CSV...")
-            load_csv_and_create_nodes(
-                driver=driver,
-                csv_path=CSV_PATH_2,
-                cypher_query=CYPHER_QUERY
-            )
-            logger.info("Knowledge graph created.")
-        except Exception as e:
-            logger.error(f"Failed to create knowledge graph: {e}")
-            return
-
-        # Step 8: Embed and link similar nodes
-        try:
-            logger.info("Embedding node types for vector similarity...")
-            for label, column in NODE_TYPES.items():
-                logger.info(f"Processing {label} nodes...")
-                process_node_type(driver, label, column, CSV_PATH_1, model)
-            logger.info("All node types embedded and linked.")
-        except Exception as e:
-            logger.error(f"Embedding and similarity linking failed: {e}")
-    
+        build_pipeline().run(resources={"driver": driver}, resume=PIPELINE_RESUME)
+    except PipelineError as e:
+        logger.error(f"Pipeline failed, rerun to resume from the failed stage: {e}")
+        return
     except Exception as e:
         logger.error(f"Failed to create knowledge graph: {e}")
         return
     
-        # Step 9: Run Cypher query    
+        # Step 4: Run Cypher query    
     try:
         response = graph_qa_chain(graph=graph,query=query,llm=LLM)
         logger.info(f"Successfully ran Cypher query: {query}")
@@ -152,7 +248,7 @@ def main():
         logger.error(f"Failed to run Cypher query: {e}")
     
     try:
-        
+        model = get_model()
         problem_context = find_similar_problem(user_input = query, driver=driver, model=model)
         print("Problem Context:\n", problem_context)
         logger.info("Successfully retrieved problem context.Problem Context:\n", problem_context)
@@ -0,0 +1,163 @@
+# async_query.py
+
+import asyncio
+import threading
+
+from utils.logger_config import get_logger
+from utils import metrics
+from query.retrievers import Neo4jRetriever, CONTEXT_QUERY
+from query.response_cache import get_response_cache, embed_query, USE_RESPONSE_CACHE
+from query.vector_based_query import build_diagnosis_request
+from query.context_assembler import assemble_context
+from embedding_relation.text_encoding import normalize_text
+from query.llm_client import get_llm_client
+
+logger = get_logger(name=__name__, log_file="query.log")
+
+VECTOR_QUERY = """
+CALL db.index.vector.queryNodes('problem_index', $top_k, $embedding)
+YIELD node, score
+RETURN node.text AS text, score
+"""
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """
+    Returns the long-lived event loop of the query path, started on first use in
+    a daemon thread. The LLM client's pooled HTTP connections and the async
+    Neo4j driver live on this loop, so they survive across Streamlit reruns.
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="query-loop", daemon=True).start()
+    return _loop
+
+
+def run_sync(coro, timeout: float = None):
+    """Runs a coroutine on the shared query loop and waits for its result."""
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop()).result(timeout)
+
+
+async def vector_search_async(driver, embedding: list, top_k: int = 3, retriever=None) -> list:
+    """
+    Returns {"text", "score"} hits for an embedding. A non-Neo4j retriever runs
+    in a worker thread so the loop stays free.
+    """
+    if retriever is not None and not isinstance(retriever, Neo4jRetriever):
+        return await asyncio.to_thread(retriever.search, embedding, top_k)
+    async with driver.session() as session:
+        result = await session.run(VECTOR_QUERY, top_k=top_k, embedding=embedding)
+        return [record.data() async for record in result]
+
+
+async def fetch_problem_context_async(driver, hits: list) -> list:
+    """Async variant of fetch_problem_context: the context of every hit in one query, best first."""
+    if driver is None:
+        return [{**hit, "causes": [], "actions": [], "machines": [], "context": None} for hit in hits]
+    async with driver.session() as session:
+        result = await session.run(CONTEXT_QUERY, hits=hits)
+        return [record.data() async for record in result]
+
+
+@metrics.timed("query.find_similar_problem_async")
+async def find_similar_problem_async(user_input: str, driver, model, top_k: int = 3,
+                                     retriever=None, stats: dict = None) -> str:
+    """
+    Async variant of find_similar_problem using the Neo4j async driver.
+
+    The query is encoded in a worker thread, and the context of all hits is
+    read in one query.
+    """
+    try:
+        logger.info(f"Finding similar problems (async) for input: {user_input}")
+        vector = await asyncio.to_thread(model.encode, normalize_text(user_input), convert_to_numpy=True)
+        hits = await vector_search_async(driver, vector.tolist(), top_k, retriever)
+        records = await fetch_problem_context_async(driver, hits) if hits else []
+
+        if not records:
+            logger.warning("No matching problem found.")
+            return "No matching problem found for the given input."
+
+        problem_context, report = assemble_context(records)
+        if stats is not None:
+            stats.update(report)
+        logger.info(f"Successfully retrieved problem context ({report['tokens_saved']} tokens saved).")
+        return problem_context
+
+    except Exception as e:
+        logger.error(f"Error while finding similar problem: {e}")
+        return f"Error occurred while processing the input: {str(e)}"
+
+
+@metrics.timed("query.llm_diagnosis_async")
+async def get_llm_diagnosis_async(user_input: str, problem_context: str, api_key: str,
+                                  model_name: str = "llama3-70b-8192",
+                                  use_cache: bool = USE_RESPONSE_CACHE, raise_errors: bool = False,
+                                  query_embedding=None) -> str:
+    """
+    Async variant of get_llm_diagnosis through the shared LLM client: at most
+    MAX_CONCURRENT_LLM_CALLS requests are in flight per event loop, rate limits
+    are shared with the sync path, and 429/5xx replies are retried after their
+    Retry-After delay.
+
+    Failures are returned as an error message, or raised with `raise_errors`
+    so callers can tell them apart from a reply. A precomputed `query_embedding`
+    is used for the semantic cache lookup instead of encoding the question again.
+    """
+    try:
+        if use_cache:
+            cache = get_response_cache()
+            if query_embedding is None:
+                query_embedding = await asyncio.to_thread(embed_query, user_input)
+            # SQLite lookup and similarity scan stay off the shared loop
+            cached = await asyncio.to_thread(cache.get, user_input, model_name, problem_context,
+                                             embedding=query_embedding)
+            if cached is not None:
+                return cached
+
+        reply = await get_llm_client().achat(
+            build_diagnosis_request(user_input, problem_context, model_name), api_key=api_key
+        )
+        logger.info("LLM response received successfully.")
+        if use_cache:
+            await asyncio.to_thread(cache.put, user_input, model_name, reply, problem_context,
+                                    embedding=query_embedding)
+        return reply
+
+    except Exception as e:
+        logger.error(f"Exception while communicating with LLM API: {e}")
+        if raise_errors:
+            raise
+        return f"Error occurred while contacting LLM: {str(e)}"
+
+
+async def answer_query_async(user_input: str, driver, model, api_key: str, model_name: str = "llama3-70b-8192",
+                             retriever=None, graph=None, qa_llm: str = None) -> dict:
+    """
+    Serves one technician query: retrieval and, when `graph` and `qa_llm` are
+    given, the Cypher QA path run concurrently; the diagnosis follows retrieval.
+
+    Returns:
+        dict: "context", "diagnosis" and "graph_answer" (None without QA).
+    """
+    retrieval = asyncio.ensure_future(
+        find_similar_problem_async(user_input, driver, model, retriever=retriever)
+    )
+    qa = None
+    if graph is not None and qa_llm:
+        # LangChain's chain is synchronous; it runs in a worker thread alongside retrieval
+        from query.template_router import answer_question
+        qa = asyncio.ensure_future(asyncio.to_thread(answer_question, graph, user_input, qa_llm))
+
+    context = await retrieval
+    diagnosis = await get_llm_diagnosis_async(user_input, context, api_key, model_name)
+    return {
+        "context": context,
+        "diagnosis": diagnosis,
+        "graph_answer": await qa if qa is not None else None,
+    }
@@ -0,0 +1,295 @@
+# batch_diagnosis.py
+#
+# Bulk triage of service tickets:
+#
+#   python -m query.batch_diagnosis tickets.csv --output data/diagnoses --format parquet
+
+import argparse
+import asyncio
+import glob
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from utils.logger_config import get_logger
+from utils import metrics
+from embedding_relation.text_encoding import normalize_text
+from embedding_relation.similarity_graph import top_k_similar
+from query.retrievers import Neo4jRetriever, fetch_problem_context
+from knowledge_graph.problem_context import CONTEXT_PROJECTION
+from query.context_assembler import assemble_context
+from query.async_query import get_llm_diagnosis_async, run_sync
+
+logger = get_logger(name=__name__, log_file="query.log")
+
+# === CONFIG ===
+ENCODE_BATCH_SIZE = 256
+LOOKUP_BATCH_SIZE = 500          # tickets per UNWIND vector query
+DEDUPE_THRESHOLD = 0.97          # cosine similarity above which tickets share one diagnosis
+PART_SIZE = 500                  # results per output part file
+TEXT_COLUMN = "problem reported"
+
+BATCH_VECTOR_QUERY = f"""
+UNWIND $rows AS row
+CALL db.index.vector.queryNodes('problem_index', $top_k, row.embedding)
+YIELD node AS problem, score
+RETURN row.idx AS idx, problem.text AS text, score,
+    {CONTEXT_PROJECTION}
+ORDER BY idx, score DESC
+"""
+
+
+def load_tickets(path: str, text_column: str = TEXT_COLUMN, id_column: str = None) -> list:
+    """
+    Reads tickets from a CSV, JSONL or plain-text file (one description per line).
+
+    Returns:
+        list[dict]: {"id", "text"}; the id is the row position when no id column is given.
+    """
+    if path.endswith(".csv"):
+        df = pd.read_csv(path, dtype=str).fillna("")
+    elif path.endswith(".jsonl"):
+        df = pd.read_json(path, lines=True, dtype=False).fillna("")
+    else:
+        with open(path, encoding="utf-8") as f:
+            df = pd.DataFrame({text_column: [line.rstrip("\n") for line in f if line.strip()]})
+    ids = df[id_column].astype(str) if id_column else pd.Series(range(len(df))).astype(str)
+    return [{"id": i, "text": t} for i, t in zip(ids, df[text_column].astype(str))]
+
+
+def completed_ids(output_dir: str) -> set:
+    """Ids already diagnosed successfully by earlier runs into `output_dir`."""
+    done = set()
+    for path in sorted(glob.glob(os.path.join(output_dir, "part-*"))):
+        if path.endswith(".jsonl"):
+            df = pd.read_json(path, lines=True, dtype=False)
+        elif path.endswith(".parquet"):
+            df = pd.read_parquet(path, columns=["id", "status"])
+        else:
+            continue
+        if not df.empty:
+            done.update(df.loc[df["status"] == "ok", "id"].astype(str))
+    return done
+
+
+def dedupe_tickets(texts: list, embeddings: np.ndarray, threshold: float = DEDUPE_THRESHOLD) -> np.ndarray:
+    """
+    Maps every ticket to a representative ticket.
+
+    Identical texts after normalization were merged before encoding; here tickets
+    whose embeddings are at least `threshold` similar are grouped (union-find over
+    top-k neighbours) and represented by their first member.
+
+    Returns:
+        np.ndarray: Representative index per ticket.
+    """
+    parent = np.arange(len(texts))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    if len(texts) > 1:
+        src, dst, _ = top_k_similar(embeddings, top_k=5, threshold=threshold,
+                                    self_index=np.arange(len(texts)))
+        for a, b in zip(src, dst):
+            ra, rb = find(a), find(b)
+            if ra != rb:
+                parent[max(ra, rb)] = min(ra, rb)
+    return np.array([find(i) for i in range(len(texts))])
+
+
+def lookup_contexts(driver, embeddings: np.ndarray, top_k: int = 3, retriever=None,
+                    batch_size: int = LOOKUP_BATCH_SIZE) -> list:
+    """
+    Retrieves the similar-problem records for many embeddings.
+
+    With Neo4j every batch is one UNWIND query over `problem_index`; with an
+    in-process retriever the searches run locally and the context of all hits
+    is fetched in one query.
+
+    Returns:
+        list[list[dict]]: Records per embedding, best first.
+    """
+    records = [[] for _ in range(len(embeddings))]
+    if retriever is not None and not isinstance(retriever, Neo4jRetriever):
+        hits = [retriever.search(vector, top_k) for vector in embeddings]
+        unique = {h["text"]: h for hs in hits for h in hs}
+        context = {r["text"]: r for r in fetch_problem_context(driver, list(unique.values()))}
+        for i, hs in enumerate(hits):
+            records[i] = [{**context.get(h["text"], {}), **h} for h in hs]
+        return records
+
+    with driver.session() as session:
+        for start in range(0, len(embeddings), batch_size):
+            rows = [{"idx": start + i, "embedding": list(map(float, v))}
+                    for i, v in enumerate(embeddings[start:start + batch_size])]
+            for record in session.run(BATCH_VECTOR_QUERY, rows=rows, top_k=top_k):
+                data = record.data()
+                records[data.pop("idx")].append(data)
+    return records
+
+
+class PartWriter:
+    """Buffers result rows and writes them as numbered JSONL or Parquet part files."""
+
+    def __init__(self, output_dir: str, fmt: str = "jsonl", part_size: int = PART_SIZE):
+        if fmt not in ("jsonl", "parquet"):
+            raise ValueError(f"Unknown output format '{fmt}'")
+        os.makedirs(output_dir, exist_ok=True)
+        self.output_dir = output_dir
+        self.fmt = fmt
+        self.part_size = part_size
+        self.rows = []
+        self.parts = []
+        self.next_part = len(glob.glob(os.path.join(output_dir, "part-*")))
+
+    def add(self, rows: list):
+        self.rows.extend(rows)
+        if len(self.rows) >= self.part_size:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        path = os.path.join(self.output_dir, f"part-{self.next_part:05d}.{self.fmt}")
+        tmp = path + ".tmp"
+        if self.fmt == "jsonl":
+            with open(tmp, "w", encoding="utf-8") as f:
+                for row in self.rows:
+                    f.write(json.dumps(row, ensure_ascii=False) + "\n")
+        else:
+            pd.DataFrame(self.rows).to_parquet(tmp, index=False)
+        # Readers and a resumed run only ever see complete parts
+        os.replace(tmp, path)
+        self.parts.append(path)
+        self.next_part += 1
+        self.rows = []
+
+
+async def _diagnose_all(groups: dict, contexts: dict, vectors: dict, tickets: list, api_key: str,
+                        model_name: str, writer: PartWriter) -> dict:
+    counts = {"ok": 0, "error": 0}
+
+    async def diagnose(rep):
+        text = tickets[rep]["text"]
+        try:
+            # The batch encode already embedded the ticket; reuse it for the cache lookup
+            return rep, await get_llm_diagnosis_async(text, contexts[rep], api_key, model_name, raise_errors=True,
+                                                      query_embedding=vectors[rep]), "ok"
+        except Exception as e:
+            return rep, f"Error occurred while contacting LLM: {str(e)}", "error"
+
+    # Concurrency is bounded by the async client's semaphore; results are written as they finish
+    for task in asyncio.as_completed([diagnose(rep) for rep in groups]):
+        rep, diagnosis, status = await task
+        counts[status] += len(groups[rep])
+        writer.add([{
+            "id": tickets[i]["id"],
+            "text": tickets[i]["text"],
+            "representative_id": tickets[rep]["id"],
+            "problem_context": contexts[rep],
+            "diagnosis": diagnosis,
+            "status": status,
+        } for i in groups[rep]])
+    return counts
+
+
+@metrics.timed("query.batch_diagnosis")
+def diagnose_batch(tickets: list, driver, model, api_key: str, output_dir: str, fmt: str = "jsonl",
+                   model_name: str = "llama3-70b-8192", top_k: int = 3, retriever=None,
+                   dedupe_threshold: float = DEDUPE_THRESHOLD) -> dict:
+    """
+    Diagnoses a batch of tickets and writes the results incrementally.
+
+    Tickets already diagnosed successfully in `output_dir` are skipped, so an
+    interrupted run resumes where it stopped. Identical and near-identical
+    tickets share one retrieval and one LLM call.
+
+    Args:
+        tickets (list): Ticket descriptions, or {"id", "text"} dicts (see load_tickets).
+        driver: Neo4j driver (sync) used for the vector lookups.
+        model: SentenceTransformer used to encode the tickets.
+        output_dir (str): Directory receiving part-*.jsonl / part-*.parquet files.
+
+    Returns:
+        dict: Counts, timing and the part files written.
+    """
+    start = time.perf_counter()
+    tickets = [t if isinstance(t, dict) else {"id": str(i), "text": t} for i, t in enumerate(tickets)]
+    done = completed_ids(output_dir)
+    pending = [t for t in tickets if str(t["id"]) not in done]
+    summary = {"tickets": len(tickets), "resumed": len(tickets) - len(pending)}
+    if not pending:
+        logger.info("All tickets already diagnosed.")
+        return {**summary, "unique": 0, "ok": 0, "error": 0, "parts": [], "seconds": 0.0}
+
+    # Exact duplicates collapse on the normalized text, which is also what gets
+    # encoded so the vectors live in the same space as the indexed node texts
+    first_of = {}
+    exact = [first_of.setdefault(normalize_text(t["text"]), i) for i, t in enumerate(pending)]
+    unique_idx = sorted(set(exact))
+    embeddings = model.encode([normalize_text(pending[i]["text"]) for i in unique_idx],
+                              batch_size=ENCODE_BATCH_SIZE, convert_to_numpy=True)
+
+    reps = dedupe_tickets([pending[i]["text"] for i in unique_idx], embeddings, dedupe_threshold)
+    position = {idx: pos for pos, idx in enumerate(unique_idx)}
+    groups = {}
+    for i, e in enumerate(exact):
+        groups.setdefault(unique_idx[reps[position[e]]], []).append(i)
+    rep_positions = [position[rep] for rep in groups]
+    summary["unique"] = len(groups)
+    logger.info(f"{len(pending)} tickets collapse to {len(groups)} distinct problems.")
+
+    lookup_start = time.perf_counter()
+    records = lookup_contexts(driver, embeddings[rep_positions], top_k, retriever)
+    contexts = {
+        rep: assemble_context(recs)[0] if recs else "No matching problem found for the given input."
+        for rep, recs in zip(groups, records)
+    }
+    summary["lookup_seconds"] = time.perf_counter() - lookup_start
+
+    writer = PartWriter(output_dir, fmt)
+    try:
+        vectors = {rep: embeddings[position[rep]] for rep in groups}
+        counts = run_sync(_diagnose_all(groups, contexts, vectors, pending, api_key, model_name, writer))
+    finally:
+        writer.flush()
+
+    summary.update(counts, parts=writer.parts, seconds=time.perf_counter() - start)
+    for status in ("ok", "error"):
+        metrics.inc("tickets_total", summary[status], status=status)
+    logger.info(f"Batch diagnosis finished: {summary['ok']} ok, {summary['error']} errors "
+                f"in {summary['seconds']:.1f}s.")
+    return summary
+
+
+def main():
+    from knowledge_graph.neo4j_load import connect_to_neo4j
+    from query.retrievers import get_retriever
+    from utils.model_registry import get_model
+
+    parser = argparse.ArgumentParser(description="Diagnose a file of service tickets in bulk")
+    parser.add_argument("path", help="CSV, JSONL or text file of ticket descriptions")
+    parser.add_argument("--output", default="data/diagnoses")
+    parser.add_argument("--format", choices=["jsonl", "parquet"], default="jsonl")
+    parser.add_argument("--text-column", default=TEXT_COLUMN)
+    parser.add_argument("--id-column")
+    parser.add_argument("--model", default="llama3-70b-8192")
+    args = parser.parse_args()
+
+    _, driver = connect_to_neo4j()
+    summary = diagnose_batch(
+        load_tickets(args.path, args.text_column, args.id_column), driver, get_model(),
+        os.getenv("groq_api_key"), args.output, fmt=args.format, model_name=args.model,
+        retriever=get_retriever(driver=driver)
+    )
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+# context_assembler.py
+
+import re
+from utils.logger_config import get_logger
+from utils import metrics
+from utils.model_registry import get_resource
+
+logger = get_logger(name=__name__, log_file="query.log")
+
+# === CONFIG ===
+CONTEXT_TOKEN_BUDGET = 400        # prompt tokens allowed for the retrieved context
+TOKENIZER_ENCODING = "cl100k_base"
+MAX_ITEMS_PER_SECTION = 8
+
+SECTIONS = [
+    ("problems", "Similar Problems"),
+    ("causes", "Likely Causes"),
+    ("actions", "Corrective Actions"),
+    ("machines", "Machines"),
+]
+
+_WORD = re.compile(r"\w+|[^\w\s]")
+
+
+def _load_tokenizer():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(TOKENIZER_ENCODING).encode
+    except Exception as e:
+        # tiktoken is optional; a word/punctuation count tracks BPE counts closely enough for budgeting
+        logger.info(f"tiktoken unavailable ({e}); using the regex tokenizer.")
+        return _WORD.findall
+
+
+def count_tokens(text: str) -> int:
+    """Counts prompt tokens with tiktoken when installed, else a regex tokenizer."""
+    return len(get_resource("tokenizer", _load_tokenizer)(text))
+
+
+def _key(text) -> str:
+    return " ".join(str(text).casefold().split())
+
+
+def _rank_items(records: list, field: str) -> list:
+    """
+    Merges one list field across hits, deduplicated case- and whitespace-insensitively.
+    Each item is weighted by the summed score of the hits mentioning it, discounted
+    by its position in that hit's list.
+    """
+    weights, first = {}, {}
+    for r in records:
+        for position, item in enumerate(r.get(field) or []):
+            if not item:
+                continue
+            key = _key(item)
+            first.setdefault(key, item)
+            weights[key] = weights.get(key, 0.0) + float(r.get("score") or 0) / (1 + 0.25 * position)
+    ranked = sorted(weights, key=lambda k: weights[k], reverse=True)
+    return [(first[k], weights[k]) for k in ranked[:MAX_ITEMS_PER_SECTION]]
+
+
+def _render(selected: dict) -> str:
+    lines = []
+    for section, title in SECTIONS:
+        items = selected.get(section)
+        if items:
+            lines.append(f"{title}:")
+            lines.extend(f"- {item}" for item in items)
+    return "\n".join(lines)
+
+
+def _raw_context(records: list) -> str:
+    """What the prompt would carry without assembly: every hit rendered in full."""
+    return "\n".join(
+        r.get("context") or
+        f"Problem: {r.get('text')} (score: {float(r.get('score') or 0):.3f})\n"
+        f"Causes: {r.get('causes')}\nCorrective Actions: {r.get('actions')}\nMachines: {r.get('machines')}"
+        for r in records
+    )
+
+
+def assemble_context(records: list, budget: int = CONTEXT_TOKEN_BUDGET):
+    """
+    Merges the top-k retrieved problems into one compact context.
+
+    Causes, actions and machines are deduplicated across hits and ranked by the
+    scores of the hits they come from. Items are then added greedily by weight,
+    across sections, while the rendered context stays within `budget` tokens.
+
+    Args:
+        records (list[dict]): Hits with text, score, causes, actions and machines.
+        budget (int): Maximum tokens of the assembled context.
+
+    Returns:
+        tuple: (context string, report dict with hits, raw_tokens, tokens,
+            tokens_saved and dropped items).
+    """
+    records = sorted((r for r in records if r), key=lambda r: float(r.get("score") or 0), reverse=True)
+    candidates = []
+    for section, _ in SECTIONS:
+        if section == "problems":
+            items = [(f"{r.get('text')} (score: {float(r.get('score') or 0):.3f})", float(r.get("score") or 0))
+                     for r in records if r.get("text")]
+        else:
+            items = _rank_items(records, section)
+        candidates.extend((weight, section, item) for item, weight in items)
+    # The best problem, cause and action go first so a tight budget still covers each
+    leaders = {}
+    for weight, section, item in candidates:
+        leaders.setdefault(section, (weight, section, item))
+    order = list(leaders.values()) + sorted(
+        (c for c in candidates if c not in leaders.values()), key=lambda c: c[0], reverse=True
+    )
+
+    selected = {section: [] for section, _ in SECTIONS}
+    dropped = 0
+    tokens = 0
+    for weight, section, item in order:
+        selected[section].append(item)
+        attempt = count_tokens(_render(selected))
+        if attempt > budget:
+            selected[section].pop()
+            dropped += 1
+        else:
+            tokens = attempt
+
+    context = _render(selected)
+    raw_tokens = count_tokens(_raw_context(records))
+    metrics.inc("context_tokens_total", tokens)
+    metrics.inc("context_tokens_saved_total", max(0, raw_tokens - tokens))
+    report = {
+        "hits": len(records),
+        "raw_tokens": raw_tokens,
+        "tokens": tokens,
+        "tokens_saved": max(0, raw_tokens - tokens),
+        "dropped": dropped,
+    }
+    return context, report
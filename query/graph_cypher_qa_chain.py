@@ -1,21 +1,182 @@
-from langchain_community.graphs import Neo4jGraph
-from langchain.chains import GraphCypherQAChain
-from langchain_groq import ChatGroq
 from utils.logger_config import get_logger
-import os
+from utils import metrics
+from utils.model_registry import get_resource
+from query.response_cache import get_response_cache, USE_RESPONSE_CACHE
+from query.llm_client import make_chat_model
+from knowledge_graph.neo4j_load import GRAPH_STATE_LABEL, GRAPH_STATE_NAME
+from collections import OrderedDict
+import re
+import threading
+import time
 
 logger = get_logger(name=__name__, log_file="query.log")
 
-groq_api_key = os.getenv("groq_api_key")
+# Cache scope for answers that depend on the whole graph rather than a retrieved context
+GRAPH_CONTEXT = "graph_cypher_qa_chain"
 
-def graph_qa_chain(graph, query: str,llm):
+SCHEMA_CHECK_SECONDS = 30      # how often the graph version is re-read
+CYPHER_MEMO_SIZE = 1000        # generated Cypher statements kept per engine
+# Internal properties and labels that only cost prompt tokens
+SCHEMA_EXCLUDED_PROPERTIES = ["embedding", "content_hash"]
+SCHEMA_EXCLUDED_LABELS = [GRAPH_STATE_LABEL]
+
+
+def compact_schema(schema: str) -> str:
+    """
+    Shrinks the Neo4jGraph schema string that goes into every Cypher prompt:
+    drops internal properties and labels and collapses whitespace.
+    """
+    lines = []
+    for line in schema.splitlines():
+        if any(re.search(rf"\b{label}\b", line) for label in SCHEMA_EXCLUDED_LABELS):
+            continue
+        for prop in SCHEMA_EXCLUDED_PROPERTIES:
+            line = re.sub(rf"{prop}: [A-Z_ ]+(, )?", "", line)
+        line = re.sub(r",\s*}", "}", line)
+        line = " ".join(line.split())
+        if line and not re.search(r"\{\s*\}$", line):
+            lines.append(line)
+    return "\n".join(lines)
+
+
+class GraphQAEngine:
+    """
+    Long-lived GraphCypherQAChain wrapper.
+
+    The chat model and chain are built once. The schema is pulled and compacted
+    only when ingestion bumps the graph version, and the chain is rebuilt only if
+    the compacted schema changed. Cypher generated for a question is memoized per
+    exact question (whitespace aside) until the schema changes, since the
+    statement embeds the question's literals; a memoized statement is
+    checked with EXPLAIN and executed directly, skipping the Cypher-generation
+    LLM call.
+    """
+
+    def __init__(self, graph, llm: str, verbose: bool = True):
+        self.graph = graph
+        self.llm_name = llm
+        self.verbose = verbose
+        # Calls go through the shared LLM client (rate limits, retries, circuit breaker)
+        self.llm = make_chat_model(llm)
+        self.chain = None
+        self.schema = None
+        self.graph_version = None
+        self._checked_at = 0.0
+        self._cypher = OrderedDict()
+        self._lock = threading.Lock()
+        self._memo_lock = threading.Lock()   # the memo is shared by concurrent Streamlit sessions
+
+    def _read_graph_version(self):
+        rows = self.graph.query(
+            f"MATCH (s:{GRAPH_STATE_LABEL} {{name: $name}}) RETURN s.version AS version",
+            {"name": GRAPH_STATE_NAME}
+        )
+        return rows[0]["version"] if rows else None
+
+    def _ensure_chain(self):
+        """Builds the chain on first use and rebuilds it when a new graph version changes the schema."""
+        now = time.monotonic()
+        if self.chain is not None and now - self._checked_at < SCHEMA_CHECK_SECONDS:
+            return
+        with self._lock:
+            version = self._read_graph_version()
+            self._checked_at = now
+            if self.chain is not None and version == self.graph_version:
+                return
+
+            from langchain.chains import GraphCypherQAChain
+
+            self.graph.refresh_schema()
+            schema = compact_schema(self.graph.schema)
+            self.graph_version = version
+            if self.chain is not None and schema == self.schema:
+                # New data, same schema: the chain and the validated Cypher stay valid
+                logger.info(f"Graph version {version} keeps the schema; QA chain and Cypher memo kept.")
+                return
+
+            chain = GraphCypherQAChain.from_llm(
+                llm=self.llm, graph=self.graph, verbose=self.verbose,
+                allow_dangerous_requests=True, return_intermediate_steps=True
+            )
+            chain.graph_schema = schema
+            self.schema = schema
+            self.chain = chain
+            with self._memo_lock:
+                self._cypher.clear()
+            logger.info(f"QA chain built for graph version {version} (schema {len(self.schema)} chars).")
+
+    def _remember(self, key: str, cypher: str):
+        with self._memo_lock:
+            self._cypher[key] = cypher
+            self._cypher.move_to_end(key)
+            while len(self._cypher) > CYPHER_MEMO_SIZE:
+                self._cypher.popitem(last=False)
+
+    def _recall(self, key: str):
+        with self._memo_lock:
+            cypher = self._cypher.get(key)
+            if cypher:
+                self._cypher.move_to_end(key)
+            return cypher
+
+    def _forget(self, key: str):
+        with self._memo_lock:
+            self._cypher.pop(key, None)
+
+    def _answer_from_context(self, question: str, context: list) -> str:
+        result = self.chain.qa_chain.invoke({"question": question, "context": context})
+        if isinstance(result, dict):
+            return result.get(getattr(self.chain.qa_chain, "output_key", "text"), result.get("text"))
+        return result
+
+    def ask(self, question: str) -> str:
+        """
+        Answers a natural-language question over the graph.
+        """
+        self._ensure_chain()
+        # Not case-folded or stripped of punctuation: "LT-3500" and "lt 3500" need different literals
+        key = " ".join(question.split())
+
+        cypher = self._recall(key)
+        metrics.inc("cache_requests_total", cache="cypher", result="hit" if cypher else "miss")
+        if cypher:
+            try:
+                self.graph.query(f"EXPLAIN {cypher}")
+                context = self.graph.query(cypher)[:self.chain.top_k]
+                logger.info(f"Reused memoized Cypher for: {question}")
+                return self._answer_from_context(question, context)
+            except Exception as e:
+                logger.warning(f"Memoized Cypher no longer valid, regenerating: {e}")
+                self._forget(key)
+
+        result = self.chain.invoke({"query": question})
+        steps = result.get("intermediate_steps") or []
+        if steps and steps[0].get("query"):
+            self._remember(key, steps[0]["query"])
+        return result["result"]
+
+
+def get_qa_engine(graph, llm: str) -> GraphQAEngine:
+    """Returns the process-wide QA engine for a graph connection and model."""
+    return get_resource(f"qa_engine:{id(graph)}:{llm}", lambda: GraphQAEngine(graph, llm))
+
+
+def graph_qa_chain(graph, query: str,llm, use_cache: bool = USE_RESPONSE_CACHE):
+    model_name = llm
     try:
-        llm = ChatGroq(groq_api_key=groq_api_key,model_name=llm)
-        chain=GraphCypherQAChain.from_llm(llm=llm,graph=graph,verbose=True,allow_dangerous_requests=True)
-        response = chain.run(f"{query}")
+        if use_cache:
+            # Exact matches only: questions about different machines or customers
+            # embed close together, and "LT-3500" and "lt 3500" need different answers
+            cache = get_response_cache()
+            cached = cache.get(query, model_name, GRAPH_CONTEXT, normalize=False)
+            if cached is not None:
+                return cached
+
+        response = get_qa_engine(graph, model_name).ask(query)
         logger.info(f"Successfully ran Cypher query: {query}")
+        if use_cache and response:
+            cache.put(query, model_name, response, GRAPH_CONTEXT, normalize=False)
         return response
     except Exception as e:
         logger.error(f"Failed to run Cypher query: {e}")
-        
-        
\ No newline at end of file
+        raise
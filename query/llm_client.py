@@ -0,0 +1,467 @@
+# llm_client.py
+
+import asyncio
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import weakref
+from concurrent.futures import Future
+
+from utils.logger_config import get_logger
+from utils import metrics
+
+logger = get_logger(name=__name__, log_file="query.log")
+
+# === CONFIG ===
+# Any OpenAI-compatible endpoint, e.g. benchmarks/fake_groq_server.py for offline runs
+GROQ_API_URL = os.getenv("GROQ_API_URL", "https://api.groq.com/openai/v1/chat/completions")
+REQUESTS_PER_MINUTE = int(os.getenv("LLM_REQUESTS_PER_MINUTE", "30"))
+TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "15000"))
+DEFAULT_COMPLETION_TOKENS = 512   # assumed reply size when reserving tokens before a call
+CONNECT_TIMEOUT_SECONDS = 5
+LLM_TIMEOUT_SECONDS = 60
+MAX_RETRIES = 4
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 30.0
+BREAKER_FAILURES = 5              # consecutive failed calls that open the circuit
+BREAKER_RESET_SECONDS = 30.0      # open time before one trial call is let through
+MAX_CONCURRENT_LLM_CALLS = 8      # in-flight requests per event loop (async path)
+HTTP_MAX_CONNECTIONS = 20
+HTTP_MAX_KEEPALIVE = 10
+KEEPALIVE_SECONDS = 30
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class LLMError(Exception):
+    """An LLM call failed; `status` is the HTTP status when there was a response."""
+
+    def __init__(self, message: str, status: int = None):
+        super().__init__(message)
+        self.status = status
+
+
+class CircuitOpenError(LLMError):
+    """Raised without calling upstream while the circuit breaker is open."""
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled at `rate` per second up to `capacity`.
+
+    `reserve` always takes the amount, possibly driving the bucket negative, and
+    returns how long the caller must wait; sync callers sleep and async callers
+    await that delay, so both share one budget.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.level = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+            self.updated = now
+            self.level -= amount
+            return 0.0 if self.level >= 0 else -self.level / self.rate
+
+    def refund(self, amount: float):
+        """Returns (or, if negative, takes) tokens once the real usage is known."""
+        with self._lock:
+            self.level = min(self.capacity, self.level + amount)
+
+
+class CircuitBreaker:
+    """
+    Opens after `failures` consecutive failures; after `reset_seconds` one trial
+    call is allowed, which closes the circuit on success and reopens it on failure.
+    """
+
+    def __init__(self, failures: int = BREAKER_FAILURES, reset_seconds: float = BREAKER_RESET_SECONDS):
+        self.failures = failures
+        self.reset_seconds = reset_seconds
+        self.consecutive = 0
+        self.opened_at = None
+        self.trial = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at >= self.reset_seconds and not self.trial:
+                self.trial = True
+                return
+        raise CircuitOpenError("LLM circuit breaker is open; upstream calls are paused")
+
+    def record_success(self):
+        with self._lock:
+            self.consecutive = 0
+            self.opened_at = None
+            self.trial = False
+
+    def release(self):
+        """Ends a trial call without a verdict, so the next call may probe again."""
+        with self._lock:
+            self.trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive += 1
+            if self.trial or self.consecutive >= self.failures:
+                if self.opened_at is None or self.trial:
+                    logger.warning(f"LLM circuit breaker opened after {self.consecutive} failures.")
+                self.opened_at = time.monotonic()
+                self.trial = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if self.trial else "open"
+
+
+def estimate_tokens(payload: dict) -> int:
+    """Rough token count of a chat request: ~4 characters per token plus the reply budget."""
+    chars = sum(len(str(m.get("content", ""))) for m in payload.get("messages", []))
+    return chars // 4 + int(payload.get("max_tokens") or DEFAULT_COMPLETION_TOKENS)
+
+
+def _retry_after(headers) -> float:
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+class LLMClient:
+    """
+    Shared client for OpenAI-compatible chat completions.
+
+    Every call, sync or async, passes through the same request and token
+    buckets and the same circuit breaker. Timeouts, 429 and 5xx replies are
+    retried with jittered exponential backoff that honours Retry-After.
+    Identical prompts already in flight are coalesced (single-flight): later
+    callers wait for the first call's result instead of calling upstream.
+    """
+
+    def __init__(self, api_url: str = GROQ_API_URL, api_key: str = None,
+                 requests_per_minute: int = REQUESTS_PER_MINUTE, tokens_per_minute: int = TOKENS_PER_MINUTE):
+        self.api_url = api_url
+        self.api_key = api_key or os.getenv("groq_api_key")
+        self.request_bucket = TokenBucket(requests_per_minute / 60.0, max(1, requests_per_minute // 6))
+        self.token_bucket = TokenBucket(tokens_per_minute / 60.0, tokens_per_minute)
+        self.breaker = CircuitBreaker()
+        self.calls = 0
+        self.coalesced = 0
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        self._loop_state = weakref.WeakKeyDictionary()
+        self._session = None
+
+    # --- shared helpers ---
+
+    def _headers(self, api_key: str = None) -> dict:
+        return {"Authorization": f"Bearer {api_key or self.api_key}", "Content-Type": "application/json"}
+
+    @staticmethod
+    def _flight_key(payload: dict, api_key: str = None) -> str:
+        raw = json.dumps(payload, sort_keys=True) + "\0" + str(api_key)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _admit(self, payload: dict, reserve_tokens: bool = True):
+        """
+        Checks the breaker and reserves rate budget; returns (tokens reserved, wait seconds).
+
+        Every attempt takes a request slot, but tokens are reserved once per
+        logical request: rejected attempts consume none upstream.
+        """
+        try:
+            self.breaker.allow()
+        except CircuitOpenError:
+            metrics.inc("llm_requests_total", status="circuit_open")
+            raise
+        tokens = estimate_tokens(payload) if reserve_tokens else 0
+        wait = max(self.request_bucket.reserve(1), self.token_bucket.reserve(tokens) if tokens else 0.0)
+        if wait:
+            metrics.observe("llm_rate_limit_wait_seconds", wait)
+        return tokens, wait
+
+    def _settle_breaker(self, outcome: str):
+        # Runs on every exit of an attempt, so a half-open trial always ends
+        if outcome == "success":
+            self.breaker.record_success()
+        elif outcome == "failure":
+            self.breaker.record_failure()
+        else:
+            self.breaker.release()
+
+    def _settle(self, reserved: int, body: dict):
+        usage = (body or {}).get("usage") or {}
+        metrics.inc("llm_tokens_total", usage.get("prompt_tokens") or 0, kind="prompt")
+        metrics.inc("llm_tokens_total", usage.get("completion_tokens") or 0, kind="completion")
+        if usage.get("total_tokens"):
+            self.token_bucket.refund(reserved - usage["total_tokens"])
+
+    @staticmethod
+    def _record(status, started: float):
+        metrics.inc("llm_requests_total", status=status)
+        metrics.observe("llm_request_seconds", time.perf_counter() - started, status=status)
+
+    @staticmethod
+    def _backoff(attempt: int, retry_after: float = None) -> float:
+        delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt)
+        delay = random.uniform(delay / 2, delay)   # jitter spreads out retries of a burst
+        return max(delay, retry_after or 0.0)
+
+    @staticmethod
+    def _content(body: dict) -> str:
+        return body["choices"][0]["message"]["content"]
+
+    # --- sync ---
+
+    def _get_session(self):
+        if self._session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            session = requests.Session()
+            session.mount("https://", HTTPAdapter(pool_maxsize=HTTP_MAX_CONNECTIONS))
+            session.mount("http://", HTTPAdapter(pool_maxsize=HTTP_MAX_CONNECTIONS))
+            self._session = session
+        return self._session
+
+    def _post(self, payload: dict, api_key: str = None, stream: bool = False):
+        """Sends one request with rate limiting, retries and the breaker; returns the response."""
+        import requests
+
+        reserved = 0
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                tokens, wait = self._admit(payload, reserve_tokens=attempt == 0)
+            except CircuitOpenError:
+                self.token_bucket.refund(reserved)
+                raise
+            reserved += tokens
+            if wait:
+                time.sleep(wait)
+            retry_after = None
+            outcome = None
+            try:
+                self.calls += 1
+                started = time.perf_counter()
+                response = self._get_session().post(
+                    self.api_url, headers=self._headers(api_key), json=payload, stream=stream,
+                    timeout=(CONNECT_TIMEOUT_SECONDS, LLM_TIMEOUT_SECONDS)
+                )
+                self._record(response.status_code, started)
+                if response.status_code == 200:
+                    outcome = "success"
+                    return response, reserved
+                error = LLMError(f"LLM API error {response.status_code}: {response.text}", response.status_code)
+                retry_after = _retry_after(response.headers)
+                response.close()
+                if response.status_code not in RETRY_STATUS:
+                    # The upstream answered; a client error says nothing about its health
+                    outcome = "success"
+                    self.token_bucket.refund(reserved)
+                    raise error
+                outcome = "failure"
+            except requests.RequestException as e:
+                self._record("error", started)
+                error = LLMError(f"LLM request failed: {e}")
+                outcome = "failure"
+            finally:
+                self._settle_breaker(outcome)
+            if attempt == MAX_RETRIES:
+                self.token_bucket.refund(reserved)
+                raise error
+            delay = self._backoff(attempt, retry_after)
+            metrics.inc("retries_total", component="llm")
+            logger.warning(f"{error}; retry {attempt + 1}/{MAX_RETRIES} in {delay:.1f}s")
+            time.sleep(delay)
+
+    def chat(self, payload: dict, api_key: str = None) -> str:
+        """
+        Runs a chat completion and returns the reply text.
+
+        Raises:
+            LLMError: When the call failed after all retries (CircuitOpenError
+                while the breaker is open).
+        """
+        key = self._flight_key(payload, api_key)
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+        if not leader:
+            self.coalesced += 1
+            metrics.inc("llm_coalesced_total")
+            return future.result()
+
+        try:
+            response, reserved = self._post(payload, api_key)
+            body = response.json()
+            self._settle(reserved, body)
+            future.set_result(self._content(body))
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(key, None)
+        return future.result()
+
+    def open_stream(self, payload: dict, api_key: str = None):
+        """
+        Starts a streaming (SSE) completion. Rate limits, retries and the breaker
+        apply until the response headers arrive; the caller reads and closes the
+        returned requests.Response.
+        """
+        response, _ = self._post({**payload, "stream": True}, api_key, stream=True)
+        return response
+
+    # --- async ---
+
+    def _async_state(self):
+        loop = asyncio.get_running_loop()
+        state = self._loop_state.get(loop)
+        if state is None:
+            # Imported lazily: httpx is only needed by the async path
+            import httpx
+
+            client = httpx.AsyncClient(
+                timeout=httpx.Timeout(LLM_TIMEOUT_SECONDS, connect=CONNECT_TIMEOUT_SECONDS),
+                limits=httpx.Limits(
+                    max_connections=HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                    keepalive_expiry=KEEPALIVE_SECONDS,
+                ),
+            )
+            state = self._loop_state[loop] = (client, asyncio.Semaphore(MAX_CONCURRENT_LLM_CALLS), {})
+        return state
+
+    async def _apost(self, payload: dict, api_key: str = None) -> dict:
+        import httpx
+
+        client, semaphore, _ = self._async_state()
+        reserved = 0
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                tokens, wait = self._admit(payload, reserve_tokens=attempt == 0)
+            except CircuitOpenError:
+                self.token_bucket.refund(reserved)
+                raise
+            reserved += tokens
+            if wait:
+                await asyncio.sleep(wait)
+            retry_after = None
+            outcome = None
+            try:
+                async with semaphore:
+                    self.calls += 1
+                    started = time.perf_counter()
+                    response = await client.post(self.api_url, headers=self._headers(api_key), json=payload)
+                self._record(response.status_code, started)
+                if response.status_code == 200:
+                    outcome = "success"
+                    body = response.json()
+                    self._settle(reserved, body)
+                    return body
+                error = LLMError(f"LLM API error {response.status_code}: {response.text}", response.status_code)
+                retry_after = _retry_after(response.headers)
+                if response.status_code not in RETRY_STATUS:
+                    # The upstream answered; a client error says nothing about its health
+                    outcome = "success"
+                    self.token_bucket.refund(reserved)
+                    raise error
+                outcome = "failure"
+            except httpx.HTTPError as e:
+                self._record("error", started)
+                error = LLMError(f"LLM request failed: {e!r}")
+                outcome = "failure"
+            finally:
+                self._settle_breaker(outcome)
+            if attempt == MAX_RETRIES:
+                self.token_bucket.refund(reserved)
+                raise error
+            # Waiting happens outside the semaphore so other calls can use the slot
+            delay = self._backoff(attempt, retry_after)
+            metrics.inc("retries_total", component="llm")
+            logger.warning(f"{error}; retry {attempt + 1}/{MAX_RETRIES} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    async def achat(self, payload: dict, api_key: str = None) -> str:
+        """Async variant of `chat` on a per-event-loop pooled httpx client."""
+        _, _, inflight = self._async_state()
+        key = self._flight_key(payload, api_key)
+        task = inflight.get(key)
+        if task is None:
+            task = inflight[key] = asyncio.ensure_future(self._apost(payload, api_key))
+            task.add_done_callback(lambda _: inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+            metrics.inc("llm_coalesced_total")
+        # shield: one cancelled caller must not cancel the call the others wait on
+        return self._content(await asyncio.shield(task))
+
+    async def aclose(self):
+        """Closes the running loop's HTTP client, e.g. on shutdown."""
+        state = self._loop_state.pop(asyncio.get_running_loop(), None)
+        if state is not None:
+            await state[0].aclose()
+
+    def stats(self) -> dict:
+        return {"calls": self.calls, "coalesced": self.coalesced, "breaker": self.breaker.state}
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_llm_client() -> LLMClient:
+    """Returns the process-wide LLM client shared by diagnoses and the QA chain."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = LLMClient()
+        return _client
+
+
+def make_chat_model(model_name: str):
+    """
+    Builds a LangChain chat model that sends every call through the shared
+    LLM client, so the QA chain shares its rate limits, retries and breaker.
+    """
+    # Imported lazily: langchain is only needed once a question is asked
+    from langchain_core.language_models.chat_models import BaseChatModel
+    from langchain_core.messages import AIMessage
+    from langchain_core.outputs import ChatGeneration, ChatResult
+
+    roles = {"human": "user", "ai": "assistant", "system": "system"}
+
+    class SharedClientChat(BaseChatModel):
+        model_name: str
+
+        @property
+        def _llm_type(self) -> str:
+            return "shared-llm-client"
+
+        def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+            payload = {
+                "model": self.model_name,
+                "messages": [{"role": roles.get(m.type, "user"), "content": m.content} for m in messages],
+            }
+            if stop:
+                payload["stop"] = stop
+            text = get_llm_client().chat(payload)
+            return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    return SharedClientChat(model_name=model_name)
@@ -0,0 +1,235 @@
+# response_cache.py
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import numpy as np
+from utils.logger_config import get_logger
+from utils import metrics
+
+logger = get_logger(name=__name__, log_file="query.log")
+
+# === CONFIG ===
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", "data/response_cache.sqlite")
+MAX_ENTRIES = 10000
+TTL_SECONDS = 7 * 24 * 3600
+SEMANTIC_THRESHOLD = 0.92   # cosine similarity for a paraphrased question to count as a hit
+USE_RESPONSE_CACHE = True
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    context_hash TEXT NOT NULL,
+    query_norm TEXT NOT NULL,
+    embedding BLOB,
+    response TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS responses_scope ON responses (model, context_hash);
+CREATE INDEX IF NOT EXISTS responses_access ON responses (last_access);
+CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+def normalize_query(text: str) -> str:
+    """Lower-cases, drops punctuation and collapses whitespace."""
+    text = re.sub(r"[^\w\s]", " ", str(text).casefold())
+    return " ".join(text.split())
+
+
+def context_hash(context: str) -> str:
+    return hashlib.sha256(str(context or "").encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Persistent LLM response cache backed by SQLite.
+
+    Entries are keyed on (normalized query, model name, hash of the retrieved
+    context). When no exact key matches, a query whose embedding is within
+    `semantic_threshold` cosine similarity of a cached query with the same model
+    and context is served from that entry. Entries expire after `ttl_seconds`
+    and the least recently used are evicted beyond `max_entries`.
+    """
+
+    def __init__(self, path: str = RESPONSE_CACHE_PATH, max_entries: int = MAX_ENTRIES,
+                 ttl_seconds: float = TTL_SECONDS, semantic_threshold: float = SEMANTIC_THRESHOLD):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.semantic_threshold = semantic_threshold
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+
+    @staticmethod
+    def _key(query_norm: str, model: str, ctx_hash: str) -> str:
+        return hashlib.sha256(f"{model}\0{ctx_hash}\0{query_norm}".encode("utf-8")).hexdigest()
+
+    def get(self, query: str, model: str, context: str = "", embedding=None, normalize: bool = True):
+        """
+        Returns a cached response or None.
+
+        Args:
+            query (str): The user question.
+            model (str): LLM model name.
+            context (str): Retrieved context the answer depends on.
+            embedding: Optional query embedding enabling semantic hits.
+            normalize (bool): Match on the normalized question; False only
+                collapses whitespace, for answers that depend on exact literals.
+        """
+        query_norm = normalize_query(query) if normalize else " ".join(str(query).split())
+        ctx_hash = context_hash(context)
+        now = time.time()
+        oldest = now - self.ttl_seconds
+
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT key, response FROM responses WHERE key = ? AND created_at >= ?",
+                (self._key(query_norm, model, ctx_hash), oldest)
+            ).fetchone()
+            semantic = False
+            if row is None and embedding is not None:
+                row = self._semantic_lookup(model, ctx_hash, embedding, oldest)
+                semantic = row is not None
+
+            if row is None:
+                self.misses += 1
+                metrics.inc("cache_requests_total", cache="response", result="miss")
+                return None
+
+            self._conn.execute(
+                "UPDATE responses SET last_access = ?, hits = hits + 1 WHERE key = ?", (now, row[0])
+            )
+            self._conn.commit()
+
+        self.hits += 1
+        if semantic:
+            self.semantic_hits += 1
+        metrics.inc("cache_requests_total", cache="response", result="semantic_hit" if semantic else "hit")
+        logger.info(f"Response cache {'semantic ' if semantic else ''}hit for: {query}")
+        return row[1]
+
+    def _semantic_lookup(self, model, ctx_hash, embedding, oldest):
+        rows = self._conn.execute(
+            """
+            SELECT key, response, embedding FROM responses
+            WHERE model = ? AND context_hash = ? AND embedding IS NOT NULL AND created_at >= ?
+            """,
+            (model, ctx_hash, oldest)
+        ).fetchall()
+        if not rows:
+            return None
+        query = np.asarray(embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        matrix = np.vstack([np.frombuffer(r[2], dtype=np.float32) for r in rows])
+        matrix = matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        scores = matrix @ query
+        best = int(np.argmax(scores))
+        if scores[best] >= self.semantic_threshold:
+            return rows[best][0], rows[best][1]
+        return None
+
+    def put(self, query: str, model: str, response: str, context: str = "", embedding=None,
+            normalize: bool = True):
+        """Stores a response, evicting expired and least recently used entries."""
+        query_norm = normalize_query(query) if normalize else " ".join(str(query).split())
+        ctx_hash = context_hash(context)
+        blob = None if embedding is None else np.asarray(embedding, dtype=np.float32).tobytes()
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT OR REPLACE INTO responses
+                    (key, model, context_hash, query_norm, embedding, response, created_at, last_access, hits)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0)
+                """,
+                (self._key(query_norm, model, ctx_hash), model, ctx_hash, query_norm, blob, response, now, now)
+            )
+            self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,))
+            self._conn.execute(
+                """
+                DELETE FROM responses WHERE key IN (
+                    SELECT key FROM responses ORDER BY last_access DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_entries,)
+            )
+            self._conn.commit()
+
+    def invalidate(self):
+        """Drops every cached response, e.g. after the graph was reloaded."""
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+        logger.info("Response cache invalidated.")
+
+    def sync_graph_version(self, version) -> bool:
+        """
+        Invalidates the cache if the graph version differs from the one the
+        entries were produced against.
+
+        Returns:
+            bool: True if the cache was invalidated.
+        """
+        if version is None:
+            return False
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE name = 'graph_version'").fetchone()
+            changed = row is None or row[0] != str(version)
+            if changed:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO meta (name, value) VALUES ('graph_version', ?)", (str(version),)
+                )
+                self._conn.commit()
+        if changed and row is not None:
+            self.invalidate()
+        return changed and row is not None
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        with self._lock:
+            entries = self._conn.execute("SELECT count(*) FROM responses").fetchone()[0]
+        return {
+            "entries": entries,
+            "hits": self.hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+def embed_query(query: str):
+    """Embeds a query with the shared model for semantic lookups; None if unavailable."""
+    try:
+        from utils.model_registry import get_model
+        return get_model().encode(query, convert_to_numpy=True)
+    except Exception as e:
+        logger.warning(f"Could not embed query for semantic cache lookup: {e}")
+        return None
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    """Returns the process-wide response cache."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache()
+        return _cache
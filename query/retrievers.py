@@ -0,0 +1,92 @@
+# retrievers.py
+
+import os
+from utils.logger_config import get_logger
+from utils import metrics
+from embedding_relation.local_index import LocalVectorIndex, LOCAL_INDEX_DIR
+from knowledge_graph.problem_context import CONTEXT_PROJECTION
+
+logger = get_logger(name=__name__, log_file="query.log")
+
+# === CONFIG ===
+RETRIEVER_BACKEND = os.getenv("RETRIEVER_BACKEND", "neo4j")   # "neo4j" or "local"
+
+# Reads the context materialized on each Problem; one unique-key lookup per hit
+CONTEXT_QUERY = f"""
+UNWIND $hits AS hit
+MATCH (problem:Problem {{text: hit.text}})
+RETURN
+    problem.text AS text,
+    hit.score AS score,
+    {CONTEXT_PROJECTION}
+ORDER BY score DESC
+"""
+
+
+class Neo4jRetriever:
+    """
+    Vector search through Neo4j's `problem_index`.
+    """
+
+    def __init__(self, driver, index_name: str = "problem_index"):
+        self.driver = driver
+        self.index_name = index_name
+
+    @metrics.timed("retrieval.neo4j")
+    def search(self, vector, top_k: int = 3) -> list:
+        with self.driver.session() as session:
+            result = session.run(
+                """
+                CALL db.index.vector.queryNodes($index_name, $top_k, $embedding)
+                YIELD node, score
+                RETURN node.text AS text, score
+                """,
+                index_name=self.index_name, top_k=top_k, embedding=list(map(float, vector))
+            )
+            return [record.data() for record in result]
+
+
+class LocalRetriever:
+    """
+    In-process vector search over the memory-mapped index written by the
+    embedding stage. Needs no database, so it also works fully offline.
+    """
+
+    def __init__(self, label: str = "Problem", base_dir: str = LOCAL_INDEX_DIR):
+        self.index = LocalVectorIndex.load(label, base_dir)
+
+    @metrics.timed("retrieval.local")
+    def search(self, vector, top_k: int = 3) -> list:
+        return self.index.search(vector, top_k)
+
+
+def fetch_problem_context(driver, hits: list) -> list:
+    """
+    Attaches the materialized causes, actions and machines to the winning Problem hits.
+
+    Without a driver the hits are returned with empty context, so retrieval can
+    be exercised offline.
+
+    Args:
+        driver: Neo4j driver instance or None.
+        hits (list[dict]): {"text", "score"} hits from a retriever.
+
+    Returns:
+        list[dict]: Records with text, score, causes, actions and machines.
+    """
+    if driver is None:
+        return [{**hit, "causes": [], "actions": [], "machines": [], "context": None} for hit in hits]
+    with driver.session() as session:
+        return [record.data() for record in session.run(CONTEXT_QUERY, hits=hits)]
+
+
+def get_retriever(backend: str = RETRIEVER_BACKEND, driver=None):
+    """
+    Builds the configured retriever, falling back to Neo4j if the local index is missing.
+    """
+    if backend == "local":
+        try:
+            return LocalRetriever()
+        except (OSError, ValueError) as e:
+            logger.warning(f"Local index unavailable, using Neo4j retriever: {e}")
+    return Neo4jRetriever(driver)
@@ -0,0 +1,354 @@
+# template_router.py
+
+import datetime
+import re
+import threading
+import time
+
+import numpy as np
+from utils.logger_config import get_logger
+from utils import metrics
+from utils.model_registry import get_model, get_resource
+from knowledge_graph.neo4j_load import GRAPH_STATE_LABEL, GRAPH_STATE_NAME
+from query.graph_cypher_qa_chain import graph_qa_chain
+from embedding_relation.text_encoding import normalize_text
+
+logger = get_logger(name=__name__, log_file="query.log")
+
+# === CONFIG ===
+ROUTE_THRESHOLD = 0.6          # minimum similarity between a question and a template example
+DICTIONARY_CHECK_SECONDS = 30  # how often the graph version is re-read to refresh entity values
+MAX_ROWS = 10
+
+# Known entity values, read from the labels MERGEd by main.CYPHER_QUERY
+ENTITY_QUERIES = {
+    "machine_model": "MATCH (n:Machine) RETURN DISTINCT n.model AS value",
+    "make": "MATCH (n:Make) RETURN DISTINCT n.name AS value",
+    "customer": "MATCH (n:Customer) RETURN DISTINCT n.name AS value",
+    "failure_mode": "MATCH (n:FailureMode) RETURN DISTINCT n.type AS value",
+}
+
+# Placeholder words that replace entity mentions before the question is embedded,
+# so routing depends on the question's shape rather than the values in it
+ENTITY_PLACEHOLDERS = {
+    "machine_model": "MODEL",
+    "make": "MAKE",
+    "customer": "CUSTOMER",
+    "failure_mode": "FAILUREMODE",
+    "period": "PERIOD",
+}
+
+CYPHER_TEMPLATES = [
+    {
+        "name": "fixes_for_problem_on_model",
+        "entities": ["machine_model"],
+        "examples": [
+            "what fixes the spindle noise on machine model MODEL",
+            "how do I repair overheating on MODEL",
+            "corrective action for coolant leak on machine MODEL",
+            "what solved this problem on MODEL machines",
+        ],
+        "cypher": """
+            CALL db.index.vector.queryNodes('problem_index', 25, $embedding)
+            YIELD node AS problem, score
+            MATCH (:Machine {model: $machine_model})-[:HAS_COMPONENT]->(:Component)-[:HAS_PROBLEM]->(problem)
+            OPTIONAL MATCH (problem)-[:CAUSED_BY]->(cause:Cause)
+            OPTIONAL MATCH (cause)-[:RESOLVED_BY]->(action:CorrectiveAction)
+            RETURN problem.text AS problem, score,
+                   collect(DISTINCT cause.text) AS causes,
+                   collect(DISTINCT action.text) AS actions
+            ORDER BY score DESC
+            LIMIT 3
+        """,
+    },
+    {
+        "name": "customers_with_failure_mode",
+        "entities": ["failure_mode"],
+        "examples": [
+            "which customers had failure mode FAILUREMODE",
+            "list customers affected by FAILUREMODE",
+            "who experienced FAILUREMODE failures",
+        ],
+        "cypher": """
+            MATCH (:FailureMode {type: $failure_mode})<-[:HAS_FAILURE_MODE]-(problem:Problem)
+                  <-[:HAS_PROBLEM]-(:Component)<-[:HAS_COMPONENT]-(machine:Machine)
+            MATCH (customer:Customer)<-[:HAS_CUSTOMER]-(sr:ServiceRequest)-[:ON_MACHINE]->(machine)
+            // Only requests that reported this problem, not every request on the machine
+            WHERE sr.problem_text = problem.text
+            RETURN customer.name AS customer, count(DISTINCT sr) AS requests
+            ORDER BY requests DESC
+            LIMIT $limit
+        """,
+    },
+    {
+        "name": "request_count_for_make",
+        "entities": ["make"],
+        "optional": ["period"],
+        "examples": [
+            "how many requests for make MAKE PERIOD",
+            "number of service requests for MAKE machines PERIOD",
+            "count of tickets for MAKE PERIOD",
+        ],
+        "cypher": """
+            MATCH (sr:ServiceRequest)-[:ON_MACHINE]->(:Machine)-[:MADE_BY]->(:Make {name: $make})
+            WHERE sr.date >= $start AND sr.date < $end
+            RETURN count(DISTINCT sr) AS requests
+        """,
+    },
+    {
+        "name": "requests_for_customer",
+        "entities": ["customer"],
+        "optional": ["period"],
+        "examples": [
+            "how many service requests did CUSTOMER raise PERIOD",
+            "show requests from customer CUSTOMER",
+            "what tickets has CUSTOMER opened PERIOD",
+        ],
+        "cypher": """
+            MATCH (:Customer {name: $customer})<-[:HAS_CUSTOMER]-(sr:ServiceRequest)
+            WHERE sr.date >= $start AND sr.date < $end
+            OPTIONAL MATCH (sr)-[:ON_MACHINE]->(machine:Machine)
+            RETURN sr.id AS request, sr.date AS date, machine.model AS machine
+            ORDER BY date DESC
+            LIMIT $limit
+        """,
+    },
+    {
+        "name": "problems_on_model",
+        "entities": ["machine_model"],
+        "examples": [
+            "what problems occur on machine model MODEL",
+            "list the issues reported for MODEL",
+            "common failures of MODEL",
+        ],
+        "cypher": """
+            MATCH (:Machine {model: $machine_model})-[:HAS_COMPONENT]->(component:Component)-[:HAS_PROBLEM]->(problem:Problem)
+            RETURN problem.text AS problem, component.name AS component
+            LIMIT $limit
+        """,
+    },
+    {
+        "name": "causes_of_failure_mode",
+        "entities": ["failure_mode"],
+        "examples": [
+            "what causes FAILUREMODE",
+            "root causes of failure mode FAILUREMODE",
+            "why does FAILUREMODE happen",
+        ],
+        "cypher": """
+            MATCH (:FailureMode {type: $failure_mode})<-[:HAS_FAILURE_MODE]-(:Problem)-[:CAUSED_BY]->(cause:Cause)
+            OPTIONAL MATCH (cause)-[:RESOLVED_BY]->(action:CorrectiveAction)
+            RETURN cause.text AS cause, collect(DISTINCT action.text) AS actions
+            LIMIT $limit
+        """,
+    },
+]
+
+MONTHS = {name.lower(): i for i, name in enumerate(
+    ["January", "February", "March", "April", "May", "June", "July",
+     "August", "September", "October", "November", "December"], start=1)}
+
+
+def _month_start(day: datetime.date, offset: int = 0) -> datetime.date:
+    month = day.month - 1 + offset
+    return datetime.date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def extract_period(question: str, today: datetime.date = None):
+    """
+    Finds a relative or absolute date range in the question.
+
+    Returns:
+        tuple or None: (start, end, matched text) with ISO dates, end exclusive.
+    """
+    today = today or datetime.date.today()
+    q = question.lower()
+    patterns = [
+        (r"\blast month\b", lambda m: (_month_start(today, -1), _month_start(today))),
+        (r"\bthis month\b", lambda m: (_month_start(today), _month_start(today, 1))),
+        (r"\blast year\b", lambda m: (datetime.date(today.year - 1, 1, 1), datetime.date(today.year, 1, 1))),
+        (r"\bthis year\b", lambda m: (datetime.date(today.year, 1, 1), datetime.date(today.year + 1, 1, 1))),
+        (r"\blast (\d+) days\b", lambda m: (today - datetime.timedelta(days=int(m.group(1))),
+                                            today + datetime.timedelta(days=1))),
+        (r"\bin (" + "|".join(MONTHS) + r") (\d{4})\b",
+         lambda m: (datetime.date(int(m.group(2)), MONTHS[m.group(1)], 1),
+                    _month_start(datetime.date(int(m.group(2)), MONTHS[m.group(1)], 1), 1))),
+        (r"\bin (\d{4})\b", lambda m: (datetime.date(int(m.group(1)), 1, 1), datetime.date(int(m.group(1)) + 1, 1, 1))),
+    ]
+    for pattern, to_range in patterns:
+        match = re.search(pattern, q)
+        if match:
+            start, end = to_range(match)
+            return start.isoformat(), end.isoformat(), match.group(0)
+    return None
+
+
+def format_rows(template: dict, params: dict, rows: list) -> str:
+    """Renders template results as plain text, without an LLM."""
+    name = template["name"]
+    if not rows:
+        return "No matching records were found in the knowledge graph."
+    if name == "fixes_for_problem_on_model":
+        parts = [f"Known fixes on machine model {params['machine_model']}:"]
+        for r in rows:
+            parts.append(f"- Problem: {r['problem']} (score: {r['score']:.3f})")
+            parts.append(f"  Causes: {', '.join(r['causes']) or 'Not available'}")
+            parts.append(f"  Corrective actions: {', '.join(r['actions']) or 'Not available'}")
+        return "\n".join(parts)
+    if name == "request_count_for_make":
+        return f"{rows[0]['requests']} service requests for make {params['make']}{params.get('period_text', '')}."
+    lines = []
+    for r in rows[:MAX_ROWS]:
+        lines.append("- " + ", ".join(
+            f"{k}: {', '.join(map(str, v)) if isinstance(v, list) else v}" for k, v in r.items()
+        ))
+    return "\n".join(lines)
+
+
+def _compile_values(values: list):
+    """
+    One case-insensitive alternation over all values of an entity, compiled once
+    per dictionary load. Values are ordered longest first, so "LT-3500X" wins
+    over "LT-3500" at the same position.
+
+    Returns:
+        tuple: (pattern, mapping of lowercased value to the stored value).
+    """
+    pattern = re.compile(r"(?<!\w)(?:" + "|".join(map(re.escape, values)) + r")(?!\w)", re.IGNORECASE)
+    return pattern, {value.lower(): value for value in reversed(values)}
+
+
+class TemplateRouter:
+    """
+    Routes questions to precompiled Cypher templates.
+
+    Entity values (machine models, makes, customers, ...) are extracted with a
+    dictionary read from the graph. The question, with entities replaced by
+    placeholders, is matched against template examples by embedding similarity.
+    """
+
+    def __init__(self, graph):
+        self.graph = graph
+        self.model = get_model()
+        self.dictionary = {}
+        self.patterns = {}
+        self.graph_version = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+        examples, owners = [], []
+        for i, template in enumerate(CYPHER_TEMPLATES):
+            examples.extend(template["examples"])
+            owners.extend([i] * len(template["examples"]))
+        self.example_owner = np.array(owners)
+        embeddings = self.model.encode([normalize_text(e) for e in examples], convert_to_numpy=True)
+        self.example_embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+    def _refresh_dictionary(self):
+        now = time.monotonic()
+        if self.dictionary and now - self._checked_at < DICTIONARY_CHECK_SECONDS:
+            return
+        with self._lock:
+            rows = self.graph.query(
+                f"MATCH (s:{GRAPH_STATE_LABEL} {{name: $name}}) RETURN s.version AS version",
+                {"name": GRAPH_STATE_NAME}
+            )
+            version = rows[0]["version"] if rows else None
+            self._checked_at = now
+            if self.dictionary and version == self.graph_version:
+                return
+            dictionary = {}
+            for entity, cypher in ENTITY_QUERIES.items():
+                values = [r["value"] for r in self.graph.query(cypher) if r["value"]]
+                # Longest first so "LT-3500X" wins over "LT-3500"
+                dictionary[entity] = sorted(set(map(str, values)), key=len, reverse=True)
+            self.patterns = {entity: _compile_values(values) for entity, values in dictionary.items() if values}
+            self.dictionary = dictionary
+            self.graph_version = version
+            logger.info(f"Template router dictionary loaded for graph version {version}.")
+
+    def extract_entities(self, question: str):
+        """
+        Returns (entities, masked question) where entity mentions are replaced by placeholders.
+        """
+        self._refresh_dictionary()
+        entities = {}
+        masked = question
+        for entity, (pattern, canonical) in self.patterns.items():
+            match = pattern.search(masked)
+            if match:
+                entities[entity] = canonical[match.group(0).lower()]
+                masked = pattern.sub(ENTITY_PLACEHOLDERS[entity], masked)
+        period = extract_period(masked)
+        if period:
+            entities["period"] = period
+            masked = re.sub(re.escape(period[2]), ENTITY_PLACEHOLDERS["period"], masked, flags=re.IGNORECASE)
+        return entities, masked
+
+    def match(self, question: str):
+        """
+        Finds the best template whose required entities are present.
+
+        Returns:
+            tuple or None: (template, params); params include the question embedding.
+        """
+        entities, masked = self.extract_entities(question)
+        # Same normalization as the indexed node texts and find_similar_problem
+        embedding = self.model.encode(normalize_text(question), convert_to_numpy=True)
+        masked_embedding = self.model.encode(normalize_text(masked), convert_to_numpy=True)
+        masked_embedding = masked_embedding / (np.linalg.norm(masked_embedding) or 1.0)
+
+        scores = self.example_embeddings @ masked_embedding
+        best = {}
+        for owner, score in zip(self.example_owner, scores):
+            best[owner] = max(best.get(owner, -1.0), float(score))
+
+        for owner, score in sorted(best.items(), key=lambda item: item[1], reverse=True):
+            if score < ROUTE_THRESHOLD:
+                break
+            template = CYPHER_TEMPLATES[owner]
+            if not all(e in entities for e in template["entities"]):
+                continue
+            params = {e: entities[e] for e in template["entities"]}
+            params["limit"] = MAX_ROWS
+            params["embedding"] = embedding.tolist()
+            start, end, text = entities.get("period", ("0000-00-00", "9999-99-99", ""))
+            params.update(start=start, end=end, period_text=f" {text}" if text else "")
+            logger.info(f"Question routed to template '{template['name']}' (score {score:.3f})")
+            return template, params
+        return None
+
+    def answer(self, question: str):
+        """
+        Answers the question from a template, or returns None if none fits.
+        """
+        matched = self.match(question)
+        if matched is None:
+            return None
+        template, params = matched
+        cypher_params = {k: v for k, v in params.items() if k != "period_text"}
+        rows = self.graph.query(template["cypher"], cypher_params)
+        return format_rows(template, params, rows)
+
+
+def get_template_router(graph) -> TemplateRouter:
+    """Returns the process-wide router for a graph connection."""
+    return get_resource(f"template_router:{id(graph)}", lambda: TemplateRouter(graph))
+
+
+def answer_question(graph, query: str, llm):
+    """
+    Answers a question with a precompiled Cypher template when one fits, with no
+    LLM call; otherwise falls back to graph_qa_chain.
+    """
+    try:
+        with metrics.span("query.template"):
+            answer = get_template_router(graph).answer(query)
+        if answer is not None:
+            metrics.inc("questions_total", route="template")
+            return answer
+    except Exception as e:
+        logger.warning(f"Template routing failed, falling back to QA chain: {e}")
+    metrics.inc("questions_total", route="qa_chain")
+    with metrics.span("query.graph_qa"):
+        return graph_qa_chain(graph=graph, query=query, llm=llm)
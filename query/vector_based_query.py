@@ -1,109 +1,206 @@
-from sentence_transformers import SentenceTransformer
 import numpy as np
-import requests
+import json
+import time
 from utils.logger_config import get_logger
+from utils import metrics
 from neo4j import Driver
+from query.retrievers import fetch_problem_context
+from query.response_cache import get_response_cache, embed_query, USE_RESPONSE_CACHE
+from query.llm_client import get_llm_client
+from knowledge_graph.problem_context import CONTEXT_PROJECTION
+from query.context_assembler import assemble_context
+from embedding_relation.text_encoding import normalize_text
 import os
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
 
 logger = get_logger(name=__name__, log_file="query.log")
 groq_api_key = os.getenv("groq_api_key")
-model = SentenceTransformer("all-MiniLM-L6-v2")
 
-def find_similar_problem(user_input: str, driver: Driver, model: SentenceTransformer, top_k: int = 3) -> str:
+# One index lookup; causes, actions and machines are read from the context
+# materialized on each Problem at ingestion (knowledge_graph/problem_context.py)
+SIMILAR_PROBLEM_QUERY = f"""
+        CALL db.index.vector.queryNodes('problem_index', $top_k, $embedding)
+        YIELD node AS problem, score
+        RETURN
+            problem.text AS text,
+            score,
+            {CONTEXT_PROJECTION}
+        """
+
+
+def build_diagnosis_request(user_input: str, problem_context: str, model_name: str) -> dict:
+    """Builds the chat-completions payload for a diagnosis."""
+    prompt = (
+        "Given the following service case details from a manufacturing knowledge graph, provide a professional "
+        "explanation of the problem and suggest further checks or steps if needed.\n"
+        f"User Input: {user_input}\n"
+        f"Problem Context:\n{problem_context}"
+    )
+
+    return {
+        "model": model_name,
+        "messages": [
+            {"role": "system", "content": "You are a technical expert in mechanical systems and industrial service operations."},
+            {"role": "user", "content": prompt}
+        ]
+    }
+
+
+@metrics.timed("query.find_similar_problem")
+def find_similar_problem(user_input: str, driver: Driver, model: "SentenceTransformer", top_k: int = 3,
+                         retriever=None, stats: dict = None) -> str:
     """
     Finds similar problems from the Neo4j knowledge graph using vector search and returns context.
+
+    By default the vector search runs inside Neo4j and reads the materialized
+    context of each hit. With a retriever (see query.retrievers) the search runs
+    through it, e.g. in-process, and the graph is only queried for the winning
+    problems. All top-k hits are merged into one context packed into the token
+    budget (see query.context_assembler); `stats` receives the packing report.
     """
     
     try:
         logger.info(f"Finding similar problems for input: {user_input}")
-        user_vector = model.encode(user_input, convert_to_numpy=True).tolist()
-
-        cypher = """
-        CALL db.index.vector.queryNodes('problem_index', $top_k, $embedding)
-        YIELD node AS problem, score
-        OPTIONAL MATCH (problem)-[:CAUSED_BY]->(cause:Cause)
-        OPTIONAL MATCH (cause)-[:RESOLVED_BY]->(action:CorrectiveAction)
-        OPTIONAL MATCH (component:Component)-[:HAS_PROBLEM]->(problem)
-        OPTIONAL MATCH (machine:Machine)-[:HAS_COMPONENT]->(component)
-        OPTIONAL MATCH (req:ServiceRequest)-[:ON_MACHINE]->(machine)
-        RETURN
-            problem.text AS text,
-            score,
-            collect(DISTINCT cause.text) AS causes,
-            collect(DISTINCT action.text) AS actions,
-            collect(DISTINCT machine.model) AS machines
+        with metrics.span("query.encode"):
+            # Same normalization as the indexed texts, so "Coolent" matches "coolant"
+            user_vector = model.encode(normalize_text(user_input), convert_to_numpy=True).tolist()
 
+        with metrics.span("query.vector_search"):
+            if retriever is not None:
+                hits = retriever.search(user_vector, top_k)
+                records = fetch_problem_context(driver, hits) if hits else []
+            else:
+                with driver.session() as session:
+                    results = session.run(SIMILAR_PROBLEM_QUERY, embedding=user_vector, top_k=top_k)
+                    records = [record.data() for record in results]
 
-        """
-        with driver.session() as session:
-            results = session.run(cypher, embedding=user_vector, top_k=top_k)
-            records = [record.data() for record in results]
-            
 
         if not records:
             logger.warning("No matching problem found.")
             return "No matching problem found for the given input."
 
-        for r in records:
-            if r is not None:
-                problem_context = f"""
-                Closest Problem:
-                Problem: {r.get("text", "Not available")} (score: {r.get("score", 0):.3f})
-                Causes: {r.get("causes", "Not available")}
-                Corrective Actions: {r.get("actions", "Not available")}
-                Machines: {r.get("machines", "Not available")}
-                """
-                print(problem_context)
-                return problem_context
-            
-            else:
-                print("No matching problem found for the given text.")
-                
-        logger.info("Successfully retrieved problem context.")
-        
-        #return problem_context
-    
+        problem_context, report = assemble_context(records)
+        if stats is not None:
+            stats.update(report)
+        logger.info(
+            f"Successfully retrieved problem context: {report['hits']} hits in {report['tokens']} tokens "
+            f"({report['tokens_saved']} tokens saved)."
+        )
+        return problem_context
 
     except Exception as e:
         logger.error(f"Error while finding similar problem: {e}")
         return f"Error occurred while processing the input: {str(e)}"
 
-def get_llm_diagnosis(user_input: str, problem_context: str, api_key: str, model_name: str = "llama3-70b-8192") -> str:
+@metrics.timed("query.llm_diagnosis")
+def get_llm_diagnosis(user_input: str, problem_context: str, api_key: str, model_name: str = "llama3-70b-8192",
+                      use_cache: bool = USE_RESPONSE_CACHE) -> str:
     """
     Sends the user input and graph context to the Groq LLM for a diagnosis and recommendation.
+
+    Successful answers are cached per (normalized question, model, context); a
+    reworded question with the same context is served from the cache.
     """
     try:
-        prompt = f"""Given the following service case details from a manufacturing knowledge graph, provide a professional explanation of the problem and suggest further checks or steps if needed.
-                    User Input: {user_input}
-                    Problem Context: {problem_context}
-                    """
-
-        data = {
-            "model": model_name,
-            "messages": [
-                {"role": "system", "content": "You are a technical expert in mechanical systems and industrial service operations."},
-                {"role": "user", "content": prompt}
-            ]
-        }
-
-        response = requests.post(
-            "https://api.groq.com/openai/v1/chat/completions",
-            headers={
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json"
-            },
-            json=data
-        )
+        if use_cache:
+            cache = get_response_cache()
+            query_embedding = embed_query(user_input)
+            cached = cache.get(user_input, model_name, problem_context, embedding=query_embedding)
+            if cached is not None:
+                return cached
 
-        if response.status_code == 200:
-            reply = response.json()["choices"][0]["message"]["content"]
-            logger.info("LLM response received successfully.")
-            return reply
-        else:
-            logger.error(f"LLM API error {response.status_code}: {response.text}")
-            return f"Error {response.status_code}: {response.text}"
+        # Rate limits, retries, timeouts and the circuit breaker live in the shared client
+        data = build_diagnosis_request(user_input, problem_context, model_name)
+        reply = get_llm_client().chat(data, api_key=api_key)
+        logger.info("LLM response received successfully.")
+        if use_cache:
+            cache.put(user_input, model_name, reply, problem_context, embedding=query_embedding)
+        return reply
 
     except Exception as e:
         logger.error(f"Exception while communicating with LLM API: {e}")
         return f"Error occurred while contacting LLM: {str(e)}"
 
+
+def stream_llm_diagnosis(user_input: str, problem_context: str, api_key: str, model_name: str = "llama3-70b-8192",
+                         use_cache: bool = USE_RESPONSE_CACHE, stats: dict = None):
+    """
+    Streaming variant of get_llm_diagnosis: consumes the OpenAI-compatible SSE
+    stream and yields text deltas as they arrive (e.g. for st.write_stream).
+
+    Args:
+        stats (dict): Optional dict filled with ttft_seconds, total_seconds,
+            tokens and tokens_per_sec once the stream ends.
+
+    Yields:
+        str: Pieces of the reply; a cached reply is yielded in one piece.
+    """
+    stats = stats if stats is not None else {}
+    start = time.perf_counter()
+    first = None
+    tokens = 0
+    usage_tokens = None
+    parts = []
+
+    try:
+        if use_cache:
+            cache = get_response_cache()
+            query_embedding = embed_query(user_input)
+            cached = cache.get(user_input, model_name, problem_context, embedding=query_embedding)
+            if cached is not None:
+                stats.update(ttft_seconds=time.perf_counter() - start, cached=True)
+                yield cached
+                return
+
+        data = build_diagnosis_request(user_input, problem_context, model_name)
+
+        with get_llm_client().open_stream(data, api_key=api_key) as response:
+            # SSE is UTF-8 by spec; without a charset requests would assume ISO-8859-1
+            response.encoding = "utf-8"
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                payload = line[len("data:"):].strip()
+                if payload == "[DONE]":
+                    break
+                chunk = json.loads(payload)
+                # Groq reports usage on the last chunk under x_groq
+                usage = chunk.get("usage") or (chunk.get("x_groq") or {}).get("usage")
+                if usage:
+                    usage_tokens = usage.get("completion_tokens")
+                for choice in chunk.get("choices", []):
+                    delta = (choice.get("delta") or {}).get("content")
+                    if delta:
+                        if first is None:
+                            first = time.perf_counter()
+                        tokens += 1
+                        parts.append(delta)
+                        yield delta
+
+        total = time.perf_counter() - start
+        tokens = usage_tokens or tokens
+        generation = total - (first - start) if first is not None else 0.0
+        stats.update(
+            ttft_seconds=(first - start) if first is not None else None,
+            total_seconds=total,
+            tokens=tokens,
+            tokens_per_sec=tokens / generation if generation > 0 else 0.0,
+            cached=False
+        )
+        if stats["ttft_seconds"] is not None:
+            metrics.observe("llm_ttft_seconds", stats["ttft_seconds"])
+        metrics.observe("llm_stream_seconds", total)
+        metrics.inc("llm_tokens_total", tokens, kind="completion")
+        logger.info(
+            f"LLM stream finished: TTFT {stats['ttft_seconds'] or 0:.3f}s, "
+            f"{tokens} tokens in {total:.2f}s ({stats['tokens_per_sec']:.1f} tokens/s)"
+        )
+        if use_cache and parts:
+            cache.put(user_input, model_name, "".join(parts), problem_context, embedding=query_embedding)
+
+    except Exception as e:
+        logger.error(f"Exception while streaming from LLM API: {e}")
+        yield f"Error occurred while contacting LLM: {str(e)}"
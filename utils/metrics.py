@@ -0,0 +1,244 @@
+# metrics.py
+#
+# In-process counters, latency histograms and timing spans.
+#
+#   from utils import metrics
+#
+#   with metrics.span("neo4j.load"):
+#       ...
+#   metrics.inc("rows_total", len(df), stage="neo4j.load")
+#
+#   @metrics.timed("query.vector_search")
+#   def find_similar_problem(...): ...
+#
+# Disabled by default; every call then returns after one flag check. Enable with
+# METRICS_ENABLED=1 (or metrics.enable()); METRICS_EXPORT_PATH writes a snapshot
+# at exit, in Prometheus text format for *.prom files and JSON otherwise.
+
+import atexit
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+from utils.logger_config import get_logger
+
+logger = get_logger(name=__name__, log_file="main.log")
+
+# === CONFIG ===
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "0").lower() in ("1", "true", "yes")
+METRICS_EXPORT_PATH = os.getenv("METRICS_EXPORT_PATH", "")
+METRIC_PREFIX = "graphrag_"
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+_enabled = METRICS_ENABLED
+_lock = threading.Lock()
+_counters = {}     # (name, labels) -> value
+_histograms = {}   # (name, labels) -> [bucket counts..., +Inf count, sum]
+
+
+def enable(flag: bool = True):
+    """Turns collection on or off at runtime."""
+    global _enabled
+    _enabled = flag
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def _key(name: str, labels: dict):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name: str, value: float = 1, **labels):
+    """Adds `value` to the counter `name` with the given labels."""
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name: str, value: float, **labels):
+    """Records one sample (seconds for latencies) in the histogram `name`."""
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        state = _histograms.get(key)
+        if state is None:
+            state = _histograms[key] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0]
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                state[i] += 1
+                break
+        else:
+            state[len(LATENCY_BUCKETS)] += 1
+        state[-1] += value
+
+
+class _Span:
+    __slots__ = ("labels", "start")
+
+    def __init__(self, labels: dict):
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        observe("span_seconds", time.perf_counter() - self.start, **self.labels)
+        if exc_type is not None:
+            inc("span_errors_total", **self.labels)
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+def span(name: str, **labels):
+    """
+    Context manager timing a block into the `span_seconds` histogram, labelled
+    span=<name>; exceptions also count in `span_errors_total`.
+    """
+    if not _enabled:
+        return _NOOP
+    return _Span({"span": name, **labels})
+
+
+def timed(name: str = None):
+    """
+    Decorator timing every call of a function (sync or async) as a span. The
+    span name defaults to <module>.<qualname>.
+    """
+    def decorate(fn):
+        span_name = name or f"{fn.__module__}.{fn.__qualname__}"
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                if not _enabled:
+                    return await fn(*args, **kwargs)
+                with _Span({"span": span_name}):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with _Span({"span": span_name}):
+                return fn(*args, **kwargs)
+        return wrapper
+
+    return decorate
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def snapshot() -> dict:
+    """
+    Current values as plain data.
+
+    Returns:
+        dict: {"counters": [{name, labels, value}], "histograms": [{name, labels,
+            count, sum, buckets: {upper bound: cumulative count}}]}.
+    """
+    with _lock:
+        counters = list(_counters.items())
+        histograms = [(key, list(state)) for key, state in _histograms.items()]
+    result = {"counters": [], "histograms": []}
+    for (name, labels), value in sorted(counters):
+        result["counters"].append({"name": name, "labels": dict(labels), "value": value})
+    for (name, labels), state in sorted(histograms):
+        cumulative, buckets = 0, {}
+        for bound, n in zip(list(LATENCY_BUCKETS) + ["+Inf"], state[:-1]):
+            cumulative += n
+            buckets[str(bound)] = cumulative
+        result["histograms"].append({
+            "name": name, "labels": dict(labels), "count": cumulative, "sum": state[-1], "buckets": buckets,
+        })
+    return result
+
+
+def _labels(labels: dict, **extra) -> str:
+    items = {**labels, **extra}
+    if not items:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in items.values())
+    return "{" + ",".join(f'{k}="{v}"' for k, v in zip(items, escaped)) + "}"
+
+
+def to_prometheus() -> str:
+    """Renders the current values in the Prometheus text exposition format."""
+    data = snapshot()
+    lines, typed = [], set()
+    for c in data["counters"]:
+        name = METRIC_PREFIX + c["name"]
+        if name not in typed:
+            lines.append(f"# TYPE {name} counter")
+            typed.add(name)
+        lines.append(f"{name}{_labels(c['labels'])} {c['value']}")
+    for h in data["histograms"]:
+        name = METRIC_PREFIX + h["name"]
+        if name not in typed:
+            lines.append(f"# TYPE {name} histogram")
+            typed.add(name)
+        for bound, count in h["buckets"].items():
+            lines.append(f"{name}_bucket{_labels(h['labels'], le=bound)} {count}")
+        lines.append(f"{name}_sum{_labels(h['labels'])} {h['sum']}")
+        lines.append(f"{name}_count{_labels(h['labels'])} {h['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def export(path: str = None) -> str:
+    """
+    Writes a snapshot to `path` (default METRICS_EXPORT_PATH): Prometheus text
+    for *.prom files, JSON otherwise. The file is replaced atomically, so a
+    node_exporter textfile collector never reads a partial file.
+
+    Returns:
+        str or None: The path written.
+    """
+    path = path or METRICS_EXPORT_PATH
+    if not path:
+        return None
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        if path.endswith(".prom"):
+            f.write(to_prometheus())
+        else:
+            json.dump({"exported_at": time.time(), **snapshot()}, f, indent=2)
+    os.replace(tmp, path)
+    logger.info(f"Exported metrics to {path}")
+    return path
+
+
+def _export_at_exit():
+    if _enabled and METRICS_EXPORT_PATH:
+        try:
+            export()
+        except Exception as e:
+            logger.error(f"Metrics export failed: {e}")
+
+
+atexit.register(_export_at_exit)
@@ -0,0 +1,81 @@
+# model_registry.py
+
+import os
+import threading
+from utils.logger_config import get_logger
+
+logger = get_logger(name=__name__, log_file="main.log")
+
+# === CONFIG ===
+MODEL_NAME = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+
+_resources = {}
+_locks = {}
+_registry_lock = threading.Lock()
+
+
+def get_resource(name: str, factory):
+    """
+    Returns the process-wide instance of a heavy resource, creating it on first use.
+
+    The factory runs exactly once per name even when several threads ask at the
+    same time; later callers get the cached object. A factory returning None
+    (e.g. a failed connection) is not cached, so the next call retries.
+
+    Args:
+        name (str): Registry key, e.g. "model:all-MiniLM-L6-v2" or "neo4j".
+        factory (callable): Zero-argument function building the resource.
+
+    Returns:
+        The cached resource.
+    """
+    if name in _resources:
+        return _resources[name]
+    with _registry_lock:
+        lock = _locks.setdefault(name, threading.Lock())
+    with lock:
+        if name not in _resources:
+            logger.info(f"Loading resource '{name}'...")
+            resource = factory()
+            if resource is None:
+                return None
+            _resources[name] = resource
+            logger.info(f"Resource '{name}' ready.")
+    return _resources[name]
+
+
+def get_model(name: str = MODEL_NAME):
+    """
+    Returns the shared SentenceTransformer for `name`, importing and loading it lazily.
+    """
+    def load():
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(name)
+
+    return get_resource(f"model:{name}", load)
+
+
+def warmup(name: str = MODEL_NAME):
+    """
+    Loads the model and runs one encode in a background thread, so the first real
+    query does not pay for model loading. Does nothing if the model is loaded.
+
+    Returns:
+        threading.Thread or None: The started daemon thread.
+    """
+    if is_loaded(f"model:{name}"):
+        return None
+
+    def run():
+        try:
+            get_model(name).encode(["warmup"], convert_to_numpy=True)
+        except Exception as e:
+            logger.error(f"Model warm-up failed: {e}")
+
+    thread = threading.Thread(target=run, name=f"warmup-{name}", daemon=True)
+    thread.start()
+    return thread
+
+
+def is_loaded(name: str) -> bool:
+    return name in _resources
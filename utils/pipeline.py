@@ -0,0 +1,391 @@
+# pipeline.py
+#
+# Small DAG runner for the ingestion pipeline.
+#
+#   pipeline = Pipeline("ingest")
+#
+#   @pipeline.stage(outputs=["source_table"], params={"csv": file_signature(CSV_PATH)})
+#   def upload(): ...
+#
+#   @pipeline.stage(inputs=["source_table", "driver"], outputs=["refresh"])
+#   def graph_load(source_table, driver): ...
+#
+#   artifacts = pipeline.run(resources={"driver": driver})
+#
+# A stage runs as soon as the stages producing its inputs are done, in a thread
+# pool or (executor="process") a process pool. Finished stages are checkpointed;
+# a rerun skips every stage whose code, params and upstream stages are unchanged
+# and resumes from the first failed or changed one.
+
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from multiprocessing import get_context
+
+from utils.logger_config import get_logger
+from utils import metrics
+
+logger = get_logger(name=__name__, log_file="main.log")
+
+# === CONFIG ===
+PIPELINE_CHECKPOINT_DIR = os.getenv("PIPELINE_CHECKPOINT_DIR", "data/pipeline_checkpoints")
+PIPELINE_THREADS = 6
+PIPELINE_PROCESSES = 2
+
+
+class PipelineError(RuntimeError):
+    """Raised when a stage fails; carries the run report."""
+
+    def __init__(self, message: str, report: dict):
+        super().__init__(message)
+        self.report = report
+
+
+def file_signature(path: str) -> str:
+    """Size and modification time of a file, for stage params that depend on it."""
+    try:
+        stat = os.stat(path)
+        return f"{stat.st_size}:{stat.st_mtime_ns}"
+    except OSError:
+        return "missing"
+
+
+class Stage:
+    """
+    One pipeline step.
+
+    Args:
+        name (str): Unique stage name.
+        fn (callable): Called with its inputs as keyword arguments. Returns a dict
+            of outputs, a single value when the stage declares one output, or None.
+        inputs (list[str]): Artifacts produced by other stages or passed as resources.
+        outputs (list[str]): Artifacts this stage produces.
+        executor (str): "thread" or "process". Process stages must be top-level
+            functions with picklable inputs and outputs.
+        params (dict): Values the result depends on besides the inputs (config,
+            file signatures); a change reruns the stage.
+        checkpoint (bool): Persist the outputs so reruns can skip the stage.
+    """
+
+    def __init__(self, name: str, fn, inputs=(), outputs=(), executor: str = "thread",
+                 params: dict = None, checkpoint: bool = True):
+        if executor not in ("thread", "process"):
+            raise ValueError(f"Unknown executor '{executor}' for stage '{name}'")
+        self.name = name
+        self.fn = fn
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.executor = executor
+        self.params = params or {}
+        self.checkpoint = checkpoint
+
+    def code_hash(self) -> str:
+        fn = getattr(self.fn, "func", self.fn)   # functools.partial
+        try:
+            source = inspect.getsource(fn)
+        except (OSError, TypeError):
+            source = getattr(fn, "__qualname__", type(fn).__name__)
+        return hashlib.sha256(source.encode("utf-8")).hexdigest()
+
+
+def _call_stage(fn, kwargs: dict):
+    start = time.perf_counter()
+    result = fn(**kwargs)
+    return result, time.perf_counter() - start
+
+
+class Pipeline:
+    """
+    Runs stages in dependency order, concurrently where the DAG allows, with
+    per-stage checkpoints under `checkpoint_dir/<pipeline name>`.
+    """
+
+    def __init__(self, name: str, checkpoint_dir: str = PIPELINE_CHECKPOINT_DIR,
+                 threads: int = PIPELINE_THREADS, processes: int = PIPELINE_PROCESSES):
+        self.name = name
+        self.checkpoint_dir = os.path.join(checkpoint_dir, name)
+        self.threads = threads
+        self.processes = processes
+        self.stages = {}
+
+    def add(self, stage: Stage) -> Stage:
+        if stage.name in self.stages:
+            raise ValueError(f"Duplicate stage '{stage.name}'")
+        producers = self._producers()
+        for output in stage.outputs:
+            if output in producers:
+                raise ValueError(f"'{output}' is produced by both '{producers[output]}' and '{stage.name}'")
+        self.stages[stage.name] = stage
+        return stage
+
+    def stage(self, name: str = None, inputs=(), outputs=(), executor: str = "thread",
+              params: dict = None, checkpoint: bool = True):
+        """Decorator form of `add`; the stage name defaults to the function name."""
+        def decorate(fn):
+            self.add(Stage(name or fn.__name__, fn, inputs, outputs, executor, params, checkpoint))
+            return fn
+        return decorate
+
+    # --- graph ---
+
+    def _producers(self) -> dict:
+        return {output: s.name for s in self.stages.values() for output in s.outputs}
+
+    def dependencies(self, resources=()) -> dict:
+        """Stage name -> names of the stages producing its inputs."""
+        producers = self._producers()
+        deps = {}
+        for stage in self.stages.values():
+            missing = [i for i in stage.inputs if i not in producers and i not in resources]
+            if missing:
+                raise ValueError(f"Stage '{stage.name}' needs {missing}, which no stage or resource provides")
+            deps[stage.name] = sorted({producers[i] for i in stage.inputs if i in producers})
+        return deps
+
+    def _topological(self, deps: dict) -> list:
+        order, state = [], {}
+
+        def visit(name, path):
+            if state.get(name) == "done":
+                return
+            if state.get(name) == "visiting":
+                raise ValueError(f"Cycle in pipeline: {' -> '.join(path + [name])}")
+            state[name] = "visiting"
+            for dep in deps[name]:
+                visit(dep, path + [name])
+            state[name] = "done"
+            order.append(name)
+
+        for name in self.stages:
+            visit(name, [])
+        return order
+
+    def _fingerprints(self, order: list, deps: dict) -> dict:
+        fingerprints = {}
+        for name in order:
+            stage = self.stages[name]
+            payload = json.dumps({
+                "code": stage.code_hash(),
+                "params": stage.params,
+                "inputs": stage.inputs,
+                "outputs": stage.outputs,
+                "upstream": [fingerprints[d] for d in deps[name]],
+            }, sort_keys=True, default=str)
+            fingerprints[name] = hashlib.sha256(payload.encode("utf-8")).hexdigest()
+        return fingerprints
+
+    # --- checkpoints ---
+
+    def _checkpoint_path(self, name: str) -> str:
+        return os.path.join(self.checkpoint_dir, f"{name}.pkl")
+
+    def _load_checkpoint(self, name: str, fingerprint: str):
+        try:
+            with open(self._checkpoint_path(name), "rb") as f:
+                saved = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            return None
+        return saved["outputs"] if saved.get("fingerprint") == fingerprint else None
+
+    def _save_checkpoint(self, name: str, fingerprint: str, outputs: dict, seconds: float):
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        path = self._checkpoint_path(name)
+        try:
+            data = pickle.dumps({"fingerprint": fingerprint, "outputs": outputs, "seconds": seconds,
+                                 "finished_at": time.time()})
+        except Exception as e:
+            logger.warning(f"Stage '{name}' outputs are not picklable, not checkpointed: {e}")
+            return
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+
+    def _drop_checkpoint(self, name: str):
+        try:
+            os.remove(self._checkpoint_path(name))
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        """Removes every checkpoint of this pipeline, forcing a full rerun."""
+        for name in self.stages:
+            self._drop_checkpoint(name)
+
+    # --- run ---
+
+    def _outputs(self, stage: Stage, result) -> dict:
+        if not stage.outputs:
+            return {}
+        if len(stage.outputs) == 1 and not (isinstance(result, dict) and stage.outputs[0] in result):
+            return {stage.outputs[0]: result}
+        missing = [o for o in stage.outputs if o not in (result or {})]
+        if missing:
+            raise ValueError(f"Stage '{stage.name}' did not return {missing}")
+        return {o: result[o] for o in stage.outputs}
+
+    def run(self, resources: dict = None, resume: bool = True, force=()) -> dict:
+        """
+        Runs the pipeline.
+
+        Args:
+            resources (dict): Artifacts supplied by the caller, e.g. open drivers.
+                They are never checkpointed or fingerprinted.
+            resume (bool): Skip stages whose checkpoint is still valid.
+            force (iterable): Stage names to rerun regardless of checkpoints;
+                everything downstream reruns as well.
+
+        Returns:
+            dict: All artifacts, plus "_report" with per-stage timings and the
+                critical path.
+
+        Raises:
+            PipelineError: When a stage fails. Stages already running finish and
+                are checkpointed; stages depending on the failed one do not run.
+        """
+        resources = dict(resources or {})
+        deps = self.dependencies(resources)
+        order = self._topological(deps)
+        fingerprints = self._fingerprints(order, deps)
+        force = set(force)
+
+        artifacts = dict(resources)
+        status, timings = {}, {}
+        ran = set()
+        failure = None
+        start = time.perf_counter()
+
+        thread_pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix=f"{self.name}-stage")
+        process_pool = None
+        running = {}
+        try:
+            while True:
+                for name in order:
+                    if name in status or name in running.values():
+                        continue
+                    if any(status.get(d) in ("failed", "blocked") for d in deps[name]):
+                        status[name] = "blocked"
+                        continue
+                    if failure or not all(status.get(d) in ("done", "cached") for d in deps[name]):
+                        continue
+                    stage = self.stages[name]
+
+                    cached = None
+                    if (resume and stage.checkpoint and name not in force
+                            and not any(d in ran for d in deps[name])):
+                        cached = self._load_checkpoint(name, fingerprints[name])
+                    if cached is not None:
+                        artifacts.update(cached)
+                        status[name] = "cached"
+                        now = time.perf_counter() - start
+                        timings[name] = (now, now)
+                        logger.info(f"Stage '{name}' unchanged, reusing checkpoint.")
+                        continue
+
+                    self._drop_checkpoint(name)
+                    kwargs = {i: artifacts[i] for i in stage.inputs}
+                    if stage.executor == "process":
+                        if process_pool is None:
+                            process_pool = ProcessPoolExecutor(max_workers=self.processes,
+                                                               mp_context=get_context("spawn"))
+                        future = process_pool.submit(_call_stage, stage.fn, kwargs)
+                    else:
+                        future = thread_pool.submit(_call_stage, stage.fn, kwargs)
+                    running[future] = name
+                    timings[name] = (time.perf_counter() - start, None)
+                    logger.info(f"Stage '{name}' started.")
+
+                if not running:
+                    break
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    stage = self.stages[name]
+                    timings[name] = (timings[name][0], time.perf_counter() - start)
+                    try:
+                        result, seconds = future.result()
+                        outputs = self._outputs(stage, result)
+                    except Exception as e:
+                        status[name] = "failed"
+                        failure = failure or (name, e)
+                        metrics.inc("pipeline_stages_total", status="failed")
+                        logger.error(f"Stage '{name}' failed: {e}")
+                        continue
+                    artifacts.update(outputs)
+                    status[name] = "done"
+                    ran.add(name)
+                    metrics.inc("pipeline_stages_total", status="done")
+                    metrics.observe("pipeline_stage_seconds", seconds, stage=name)
+                    if stage.checkpoint:
+                        self._save_checkpoint(name, fingerprints[name], outputs, seconds)
+                    logger.info(f"Stage '{name}' finished in {seconds:.2f}s.")
+        finally:
+            thread_pool.shutdown(wait=True)
+            if process_pool is not None:
+                process_pool.shutdown(wait=True)
+
+        for name in order:
+            # Not started because another stage failed first
+            status.setdefault(name, "skipped")
+        report = self._report(order, deps, status, timings, time.perf_counter() - start)
+        logger.info("Pipeline report:\n" + format_report(report))
+        if failure:
+            name, error = failure
+            raise PipelineError(f"Stage '{name}' failed: {error}", report) from error
+        artifacts["_report"] = report
+        return artifacts
+
+    def _report(self, order: list, deps: dict, status: dict, timings: dict, wall: float) -> dict:
+        durations = {}
+        stages = []
+        for name in order:
+            begin, end = timings.get(name, (None, None))
+            durations[name] = (end - begin) if begin is not None and end is not None else 0.0
+            stages.append({"stage": name, "status": status[name], "start": begin, "seconds": durations[name],
+                           "executor": self.stages[name].executor})
+
+        # Longest chain of dependent stages by duration: the run cannot be shorter
+        finish, previous = {}, {}
+        for name in order:
+            best = max(deps[name], key=lambda d: finish[d], default=None)
+            finish[name] = durations[name] + (finish[best] if best else 0.0)
+            previous[name] = best
+        path = []
+        node = max(order, key=lambda n: finish[n], default=None)
+        while node:
+            path.append(node)
+            node = previous[node]
+        path.reverse()
+        critical = set(path)
+        for row in stages:
+            row["critical"] = row["stage"] in critical
+
+        serial = sum(durations.values())
+        return {
+            "pipeline": self.name,
+            "wall_seconds": wall,
+            "serial_seconds": serial,
+            "critical_path": path,
+            "critical_path_seconds": sum(durations[n] for n in path),
+            "parallel_speedup": serial / wall if wall > 0 else 0.0,
+            "stages": stages,
+        }
+
+
+def format_report(report: dict) -> str:
+    """Renders a run report as a fixed-width table followed by the critical path."""
+    width = max([len(r["stage"]) for r in report["stages"]] + [5])
+    lines = [f"{'stage':<{width}}  {'status':<8} {'start':>8} {'seconds':>9}  critical"]
+    for r in report["stages"]:
+        begin = f"{r['start']:.2f}" if r["start"] is not None else "-"
+        lines.append(f"{r['stage']:<{width}}  {r['status']:<8} {begin:>8} {r['seconds']:>9.2f}  "
+                     f"{'*' if r['critical'] else ''}")
+    lines.append(
+        f"wall {report['wall_seconds']:.2f}s, serial {report['serial_seconds']:.2f}s "
+        f"(speedup {report['parallel_speedup']:.2f}x), critical path "
+        f"{report['critical_path_seconds']:.2f}s: {' -> '.join(report['critical_path'])}"
+    )
+    return "\n".join(lines)